@@ -0,0 +1,232 @@
+import sys
+sys.dont_write_bytecode = True
+
+import argparse, glob, io, json, os, platform, subprocess, tempfile, time, tracemalloc
+from contextlib import redirect_stdout
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+
+# Local deps
+from gazelle import cache, repl
+from gazelle.atomizer import Atomizer
+from gazelle.env import Environment
+from gazelle.parseval import expand, global_env, load
+
+### Benchmarks
+# Each of the programs in this directory, along with the Project Euler
+# examples, is run by each evaluator asked for. The program is loaded
+# (and expanded) once up front, and each run evaluates it in a new
+# environment, so these measure the evaluators and nothing else.
+#
+# The `parse/` benchmarks measure the front end on its own: the standard
+# library, and a large program made of many copies of the ones here.
+#
+# The `startup/` benchmarks run `gazelle.py` on a short program that uses
+# the standard library, starting cold (calling `(stdlib)` itself) and
+# from an image with the standard library already in it (see `image.py`).
+# They time the whole process, and their memory is the runner's own.
+#
+# Every benchmark is run once to warm up and then `--repeat` times,
+# reporting the fastest and average time and how many runs a second
+# that average comes to. Then it's run once more while `tracemalloc`
+# watches, for the most memory it had allocated at once. Results are
+# written as JSON, which `--compare` can check a later run against.
+#
+#   python benchmarks/run.py -e tree -e vm --output before.json
+#   python benchmarks/run.py -e tree -e vm --compare before.json
+#   python benchmarks/run.py --compare before.json after.json
+#
+# Comparing exits with 1 if any benchmark got slower (or used more
+# memory) than the thresholds allow.
+
+# Name -> path of each program
+programs = dict(
+  [(os.path.splitext(os.path.basename(path))[0], path)
+    for path in sorted(glob.glob(os.path.join(HERE, '*.gel')))] +
+  [('euler-' + os.path.splitext(os.path.basename(path))[0], path)
+    for path in sorted(glob.glob(os.path.join(ROOT, 'example', 'euler', '*.gel')))])
+
+# String -> Procedure
+def parser_for(source):
+  ''' A benchmark that atomizes and expands source. '''
+
+  return lambda: expand(Atomizer(io.StringIO(source)).read(), toplevel=True)
+
+# None -> {String: Procedure}
+def parse_benchmarks():
+  ''' The front end benchmarks, by name. '''
+
+  with open(os.path.join(ROOT, 'lib', 'stdlib.gel')) as f:
+    stdlib = f.read()
+
+  sources = []
+  for name in ('fib', 'tak', 'nqueens', 'collatz'):
+    with open(programs[name]) as f:
+      sources.append(f.read())
+
+  return {
+    'parse/stdlib': parser_for(stdlib),
+    'parse/large':  parser_for('(begin ' + '\n'.join(sources * 200) + ')'),
+  }
+
+# String -> {String: Procedure}
+def startup_benchmarks(directory):
+  ''' The startup benchmarks by name, keeping their files
+  in directory. '''
+
+  script = os.path.join(ROOT, 'gazelle.py')
+  program = '(display (foldl + 0 (map (\\ (x) (* x x)) (range 100))))'
+  files = {
+    'cold':  ('(begin (stdlib) %s)' % program, []),
+    'image': (program, ['--image', os.path.join(directory, 'stdlib.img')]),
+  }
+
+  subprocess.check_call([sys.executable, script, '--make-image', files['image'][1][1]], cwd=ROOT)
+
+  benchmarks = {}
+  for name, (source, options) in files.items():
+    path = os.path.join(directory, name + '.gel')
+    with open(path, 'w') as f:
+      f.write(source)
+    command = [sys.executable, script] + options + [path]
+    benchmarks['startup/' + name] = lambda command=command: \
+      subprocess.check_call(command, cwd=ROOT, stdout=subprocess.DEVNULL)
+  return benchmarks
+
+# String, String -> Procedure
+def runner_for(path, engine):
+  ''' A benchmark that evaluates the program at path with engine. '''
+
+  evaluate, program = repl.engines[engine], load(path)
+  return lambda: evaluate(program, Environment(outer=global_env))
+
+# Procedure, Integer -> Dict
+def measure(benchmark, repeat):
+  ''' Time benchmark and find its peak memory. Anything it prints
+  is thrown away. '''
+
+  with redirect_stdout(io.StringIO()):
+    benchmark()
+
+    times = []
+    for _ in range(repeat):
+      start = time.perf_counter()
+      benchmark()
+      times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+      benchmark()
+      peak = tracemalloc.get_traced_memory()[1]
+    finally:
+      tracemalloc.stop()
+
+  mean = sum(times) / len(times)
+  return {
+    'time':        min(times),
+    'mean':        mean,
+    'ops_per_sec': 1 / mean if mean else float('inf'),
+    'peak_memory': peak,
+  }
+
+# [String], Integer, (String) -> Dict
+def run(engines, repeat, only=None):
+  ''' Run every benchmark whose name contains `only`. '''
+
+  benchmarks = {}
+  for engine in engines:
+    for name, path in programs.items():
+      benchmarks[engine + '/' + name] = lambda path=path, engine=engine: runner_for(path, engine)
+  for name, benchmark in parse_benchmarks().items():
+    benchmarks[name] = lambda benchmark=benchmark: benchmark
+
+  results = {}
+  with tempfile.TemporaryDirectory() as directory:
+    if not only or only in 'startup/cold' or only in 'startup/image':
+      for name, benchmark in startup_benchmarks(directory).items():
+        benchmarks[name] = lambda benchmark=benchmark: benchmark
+
+    for name, make in benchmarks.items():
+      if only and only not in name:
+        continue
+      results[name] = result = measure(make(), repeat)
+      print('%-24s %10.6fs %10.1f/s %10.1fKB' % (name, result['time'],
+        result['ops_per_sec'], result['peak_memory'] / 1024), file=sys.stderr)
+
+  return {
+    'python':     platform.python_version(),
+    'platform':   platform.platform(),
+    'repeat':     repeat,
+    'benchmarks': results,
+  }
+
+# Dict, Dict, Float, Float -> [String]
+def compare(old, new, threshold, memory_threshold):
+  ''' Print how each benchmark in both runs changed, returning
+  the names of the ones that regressed. '''
+
+  regressions = []
+  old, new = old['benchmarks'], new['benchmarks']
+  for name in sorted(set(old) & set(new)):
+    speed = new[name]['time'] / old[name]['time'] if old[name]['time'] else 1.0
+    memory = new[name]['peak_memory'] / old[name]['peak_memory'] if old[name]['peak_memory'] else 1.0
+
+    slower, bigger = speed > 1 + threshold, memory > 1 + memory_threshold
+    if slower or bigger:
+      regressions.append(name)
+
+    print('%-24s time %6.2fx%s  memory %6.2fx%s' % (name,
+      speed, ' !' if slower else '  ', memory, ' !' if bigger else ''), file=sys.stderr)
+
+  return regressions
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(prog='benchmarks/run.py',
+    description='Run the gazelle benchmarks, or compare two runs of them.')
+  parser.add_argument('-e', '--engine', action='append', choices=sorted(repl.engines),
+    help='evaluator to run the programs with; can be given more than once (default: tree)')
+  parser.add_argument('-k', metavar='NAME', dest='only',
+    help='only run benchmarks whose name contains NAME')
+  parser.add_argument('-r', '--repeat', type=int, default=5,
+    help='how many timed runs of each benchmark (default: 5)')
+  parser.add_argument('-o', '--output', metavar='FILE',
+    help='write the results to FILE instead of stdout')
+  parser.add_argument('--compare', nargs='+', metavar='FILE',
+    help='compare against the results in FILE; given two files, compare them without running anything')
+  parser.add_argument('--threshold', type=float, default=0.10,
+    help='how much slower a benchmark can get before it counts as a regression (default: 0.10)')
+  parser.add_argument('--memory-threshold', type=float, default=0.25,
+    help='how much more memory a benchmark can use before it counts as a regression (default: 0.25)')
+  args = parser.parse_args()
+
+  if args.compare and len(args.compare) > 2:
+    parser.error('--compare takes one or two files')
+
+  # The front end should be measured, not the cache
+  cache.enabled = False
+
+  if args.compare and len(args.compare) == 2:
+    with open(args.compare[0]) as f:
+      old = json.load(f)
+    with open(args.compare[1]) as f:
+      new = json.load(f)
+  else:
+    new = run(args.engine or ['tree'], args.repeat, args.only)
+    if args.output:
+      with open(args.output, 'w') as f:
+        json.dump(new, f, indent=2)
+    else:
+      print(json.dumps(new, indent=2))
+
+    old = None
+    if args.compare:
+      with open(args.compare[0]) as f:
+        old = json.load(f)
+
+  if old is not None:
+    regressions = compare(old, new, args.threshold, args.memory_threshold)
+    if regressions:
+      print('regressed: ' + ', '.join(regressions), file=sys.stderr)
+      sys.exit(1)
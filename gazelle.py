@@ -1,8 +1,11 @@
 import sys
 sys.dont_write_bytecode = True
 
+import argparse, os
+
 # Local deps
-from gazelle import repl
+from gazelle import batch, cache, image, optimizer, parseval, repl, transpile
+from gazelle.profiler import Profiler
 
 ### CLI
 # The commandline interface helps determine what action
@@ -10,19 +13,110 @@ from gazelle import repl
 # can either load files, start the REPL, or run the tests.
 
 if __name__ == '__main__':
-  sys.argv.pop(0)
+  parser = argparse.ArgumentParser(prog='gazelle',
+    description='Run gazelle files, or start the REPL if none are given.')
+  parser.add_argument('files', nargs='*',
+    help='gazelle files to evaluate in order')
+  parser.add_argument('-e', '--engine', choices=sorted(repl.engines), default='tree',
+    help='evaluator to run programs with (default: tree)')
+  parser.add_argument('--no-cache', action='store_true',
+    help='expand every file again instead of using cached expansions')
+  parser.add_argument('--no-optimize', action='store_true',
+    help='run programs as they were expanded, without optimizing them')
+  parser.add_argument('--macro-stats', action='store_true',
+    help='print how often each macro was expanded, and how long it took')
+  parser.add_argument('--profile', action='store_true',
+    help='print the time spent in each procedure and builtin (tree engine only)')
+  parser.add_argument('--profile-stacks', metavar='FILE',
+    help='profile, and write collapsed stacks for flame graphs to FILE')
+  parser.add_argument('--image', metavar='FILE',
+    help='start from the global environment and macros saved in FILE')
+  parser.add_argument('--make-image', metavar='FILE',
+    help='run the standard library and the files given, then save an image of them to FILE')
+  parser.add_argument('--emit-py', action='store_true',
+    help='translate each file into a python module next to it instead of running it')
+  parser.add_argument('--batch', action='store_true',
+    help='evaluate what\'s piped into stdin without prompting, stopping at the first error')
+  parser.add_argument('-j', '--jobs', type=int, metavar='N',
+    help='run each file in a fresh process of its own, N at a time')
+  args = parser.parse_args()
+
+  if args.jobs is not None and (args.jobs < 1 or args.profile or args.profile_stacks or args.macro_stats):
+    parser.error('--jobs takes a number of processes, and can\'t be used with --profile or --macro-stats')
+
+  if args.jobs is not None and args.make_image:
+    parser.error('--make-image can\'t be used with --jobs')
+
+  if args.emit_py and (not args.files or args.jobs is not None or args.make_image):
+    parser.error('--emit-py needs files to translate, and can\'t be used with --jobs or --make-image')
+
+  if args.batch and (args.files or args.make_image):
+    parser.error('--batch reads stdin, and can\'t be given files or used with --make-image')
+
+  if (args.profile or args.profile_stacks) and args.engine != 'tree':
+    parser.error('profiling only works with the tree engine')
+
+  cache.enabled = not args.no_cache
+  optimizer.enabled = not args.no_optimize
+  evaluate = repl.engines[args.engine]
+
+  if args.image:
+    image.restore(args.image)
+
+  # Translate files into python modules
+  #  `py gazelle.py --emit-py file1.gel ... fileN.gel`
+  if args.emit_py:
+    for file in args.files:
+      print(transpile.emit(file))
 
   # Evaluate Files
   #  repl will rep all files after the program name such as:
   #  `py gazelle.py file1.gel file2.gel ... fileN.gel`
-  if sys.argv:
-    for file in sys.argv:
-      repl.run_file(file)
+  elif args.files and args.jobs is not None:
+    options = ['-e', args.engine] + (['--no-cache'] if args.no_cache else []) + \
+      (['--no-optimize'] if args.no_optimize else []) + \
+      (['--image', os.path.abspath(args.image)] if args.image else [])
+    results = batch.run_files(args.files, args.jobs, options, os.path.abspath(__file__))
+    sys.exit(1 if any(result.status != 0 for result in results) else 0)
+
+  elif args.files or args.make_image:
+    if args.profile or args.profile_stacks:
+      parseval.profile = Profiler(parseval.global_env)
+
+    if args.make_image:
+      evaluate(parseval.parse('(stdlib)'), parseval.global_env)
+
+    failed = False
+    for file in args.files:
+      failed = not repl.run_file(file, evaluate) or failed
+
+    if parseval.profile is not None:
+      if args.profile:
+        print(parseval.profile.report(), file=sys.stderr)
+      if args.profile_stacks:
+        with open(args.profile_stacks, 'w') as f:
+          f.write(parseval.profile.collapsed())
+
+    if args.macro_stats:
+      for name, stats in parseval.expansion_stats():
+        print('%-20s %8d calls %8d cached %10.6fs' % (name, stats.count, stats.hits, stats.time),
+          file=sys.stderr)
+
+    if failed:
+      sys.exit(1)
+
+    if args.make_image:
+      image.save(args.make_image)
+
+  # Evaluate stdin without a prompt
+  #  `py gazelle.py --batch < program.gel`
+  elif args.batch:
+    sys.exit(0 if repl.run_batch(sys.stdin, evaluate) else 1)
 
   # Start Repl
   #  repl starts under the condition :
   #  `./gazelle.py` or `py gazelle.py` or `python gazelle.py`
   else:
-    repl.run()
-  
-  
+    repl.run(evaluate=evaluate)
+
+
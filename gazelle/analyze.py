@@ -0,0 +1,411 @@
+# Local deps
+from .env import Environment, InlineCache, unbound
+from .gazellestr import gazellestr
+from . import modules
+from .nodes import Const, Ref, If, Set, Def, Lambda, Begin, While, \
+  Primitive, Include, Stdlib, Import, Provide, App
+from .scope import Scope, resolve, scope_at
+from .stdenv import global_env, fast_path
+
+### Analyzer
+# `gazeval()` decides what to do with an expression every time it sees it,
+# walking down a chain of comparisons against the symbol table before it
+# can even apply a procedure. Inside a loop or a recursive procedure that
+# work is repeated on every single iteration even though the expression
+# never changes.
+#
+# The analyzer splits evaluation in two. `analyze()` looks at an expanded
+# expression once and returns a plain python function of an environment,
+# built out of smaller functions for each of its subexpressions. Running
+# the program is then just calling that function, so all of the dispatch
+# happens once up front instead of every time the expression is evaluated.
+#
+# The analyzer also knows where every variable lives (see `scope.py`), so
+# procedures are called with a `Frame` rather than a whole `Environment`
+# and variables are read straight out of it by position.
+
+# A `TailCall` is returned by an application in tail position instead of
+# calling the procedure directly. Whoever is running the body of a
+# procedure bounces it through `trampoline()`, which keeps tail
+# recursion from growing the python stack just like the `while` loop in
+# `gazeval()` does.
+class TailCall(object):
+  __slots__ = ('proc', 'args')
+
+  def __init__(self, proc, args):
+    self.proc, self.args = proc, args
+
+# Like a `Procedure`, a `Closure` is a lambda expression paired with the
+# environment it was created in. The difference is that its body has
+# already been analyzed, so calling it never has to look at the
+# expression again, and `bind` makes the frame for its arguments.
+# The original body is kept around for `gazellestr()`, and the scope of
+# the body so that it can be analyzed again after being pickled.
+class Closure(object):
+  def __init__(self, params, body, code, bind, env, scope=None):
+    self.params, self.body, self.code, self.bind, self.env = \
+      params, body, code, bind, env
+    self.scope = scope
+
+  def __reduce__(self):
+    ''' The analyzed body can't be pickled, so analyze it again
+    instead. The environment comes after, since it might hold the
+    closure itself. '''
+
+    return (reanalyze, (self.params, self.body, self.scope), {'env': self.env})
+
+  def __call__(self, *args):
+    ''' Run the analyzed body in a new frame made from the
+    arguments, the same way a `Procedure` is called. '''
+
+    return trampoline(self.code(self.bind(args, self.env)))
+
+# Symbol or [Symbol], Node, Scope -> Closure
+def reanalyze(params, body, scope):
+  ''' Make a closure without an environment yet, for unpickling. '''
+
+  return Closure(params, body, analyze(body, scope, tail=True), scope.binder(), None, scope)
+
+# Object -> Object
+def trampoline(result):
+  ''' Keep applying tail calls until we are left with a value. '''
+
+  while type(result) is TailCall:
+    proc, args = result.proc, result.args
+    if type(proc) is Closure:
+      result = proc.code(proc.bind(args, proc.env))
+    else:
+      result = proc(*args)
+  return result
+
+# Node, (Scope, Boolean) -> Analyzed Expression
+def analyze(expr, scope=None, tail=False):
+  ''' Turn an expanded gazelle expression into a function that takes an
+  environment and evaluates the expression in it. `scope` describes the
+  procedure the expression is written in, if any. `tail` is true when
+  the expression is the last thing its procedure does, in which case
+  applications hand back a `TailCall` rather than growing the stack. '''
+
+  return analyzers.get(type(expr), analyze_literal)(expr, scope, tail)
+
+### Variables
+# Depending on where a variable was resolved to, reading it is either
+# indexing a frame some number of steps out, or a lookup by name
+# starting from the frame where we can no longer tell.
+
+# Integer -> Procedure
+def outwards(depth):
+  ''' Make a procedure that follows `outer` depth times. '''
+
+  if depth == 0:
+    return lambda env: env
+  elif depth == 1:
+    return lambda env: env.outer
+  elif depth == 2:
+    return lambda env: env.outer.outer
+
+  def walk(env):
+    for _ in range(depth):
+      env = env.outer
+    return env
+  return walk
+
+# Node, Scope, Boolean -> Analyzed Expression
+def analyze_variable(expr, scope, tail):
+  ''' (var) '''
+
+  var = expr.var
+  depth, index = resolve(var, scope)
+
+  # Looked up by name the first time, and read from its cell
+  # after that (see `InlineCache` in `env.py`)
+  if index is None:
+    cache = InlineCache(var)
+
+    if depth == 0:
+      def run(env):
+        if env is cache.env and cache.version == Environment.version:
+          return cache.cell.value
+        return cache.lookup(env)
+      return run
+
+    walk = outwards(depth)
+
+    def run(env):
+      env = walk(env)
+      if env is cache.env and cache.version == Environment.version:
+        return cache.cell.value
+      return cache.lookup(env)
+    return run
+
+  # Parameters are always there to be read
+  if scope_at(scope, depth).is_param(index):
+    if depth == 0:
+      return lambda env: env.values[index]
+    elif depth == 1:
+      return lambda env: env.outer.values[index]
+    walk = outwards(depth)
+    return lambda env: walk(env).values[index]
+
+  # Variables from `def` might not have been defined yet, in which case
+  # we keep looking outwards just like `Environment.find()` would.
+  walk = outwards(depth)
+
+  def run(env):
+    frame = walk(env)
+    value = frame.values[index]
+    if value is unbound:
+      return frame.outer.find(var)[var]
+    return value
+  return run
+
+### Special forms
+# Each kind of node gets a function that analyzes its pieces and returns
+# the function that runs it. They are looked up by the type of the node
+# in `analyzers` rather than compared against one by one.
+
+# Object, Scope, Boolean -> Analyzed Expression
+def analyze_literal(expr, scope, tail):
+  ''' Anything that isn't a node evaluates to itself. '''
+
+  return lambda env: expr
+
+# Node, Scope, Boolean -> Analyzed Expression
+def analyze_const(expr, scope, tail):
+  ''' constant, (quote subexpr) '''
+
+  value = expr.value
+  return lambda env: value
+
+# Node, Scope, Boolean -> Analyzed Expression
+def analyze_if(expr, scope, tail):
+  ''' (if test conseq alt) '''
+
+  test = analyze(expr.test, scope)
+  conseq, alt = analyze(expr.conseq, scope, tail), analyze(expr.alt, scope, tail)
+
+  def run(env):
+    if test(env):
+      return conseq(env)
+    return alt(env)
+  return run
+
+# Node, Scope, Boolean -> Analyzed Expression
+def analyze_set(expr, scope, tail):
+  ''' (set! var expr) '''
+
+  var, value = expr.var, analyze(expr.value, scope)
+  depth, index = resolve(var, scope)
+  walk = outwards(depth)
+
+  if index is None:
+    def run(env):
+      walk(env).find(var)[var] = value(env)
+    return run
+
+  def run(env):
+    frame = walk(env)
+    if frame.values[index] is unbound:
+      frame.outer.find(var)[var] = value(env)
+    else:
+      frame.values[index] = value(env)
+  return run
+
+# Node, Scope, Boolean -> Analyzed Expression
+def analyze_def(expr, scope, tail):
+  ''' (def var expr) '''
+
+  var, value = expr.var, analyze(expr.value, scope)
+
+  if scope is None or scope.dynamic:
+    def run(env):
+      env[var] = value(env)
+    return run
+
+  # A procedure's frame has a place for everything its body
+  # defines, found when the procedure was analyzed
+  if var not in scope.names:
+    raise SyntaxError(gazellestr(expr) +
+      ': definition was not visible when its procedure was analyzed')
+
+  index = scope.names.index(var)
+
+  def run(env):
+    env.values[index] = value(env)
+  return run
+
+# Node, Scope, Boolean -> Analyzed Expression
+def analyze_lambda(expr, scope, tail):
+  ''' (lambda (var*) expr) '''
+
+  params, body = expr.params, expr.body
+  inner = Scope(params, body, scope)
+  code, bind = analyze(body, inner, tail=True), inner.binder()
+  return lambda env: Closure(params, body, code, bind, env, inner)
+
+# Node, Scope, Boolean -> Analyzed Expression
+def analyze_begin(expr, scope, tail):
+  ''' (begin expr+) '''
+
+  steps = [analyze(subexpr, scope) for subexpr in expr.body[:-1]]
+  last = analyze(expr.body[-1], scope, tail)
+
+  def run(env):
+    for step in steps:
+      step(env)
+    return last(env)
+  return run
+
+# Node, Scope, Boolean -> Analyzed Expression
+def analyze_primitive(expr, scope, tail):
+  ''' (display expr), (check-expect expr expected), ... '''
+
+  proc, args = expr.proc, [analyze(arg, scope) for arg in expr.args]
+
+  if len(args) == 1:
+    a, = args
+    return lambda env: proc(a(env))
+  elif len(args) == 2:
+    a, b = args
+    return lambda env: proc(a(env), b(env))
+  return lambda env: proc(*[arg(env) for arg in args])
+
+# Node, Scope, Boolean -> Analyzed Expression
+def analyze_include(expr, scope, tail):
+  ''' (include "filepath") '''
+
+  # The file was loaded when it was expanded, and runs like
+  # a program of its own in whatever environment it's in
+  program = analyze(expr.program, tail=True)
+  return lambda env: trampoline(program(env))
+
+# Node, Scope, Boolean -> Analyzed Expression
+def analyze_stdlib(expr, scope, tail):
+  ''' (stdlib) '''
+
+  program = analyze(expr.program, tail=True)
+
+  def run(env):
+    trampoline(program(env))
+  return run
+
+# Node, Scope, Boolean -> Analyzed Expression
+def analyze_import(expr, scope, tail):
+  ''' (import name) '''
+
+  def run(env):
+    modules.link(expr, env, aeval)
+  return run
+
+# Node, Scope, Boolean -> Analyzed Expression
+def analyze_provide(expr, scope, tail):
+  ''' (provide var...) '''
+
+  return lambda env: None
+
+# Node, Scope, Boolean -> Analyzed Expression
+def analyze_while(expr, scope, tail):
+  ''' (while cond body) '''
+
+  test, body = analyze(expr.test, scope), analyze(expr.body, scope)
+
+  def run(env):
+    while test(env):
+      body(env)
+  return run
+
+### Application
+# Most of the time a procedure is called with only a handful of arguments,
+# so those shapes get their own functions that don't have to build a
+# list of arguments with a loop.
+
+# Node, Scope, Boolean -> Analyzed Expression
+def analyze_application(expr, scope, tail):
+  ''' (proc expr*) '''
+
+  proc = analyze(expr.proc, scope)
+  args = [analyze(arg, scope) for arg in expr.args]
+
+  if type(expr.proc) is Ref and len(args) == 2:
+    fast = analyze_binary(expr.proc.var, scope, proc, args, tail)
+    if fast is not None:
+      return fast
+
+  if tail:
+    if len(args) == 0:
+      return lambda env: TailCall(proc(env), ())
+    elif len(args) == 1:
+      a, = args
+      return lambda env: TailCall(proc(env), (a(env),))
+    elif len(args) == 2:
+      a, b = args
+      return lambda env: TailCall(proc(env), (a(env), b(env)))
+    elif len(args) == 3:
+      a, b, c = args
+      return lambda env: TailCall(proc(env), (a(env), b(env), c(env)))
+    return lambda env: TailCall(proc(env), [arg(env) for arg in args])
+
+  if len(args) == 0:
+    return lambda env: proc(env)()
+  elif len(args) == 1:
+    a, = args
+    return lambda env: proc(env)(a(env))
+  elif len(args) == 2:
+    a, b = args
+    return lambda env: proc(env)(a(env), b(env))
+  elif len(args) == 3:
+    a, b, c = args
+    return lambda env: proc(env)(a(env), b(env), c(env))
+  return lambda env: proc(env)(*[arg(env) for arg in args])
+
+# Symbol, Scope, Analyzed Expression, [Analyzed Expression], Boolean -> Analyzed Expression or None
+def analyze_binary(var, scope, proc, args, tail):
+  ''' (+ a b), (< a b), ...: if var is a global builtin with a two-argument
+  version (see `binary` in `stdenv.py`), call that version directly for
+  as long as var is still bound to the builtin. '''
+
+  fast = fast_path(var)
+  if fast is None or resolve(var, scope)[1] is not None:
+    return None
+
+  builtin, binary = fast
+  a, b = args
+
+  if tail:
+    def run(env):
+      f = proc(env)
+      if f is builtin:
+        return binary(a(env), b(env))
+      return TailCall(f, (a(env), b(env)))
+    return run
+
+  def run(env):
+    f = proc(env)
+    if f is builtin:
+      return binary(a(env), b(env))
+    return f(a(env), b(env))
+  return run
+
+analyzers = {
+  Const:     analyze_const,
+  Ref:       analyze_variable,
+  If:        analyze_if,
+  Set:       analyze_set,
+  Def:       analyze_def,
+  Lambda:    analyze_lambda,
+  Begin:     analyze_begin,
+  While:     analyze_while,
+  Primitive: analyze_primitive,
+  Include:   analyze_include,
+  Stdlib:    analyze_stdlib,
+  Import:    analyze_import,
+  Provide:   analyze_provide,
+  App:       analyze_application,
+}
+
+### aeval
+# Node -> Evaluated Gazelle expression
+def aeval(expr, env=global_env):
+  ''' Analyze an expression, then evaluate it in an environment. '''
+
+  return trampoline(analyze(expr, tail=True)(env))
@@ -3,12 +3,30 @@ import re
 # Local deps
 from .sym import eof, Sym, Quotes
 
-# A regex that we use to tokenize a string
-Tokenizer = r"""\s*(,@|[('`,)]|"(?:[\\].|[^\\"])*"|;.*|[^\s('"`,;)]*)(.*)"""
+# A regex that matches the next token in a string, after skipping
+# any whitespace before it
+Tokenizer = re.compile(r"""\s*(,@|[('`,)]|"(?:[\\].|[^\\"])*"|;[^\n]*|[^\s('"`,;)]*)""")
+
+# A regex that matches the integer and floating point literals that
+# `int()` and `float()` would accept. Which group matched tells us
+# which one it is.
+Digits = r'\d(?:_?\d)*'
+Number = re.compile(r"""[+-]?(?:
+  (?P<int>{0}) |
+  (?:{0}\.(?:{0})?|\.{0}|{0})(?:[eE][+-]?{0})?
+)$""".format(Digits), re.VERBOSE)
 
 # A regex that we use to determine if a number 0-9 is 
 # present within a string
-ContainsNum = re.compile('\d')
+ContainsNum = re.compile(r'\d')
+
+# How much of a file to read at once
+CHUNK_SIZE = 1 << 16
+
+# A list read from the input, which remembers the line it started on
+# so that `expand()` can tell where each expression came from
+class Form(list):
+  __slots__ = ('line',)
 
 class Atomizer(object):
   
@@ -24,24 +42,84 @@ class Atomizer(object):
   We essentially perform the action of gazelle syntax -> python object
   and reason about it using lisp terms. We do this to make evaluation
   and parsing easier later on.
+
+  Input is read into a buffer `CHUNK_SIZE` characters at a time, and
+  the atomizer keeps its position in the buffer instead of cutting
+  tokens off of the front of it. Interactive input is read a line at
+  a time instead so that we never wait on more than the user typed.
   '''
 
-  def __init__(self, file):
-    self.file = file; self.line = ''
+  def __init__(self, file, chunk_size=None):
+    self.file, self.buffer, self.pos, self.exhausted = file, '', 0, False
+
+    # The line we're at in the input, and the line
+    # the last token returned started on
+    self.line = self.token_line = 1
+
+    if chunk_size is None:
+      interactive = getattr(file, 'isatty', None)
+      chunk_size = 0 if interactive and interactive() else CHUNK_SIZE
+
+    self.chunk_size = chunk_size
+
+  # self -> Boolean
+  def fill(self):
+    ''' Read more input onto the end of the buffer, dropping everything
+    before the current position. Return False if there is none left. '''
+
+    if self.chunk_size:
+      more = self.file.read(self.chunk_size)
+    else:
+      more = self.file.readline()
+
+    self.buffer, self.pos = self.buffer[self.pos:] + more, 0
+    if more == '':
+      self.exhausted = True
+    return more != ''
+
+  # self -> Boolean
+  def pending(self):
+    ''' Is there input that's been read in but not used yet,
+    other than whitespace? '''
+
+    return self.pos < len(self.buffer) and not self.buffer[self.pos:].isspace()
+
+  # self -> None
+  def discard(self):
+    ''' Forget the input that's been read in but not used yet. '''
+
+    self.buffer, self.pos = '', 0
 
   # self -> Token
   def next_token(self):
     ''' Return the next token from the input based on the tokenizer '''
 
     while True:
-      if self.line == '': 
-        self.line = self.file.readline()
-        if self.line == '': 
+      match = Tokenizer.match(self.buffer, self.pos)
+      end = match.end()
+
+      token = match.group(1)
+
+      # A token (or comment) that runs into the end of the buffer might
+      # continue past it, and a string that hasn't ended yet can't be
+      # matched at all, so read more and look again
+      if (end == len(self.buffer) or token == '') and not self.exhausted:
+        self.fill()
+        continue
+
+      if token == '':
+        if end == len(self.buffer):
           return eof
+        raise SyntaxError('unterminated string')
 
-      token, self.line = re.match(Tokenizer, self.line).groups()
+      # Keep count of the lines we pass, including any inside strings
+      start = match.start(1)
+      self.line += self.buffer.count('\n', self.pos, start)
+      self.token_line = self.line
+      self.line += self.buffer.count('\n', start, end)
+      self.pos = end
 
-      if token != '' and not token.startswith(';'):
+      if token[0] != ';':
         return token
 
   ### Atoms
@@ -79,7 +157,8 @@ class Atomizer(object):
 
       # Lparen means that a list has begun
       if '(' == token: 
-        L = []
+        L = Form()
+        L.line = self.token_line
         while True:
           token = self.next_token()
           if token == ')': return L
@@ -88,7 +167,11 @@ class Atomizer(object):
       # after each lparen we check for the end of the list
       elif ')' == token: raise SyntaxError('unexpected )')
       # Expand quotes into their proper symbol
-      elif token in Quotes: return [Quotes[token], self.read()]
+      elif token in Quotes:
+        L = Form([Quotes[token]])
+        L.line = self.token_line
+        L.append(self.read())
+        return L
       # We also shouldn't be having eofs
       elif token is eof: raise SyntaxError('unexpected EOF in list')
       # Otherwise we just return the proper atom
@@ -115,26 +198,21 @@ class Atomizer(object):
     # wrapped in double quotes
     elif token[0] == '"': return token[1:-1]
 
-    # TODO: The act of determining if a token is something like 
-    # `123foobar` is potentially costly towards computation time
-    # it might be better to remove such symbols from gazelle
-    # and return SyntaxErrors
-
-    # Otherwise if the token contains an integer,
-    # it *may be* an int, float, or complex number
-    elif ContainsNum.search(token):
-      # See if it's just something like `'123'`
-      try: return int(token)
+    # A number will start with a digit, a sign or a decimal point.
+    # Integers and floats are told apart by the same match that
+    # finds them
+    elif token[0] in '0123456789+-.':
+      number = Number.match(token)
+      if number:
+        return int(token) if number.group('int') else float(token)
+
+    # Anything else with a digit in it could still be something
+    # like `123j`, otherwise it must be something like `123foobar`
+    if token[-1] in 'ij' and ContainsNum.search(token):
+      try: return complex(token.replace('i', 'j', 1))
       except ValueError:
-        # See if it's something like `'12.3'`
-        try: return float(token)
-        except ValueError:
-          # See if it's something like `'123j'`
-          try: return complex(token.replace('i', 'j', 1))
-          # Otherwise it must be something like `123foobar`
-          except ValueError:
-            return Sym(token)
-    
-    # If the token contains no numbers, isn't wrapped in double quotes,
-    # and doesn't contain a number, it must be a string
-    else: return Sym(token)
\ No newline at end of file
+        pass
+
+    # If the token isn't a boolean, a string or a number,
+    # it must be a symbol
+    return Sym(token)
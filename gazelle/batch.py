@@ -0,0 +1,62 @@
+import concurrent.futures, subprocess, sys, time
+
+# Local deps
+from . import colors
+
+### Batch runs
+# Running several files with `gazelle.py file1.gel file2.gel ...` runs
+# them one after another in the same environment, so whatever one file
+# defines (including macros) is there for the next one, and only one
+# core is ever used.
+#
+# With `--jobs N`, every file is run by a `gazelle.py` process of its
+# own instead, up to N of them at a time. Each one starts from a fresh
+# global environment, and a file that fails or crashes can't take the
+# others down with it. What each file printed is shown once it's done,
+# in the order the files were given, followed by a summary.
+
+# What happened when a file was run: whether it succeeded,
+# everything it printed and how long it took
+class Result(object):
+  def __init__(self, path, status, output, seconds):
+    self.path, self.status, self.output, self.seconds = path, status, output, seconds
+
+# String, [String], String -> Result
+def run_one(path, options, script):
+  ''' Run a single file in a process of its own. '''
+
+  start = time.perf_counter()
+  process = subprocess.run([sys.executable, script] + options + [path],
+    stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+  return Result(path, process.returncode, process.stdout, time.perf_counter() - start)
+
+# [String], Integer, [String], String -> [Result]
+def run_files(paths, jobs, options, script):
+  ''' Run every file with `script` (`gazelle.py`) and the commandline
+  options, jobs at a time, printing each one's output as it finishes
+  and then a summary. '''
+
+  start, results = time.perf_counter(), []
+  with concurrent.futures.ThreadPoolExecutor(jobs) as pool:
+    for result in pool.map(lambda path: run_one(path, options, script), paths):
+      results.append(result)
+      report(result)
+
+  failed = [result for result in results if result.status != 0]
+  summary = '%d files, %d failed in %.2fs' % (len(results), len(failed),
+    time.perf_counter() - start)
+  colors.printf(summary, colors.FAIL if failed else colors.OKGREEN)
+  for result in failed:
+    colors.printf('  ' + result.path, colors.FAIL)
+  return results
+
+# Result -> None
+def report(result):
+  ''' Print what a file printed, under a line saying how it went. '''
+
+  if result.status == 0:
+    colors.printf('[ok] %s (%.2fs)' % (result.path, result.seconds), colors.OKGREEN)
+  else:
+    colors.printf('[exit %d] %s (%.2fs)' % (result.status, result.path, result.seconds), colors.FAIL)
+  if result.output:
+    sys.stdout.write(result.output if result.output.endswith('\n') else result.output + '\n')
@@ -0,0 +1,132 @@
+import hashlib, os, pickle, tempfile
+
+### Cache
+# Reading a file means running it through the atomizer and `expand()`
+# before anything is evaluated, and `(stdlib)` or `(include ...)` do
+# that every time they are evaluated, even if the file hasn't changed.
+#
+# Instead, the expanded program is saved to a cache directory the first
+# time a file is loaded, and read back with pickle from then on. An
+# entry belongs to the absolute path of the file, and remembers the
+# modification time, size and content hash of the file it was made from.
+# If the time and size still match the entry is used straight away;
+# otherwise the file is hashed, and the entry is only used if the
+# contents are the same. Entries can also depend on other files (like
+# the ones a file includes), which are checked the same way.
+#
+# Set `GAZELLE_CACHE_DIR` to move the cache, or `GAZELLE_CACHE=0` to turn
+# it off.
+
+# Bump this whenever `expand()` starts producing something different,
+# so that entries made by older versions are ignored
+VERSION = 6
+
+# Where entries go unless `GAZELLE_CACHE_DIR` says otherwise
+DEFAULT_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'gazelle')
+
+# Turned off by the commandline with `--no-cache`
+enabled = True
+
+# Entries that have already been read or written by this process, so
+# that a file loaded from many places is only unpickled once. Since
+# nodes can't be changed, everyone can share the same program.
+memory = {}
+
+# None -> String or None
+def directory():
+  ''' The directory entries are kept in, or None if caching is off. '''
+
+  if not enabled or os.environ.get('GAZELLE_CACHE') == '0':
+    return None
+  return os.environ.get('GAZELLE_CACHE_DIR') or DEFAULT_DIR
+
+# String -> String or None
+def entry_path(path):
+  ''' The file that caches path. '''
+
+  root = directory()
+  if root is None:
+    return None
+  key = hashlib.sha1(os.path.abspath(path).encode())
+  return os.path.join(root, key.hexdigest() + '.gelc')
+
+# String -> String
+def digest(path):
+  ''' Hash the contents of a file. '''
+
+  with open(path, 'rb') as f:
+    return hashlib.sha1(f.read()).hexdigest()
+
+# String -> (Integer, Integer, String)
+def stamp(path):
+  ''' What an entry remembers about the file it was made from. This
+  should be taken before the file is read, in case it changes after. '''
+
+  stat = os.stat(path)
+  return stat.st_mtime_ns, stat.st_size, digest(path)
+
+# String, (Integer, Integer, String) -> Boolean
+def unchanged(path, stamp):
+  ''' Is the file at path still the same as when stamp was taken? '''
+
+  try:
+    stat = os.stat(path)
+  except OSError:
+    return False
+
+  mtime, size, content = stamp
+  if (stat.st_mtime_ns, stat.st_size) == (mtime, size):
+    return True
+  # Touched, but maybe not changed
+  return stat.st_size == size and digest(path) == content
+
+# String -> ((Integer, Integer, String), Object) or None
+def fetch(path):
+  ''' Look for what was stored for path, returning the stamp of the file
+  it was made from along with it. Returns None if nothing was stored,
+  or the file has changed since. '''
+
+  entry = entry_path(path)
+  if entry is None:
+    return None
+
+  if entry in memory:
+    stamp, value = memory[entry]
+    if unchanged(path, stamp):
+      return stamp, value
+
+  try:
+    with open(entry, 'rb') as f:
+      version, stamp, value = pickle.load(f)
+  except Exception:
+    return None
+
+  if version != VERSION or not unchanged(path, stamp):
+    return None
+  memory[entry] = stamp, value
+  return stamp, value
+
+# String, (Integer, Integer, String), Object -> None
+def store(path, stamp, value):
+  ''' Save value as what path expanded to when it had stamp. Anything
+  that goes wrong just means the file will be expanded again next time. '''
+
+  entry = entry_path(path)
+  if entry is None:
+    return
+
+  memory[entry] = stamp, value
+  temp = None
+  try:
+    data = pickle.dumps((VERSION, stamp, value), pickle.HIGHEST_PROTOCOL)
+
+    # Write somewhere else first so that nobody
+    # reads an entry that's only half written
+    os.makedirs(os.path.dirname(entry), exist_ok=True)
+    fd, temp = tempfile.mkstemp(dir=os.path.dirname(entry))
+    with os.fdopen(fd, 'wb') as f:
+      f.write(data)
+    os.replace(temp, entry)
+  except Exception:
+    if temp is not None and os.path.exists(temp):
+      os.remove(temp)
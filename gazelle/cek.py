@@ -0,0 +1,292 @@
+# Local deps
+from .env import Environment
+from . import modules
+from .nodes import Const, Ref, If, Set, Def, Lambda, Begin, While, \
+  Primitive, Include, Stdlib, Import, Provide, App
+from .stdenv import global_env, apply, callcc, filter_list, map_list
+
+### CEK machine
+# `gazeval()` only avoids recursion for tail calls. Evaluating the
+# arguments of a procedure, the test of an `if` or anything else that
+# has to come back and finish some work afterwards is done by calling
+# `gazeval()` again, so a program can only be as deeply recursive as
+# python lets it be.
+#
+# This evaluator keeps that "work to finish afterwards" in a list of its
+# own instead. It's named after the three things that make up its state:
+# the Control (the expression being evaluated), the Environment it's
+# being evaluated in, and the Kontinuation (the list of frames saying
+# what to do with the value once we have it). Since the list lives on
+# the heap, recursion can go as deep as memory allows.
+#
+# Builtins that call procedures, like `map`, `filter` and `apply`, would
+# bring the python stack back, so the machine runs those itself, and
+# because the continuation is just a list `call/cc` can capture all of
+# it: continuations made here can be resumed, not just escaped from.
+
+# The machine is either evaluating an expression or
+# returning a value to the top frame of the continuation
+EVAL, RETURN = 0, 1
+
+# Kinds of continuation frames and what they hold
+IF_K     = 0  # (IF_K, node, env): pick a branch of node by the value
+SET_K    = 1  # (SET_K, var, env): set! var to the value
+DEF_K    = 2  # (DEF_K, var, env): def var as the value
+BEGIN_K  = 3  # (BEGIN_K, body, i, env): go on to body[i]
+WHILE_K  = 4  # (WHILE_K, node, env): run the body of node if the value is true
+BODY_K   = 5  # (BODY_K, node, env): the body ran, evaluate the test again
+ARGS_K   = 6  # (ARGS_K, exprs, i, values, env, op): collect values of exprs in a list
+MAP_K    = 7  # (MAP_K, f, items, i, results): collect f of each item in a list
+FILTER_K = 8  # (FILTER_K, f, items, i, results): keep items f accepts in a list
+IGNORE_K = 9  # (IGNORE_K,): return None instead of the value
+
+# A `CEKProcedure` is a lambda expression paired with its environment.
+# Applying it inside the machine just moves the machine into its body;
+# calling it from python starts a new machine.
+class CEKProcedure(object):
+  def __init__(self, params, body, env):
+    self.params, self.body, self.env = params, body, env
+
+  def __call__(self, *args):
+    return run(self.body, Environment(self.params, args, self.env))
+
+# A `Continuation` is a copy of the continuation frames at the time
+# `call/cc` was applied, and the machine it came from.
+class Continuation(object):
+  def __init__(self, frames, machine):
+    self.frames, self.machine = frames, machine
+
+  def __call__(self, value):
+    ''' Called from python, so unwind back to our machine. '''
+
+    raise Resume(self, value)
+
+# Raised to carry a value back to the machine that owns a continuation
+# when it's resumed from somewhere that machine can't see, like a
+# builtin or another machine started by one.
+class Resume(Exception):
+  def __init__(self, continuation, value):
+    Exception.__init__(self, 'continuation can\'t be resumed outside of its evaluation')
+    self.continuation, self.value = continuation, value
+
+# Node, Environment -> Evaluated Gazelle expression
+def run(expr, env):
+  ''' Run the machine on an expression until there is nothing
+  left to do with its value. '''
+
+  frames, machine = [], object()
+  push, pop = frames.append, frames.pop
+  mode, value = EVAL, None
+
+  while True:
+
+    if mode == EVAL:
+      kind = type(expr)
+
+      # variable reference
+      if kind is Ref:
+        value, mode = env.find(expr.var)[expr.var], RETURN
+
+      # constant literal, (quote subexpr)
+      elif kind is Const:
+        value, mode = expr.value, RETURN
+
+      # (proc expr*): the procedure is evaluated first, then its arguments
+      elif kind is App:
+        push((ARGS_K, expr.args, 0, [], env, None))
+        expr = expr.proc
+
+      # (if test conseq alt)
+      elif kind is If:
+        push((IF_K, expr, env))
+        expr = expr.test
+
+      # (begin expr+)
+      elif kind is Begin:
+        push((BEGIN_K, expr.body, 1, env))
+        expr = expr.body[0]
+
+      # (set! var expr)
+      elif kind is Set:
+        push((SET_K, expr.var, env))
+        expr = expr.value
+
+      # (def var expr)
+      elif kind is Def:
+        push((DEF_K, expr.var, env))
+        expr = expr.value
+
+      # (lambda (var*) expr)
+      elif kind is Lambda:
+        value, mode = CEKProcedure(expr.params, expr.body, env), RETURN
+
+      # (while cond body)
+      elif kind is While:
+        push((WHILE_K, expr, env))
+        expr = expr.test
+
+      # check-expect, check-within, member?, display
+      elif kind is Primitive:
+        push((ARGS_K, expr.args, 1, [], env, expr.proc))
+        expr = expr.args[0]
+
+      # (include "filepath")
+      elif kind is Include:
+        expr = expr.program
+
+      # (stdlib)
+      elif kind is Stdlib:
+        push((IGNORE_K,))
+        expr = expr.program
+
+      # (import name)
+      elif kind is Import:
+        modules.link(expr, env, cekeval)
+        value, mode = None, RETURN
+
+      # (provide var...)
+      elif kind is Provide:
+        value, mode = None, RETURN
+
+      # anything else is a value already
+      else:
+        value, mode = expr, RETURN
+
+      continue
+
+    # mode == RETURN: hand value to the top frame
+    if not frames:
+      return value
+
+    frame = pop()
+    kind = frame[0]
+
+    if kind == ARGS_K:
+      _, exprs, i, values, env, op = frame
+      values.append(value)
+      if i < len(exprs):
+        push((ARGS_K, exprs, i + 1, values, env, op))
+        expr, mode = exprs[i], EVAL
+      elif op is not None:
+        value = op(*values)
+      else:
+        mode, expr, env, value = application(values[0], values[1:], frames, machine)
+
+    elif kind == IF_K:
+      _, expr, env = frame
+      expr, mode = expr.conseq if value else expr.alt, EVAL
+
+    elif kind == BEGIN_K:
+      _, body, i, env = frame
+      if i < len(body) - 1:
+        push((BEGIN_K, body, i + 1, env))
+      expr, mode = body[i], EVAL
+
+    elif kind == WHILE_K:
+      _, expr, env = frame
+      if value:
+        push((BODY_K, expr, env))
+        expr, mode = expr.body, EVAL
+      else:
+        value = None
+
+    elif kind == BODY_K:
+      _, expr, env = frame
+      push((WHILE_K, expr, env))
+      expr, mode = expr.test, EVAL
+
+    elif kind == SET_K:
+      _, var, env = frame
+      env.find(var)[var] = value
+      value = None
+
+    elif kind == DEF_K:
+      _, var, env = frame
+      env[var] = value
+      value = None
+
+    elif kind == MAP_K:
+      _, f, items, i, results = frame
+      results.append(value)
+      if i < len(items):
+        push((MAP_K, f, items, i + 1, results))
+        mode, expr, env, value = application(f, (items[i],), frames, machine)
+      else:
+        value = results
+
+    elif kind == FILTER_K:
+      _, f, items, i, results = frame
+      if value:
+        results.append(items[i - 1])
+      if i < len(items):
+        push((FILTER_K, f, items, i + 1, results))
+        mode, expr, env, value = application(f, (items[i],), frames, machine)
+      else:
+        value = results
+
+    elif kind == IGNORE_K:
+      value = None
+
+# [Frame] -> [Frame]
+def snapshot(frames):
+  ''' A copy of frames whose lists of collected values aren't shared
+  with the original, since the frames add to them as the machine goes. '''
+
+  copy = []
+  for frame in frames:
+    if frame[0] == ARGS_K:
+      frame = frame[:3] + (list(frame[3]),) + frame[4:]
+    elif frame[0] == MAP_K or frame[0] == FILTER_K:
+      frame = frame[:4] + (list(frame[4]),)
+    copy.append(frame)
+  return copy
+
+# Procedure, (Object), [Frame], Object -> (Integer, Gazelle Expression, Environment, Object)
+def application(proc, args, frames, machine):
+  ''' Apply proc to args on the machine `machine` with continuation
+  `frames`. Returns the state to continue from: either (EVAL, expr, env,
+  None) to evaluate a procedure body, or (RETURN, None, None, value). '''
+
+  while True:
+    if type(proc) is CEKProcedure:
+      return EVAL, proc.body, Environment(proc.params, args, proc.env), None
+
+    # Anything given the wrong number of arguments is called like any
+    # other builtin below, so that it raises what it would elsewhere
+    elif type(proc) is Continuation and len(args) == 1:
+      if proc.machine is not machine:
+        raise Resume(proc, args[0])
+      frames[:] = snapshot(proc.frames)
+      return RETURN, None, None, args[0]
+
+    # (apply proc list)
+    elif proc is apply and len(args) == 2:
+      proc, args = args[0], tuple(args[1])
+
+    # (call/cc proc)
+    elif proc is callcc and len(args) == 1:
+      proc, args = args[0], (Continuation(snapshot(frames), machine),)
+
+    # (map f list), (filter f list)
+    elif (proc is map_list or proc is filter_list) and len(args) == 2:
+      f, items = args[0], list(args[1])
+      if not items:
+        return RETURN, None, None, []
+      frames.append((MAP_K if proc is map_list else FILTER_K, f, items, 1, []))
+      proc, args = f, (items[0],)
+
+    else:
+      try:
+        return RETURN, None, None, proc(*args)
+      except Resume as resume:
+        if resume.continuation.machine is not machine:
+          raise
+        frames[:] = snapshot(resume.continuation.frames)
+        return RETURN, None, None, resume.value
+
+### cekeval
+# Node -> Evaluated Gazelle expression
+def cekeval(expr, env=global_env):
+  ''' Evaluate an expression in an environment on the CEK machine. '''
+
+  return run(expr, env)
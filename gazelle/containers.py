@@ -0,0 +1,99 @@
+### Containers
+# Lists are the only way to keep more than one thing together in
+# gazelle, and the only way to get at something in a list is to walk
+# down it. Looking a key up in an association list or checking whether
+# something is in a list takes as long as the list is, and so does
+# getting at its last element.
+#
+# These are containers that don't have to walk anywhere:
+#
+#  - a `Table` maps keys to values, `(table 'a 1 'b 2)`
+#  - a `Set` holds values without repeating any, `(set 1 2 3)`
+#  - an `Array` is a list that can be indexed and changed in
+#    place, `(array 1 2 3)` or `(make-array 10 0)`
+#
+# `ref`, `put!`, `has?` and `delete!` work on all of them (and `ref`
+# and `has?` on lists as well), and take the same time however big the
+# container is. Keys and the values in a set have to be atoms, like
+# numbers, strings and symbols, since lists can change.
+#
+# An array is still a list, so anything that takes a list can take one
+# too. Since `cdr` and `cons` don't copy, a list made from an array by
+# them will see any changes made to the array after.
+
+class Table(dict):
+  __slots__ = ()
+
+class Set(set):
+  __slots__ = ()
+
+class Array(list):
+  __slots__ = ()
+
+### Builtins
+
+# Object... -> Table
+def table(*x):
+  ''' (table key value...) '''
+  if len(x) % 2:
+    raise TypeError('table expects keys and values in pairs')
+  return Table(zip(x[::2], x[1::2]))
+
+# Integer, Object -> Array
+def make_array(n, fill=None):
+  ''' (make-array n), (make-array n fill) '''
+  return Array([fill] * n)
+
+# Container, Object, (Object) -> Object
+def ref(c, key, *default):
+  ''' (ref container key), (ref table key default) '''
+  if default and type(c) is Table:
+    return c.get(key, default[0])
+  return c[key]
+
+# Container, Object... -> None
+def put(c, *x):
+  ''' (put! table key value), (put! array index value), (put! set value) '''
+  if type(c) is Set:
+    c.update(x)
+  elif len(x) == 2 and type(c) in (Table, Array):
+    c[x[0]] = x[1]
+  else:
+    raise TypeError('put! expects a table or array, key and value, or a set and values')
+
+# Container, Object -> Boolean
+def has(c, key):
+  ''' (has? container key): is key in a table or set, or an index of a list '''
+  if type(c) is Table or type(c) is Set:
+    return key in c
+  return isinstance(key, int) and -len(c) <= key < len(c)
+
+# Container, Object -> None
+def delete(c, key):
+  ''' (delete! container key) '''
+  if type(c) is Set:
+    c.discard(key)
+  elif type(c) is Table:
+    c.pop(key, None)
+  elif type(c) is Array:
+    del c[key]
+  else:
+    raise TypeError('delete! expects a table, set or array')
+
+builtins = {
+  'table':        table,
+  'table?':       lambda x: type(x) is Table,
+  'table-keys':   lambda t: list(t.keys()),
+  'table-values': lambda t: list(t.values()),
+  'set':          lambda *x: Set(x),
+  'set?':         lambda x: type(x) is Set,
+  'list->set':    Set,
+  'array':        lambda *x: Array(x),
+  'array?':       lambda x: type(x) is Array,
+  'make-array':   make_array,
+  'list->array':  Array,
+  'ref':          ref,
+  'put!':         put,
+  'has?':         has,
+  'delete!':      delete,
+}
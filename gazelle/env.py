@@ -8,23 +8,72 @@ from .sym import Symbol
 # We can create a mutable environment by representing it as a dictionary
 # that is, a simple key/value relation where the key is a string
 # representation of the value which may be an atom, a list, or a procedure
+#
+# An environment also hands out `Cell`s for its variables (see below),
+# and keeps them up to date as the variables change.
 class Environment(dict):
 
+  # Bumped whenever a variable is added to or removed from any
+  # environment, which is the only way what a name refers to can change
+  version = 0
+
+  # The cells handed out for variables in this environment, by name
+  cells = None
+
   def __init__(self, params=(), args=(), outer=None):
     ''' Bind param list to corresponding args, or 
     single param to list of args. '''
 
     self.outer = outer
 
+    # Nothing can have looked anything up in a new environment yet,
+    # so there are no cells to update
     if isinstance(params, Symbol): 
       
-      self.update({params:list(args)})
+      dict.update(self, {params:list(args)})
 
     else: 
       if len(args) != len(params):
         raise SyntaxError('expected %s, given %s, ' 
           % (gazellestr(params), gazellestr(args)))
-      self.update(list(zip(params,args)))
+      dict.update(self, zip(params,args))
+
+  def __getstate__(self):
+    return {'outer': self.outer}
+
+  def __setitem__(self, var, value):
+    if var not in self:
+      Environment.version += 1
+    elif self.cells is not None and var in self.cells:
+      self.cells[var].value = value
+    dict.__setitem__(self, var, value)
+
+  def __delitem__(self, var):
+    dict.__delitem__(self, var)
+    Environment.version += 1
+    if self.cells is not None:
+      self.cells.pop(var, None)
+
+  def update(self, *args, **kwargs):
+    for var, value in dict(*args, **kwargs).items():
+      self[var] = value
+
+  def pop(self, var, *default):
+    if var not in self:
+      return dict.pop(self, var, *default)
+    value = self[var]
+    del self[var]
+    return value
+
+  def cell(self, var):
+    ''' The cell holding var, which must be in this environment. '''
+
+    if self.cells is None:
+      self.cells = {}
+    cell = self.cells.get(var)
+    if cell is None:
+      cell = self.cells[var] = Cell(self[var])
+    return cell
 
   def find(self, var):
     ''' Find the innermost Environment where var appears. '''
@@ -34,4 +83,97 @@ class Environment(dict):
     elif self.outer is None: 
       raise LookupError(var)
     else: 
-      return self.outer.find(var)
\ No newline at end of file
+      return self.outer.find(var)
+
+### Cells
+# A variable that isn't in any procedure's frame, like a builtin or a
+# top-level `def`, is looked up by name every time it's used: the
+# evaluator walks out to the environment the program is running in,
+# then tries one dictionary after another until it finds it. For a
+# builtin called from a program running in `Environment(outer=global_env)`
+# that's a failed lookup and a call to `find()` every single time.
+#
+# Instead, each place a variable like that is used in the closure
+# compiler and the virtual machine gets an `InlineCache`. The first time
+# it runs it looks the variable up by name and keeps the `Cell` the
+# environment holding it hands out, which always has the variable's
+# current value, since the environment updates it on `def` and `set!`.
+# From then on reading the variable is reading the cell.
+#
+# The cell is only used while the cache is run in the same environment
+# it was filled in, and while `Environment.version` hasn't changed. A
+# `def` that adds a variable (which might hide the one the cell holds)
+# changes the version, and so does removing one, and the next read
+# looks the variable up again. This is the same trick python uses for
+# its own global variables.
+class Cell(object):
+  __slots__ = ('value',)
+
+  def __init__(self, value):
+    self.value = value
+
+class InlineCache(object):
+  __slots__ = ('var', 'env', 'version', 'cell')
+
+  def __init__(self, var):
+    self.var, self.env, self.version, self.cell = var, None, -1, None
+
+  def __reduce__(self):
+    return (InlineCache, (self.var,))
+
+  def __repr__(self):
+    return repr(self.var)
+
+  def lookup(self, env):
+    ''' Look var up by name from env, keeping its cell
+    for next time, and return its value. '''
+
+    version, found = Environment.version, env.find(self.var)
+    if not isinstance(found, Environment):
+      return found[self.var]
+
+    # In this order so that tasks (see `tasks.py`) reading
+    # the cache never see a cell with the wrong environment
+    cell, self.env = found.cell(self.var), None
+    self.cell, self.version, self.env = cell, version, env
+    return cell.value
+
+# Variables that a procedure defines with `def` get a place in its
+# `Frame` before the `def` has actually run. Until it does, the place
+# holds `unbound` so lookups know to keep searching outwards.
+unbound = Symbol('#<unbound>') # Note: uninterned; can't be read
+
+### Frames
+# Making a whole dictionary every time a procedure is called is
+# expensive, and so is hashing our way up a chain of them every time
+# a variable is used. Since we can tell which variables a procedure
+# has just by reading it, the analyzer gives each of them a numbered
+# place ahead of time and a `Frame` only has to keep a list of values.
+#
+# Looking a variable up by name still works so that a `Frame` can sit
+# in the middle of a chain of `Environment`s, but code that knows where
+# its variables live indexes `values` directly.
+class Frame(object):
+  __slots__ = ('names', 'values', 'outer')
+
+  def __init__(self, names, values, outer=None):
+    self.names, self.values, self.outer = names, values, outer
+
+  def __contains__(self, var):
+    return var in self.names and self.values[self.names.index(var)] is not unbound
+
+  def __getitem__(self, var):
+    return self.values[self.names.index(var)]
+
+  def __setitem__(self, var, value):
+    self.values[self.names.index(var)] = value
+
+  def find(self, var):
+    ''' Find the innermost Environment or Frame where var appears. '''
+
+    if var in self:
+      return self
+    elif self.outer is None:
+      raise LookupError(var)
+    else:
+      return self.outer.find(var)
@@ -1,4 +1,10 @@
-import collections
+import collections.abc
+
+# Local deps
+from .containers import Table, Set, Array
+from .nodes import Node, unparse
+from .pair import is_list
+from .vector import is_vector
 
 # Object -> Gazelle Expression
 def gazellestr(exp):
@@ -10,15 +16,31 @@ def gazellestr(exp):
     else: return '#f'
 
   # Procedures
-  elif isinstance(exp, collections.Callable):
+  elif isinstance(exp, collections.abc.Callable):
     try:
-      return '(lambda (' + ' '.join([str(x) for x in exp.params]) + \
-        ') (' + ' '.join([gazellestr(x) for x in exp.body]) + '))'
+      return '(lambda ' + gazellestr(exp.params) + \
+        ' ' + gazellestr(unparse(exp.body)) + ')'
     except AttributeError:
       return exp
+
+  # Expanded expressions
+  elif isinstance(exp, Node):
+    return gazellestr(unparse(exp))
   
+  # Containers
+  elif isinstance(exp, Table):
+    return '#table(' + ' '.join('(' + gazellestr(k) + ' ' + gazellestr(v) + ')' for k, v in exp.items()) + ')'
+  elif isinstance(exp, Set):
+    return '#set(' + ' '.join(map(gazellestr, exp)) + ')'
+  elif isinstance(exp, Array):
+    return '#(' + ' '.join(map(gazellestr, exp)) + ')'
+
+  # Vectors
+  elif is_vector(exp):
+    return '#v(' + ' '.join(map(gazellestr, exp.tolist())) + ')'
+
   # Lists
-  elif isinstance(exp, list):
+  elif is_list(exp):
     return '(' + ' '.join(map(gazellestr, exp)) + ')' 
   
   # Everything else
@@ -0,0 +1,50 @@
+# Local deps
+from . import parseval, stdenv
+from .parallel import dumps, loads
+
+### Images
+# Every time gazelle starts, the global environment has to be built from
+# scratch, and a program that wants the standard library (or a prelude
+# of its own) has to load and run it before it can do anything else.
+#
+# An image is a snapshot of the global environment and the macros that
+# have been defined, saved to a file once and read back on startup
+# instead:
+#
+#   python gazelle.py --make-image prelude.img prelude.gel
+#   python gazelle.py --image prelude.img script.gel
+#
+# Making an image always runs the standard library first, so a program
+# started from one can use everything in it without calling `(stdlib)`.
+#
+# Images are written with the same pickler `pmap` sends procedures to
+# other processes with (see `parallel.py`): builtins are saved by name,
+# and only what has been defined or changed in the global environment
+# is saved at all. They only work with the version of gazelle that made
+# them.
+
+MAGIC = b'GZLIMG1\n'
+
+# String -> None
+def save(path):
+  ''' Save the global environment and macros to path. '''
+
+  macros = dict((var, parseval.macro_table[var]) for var in parseval.macro_sources)
+  data = dumps((stdenv.global_env, macros, parseval.macro_sources), True)
+  with open(path, 'wb') as f:
+    f.write(MAGIC)
+    f.write(data)
+
+# String -> None
+def restore(path):
+  ''' Load what an image saved into the global environment,
+  defining its macros. '''
+
+  with open(path, 'rb') as f:
+    if f.read(len(MAGIC)) != MAGIC:
+      raise ValueError(path + ': not a gazelle image')
+    _, macros, sources = loads(f.read())
+
+  parseval.macro_table.update(macros)
+  parseval.macro_sources.update(sources)
+  parseval.forget_expansions()
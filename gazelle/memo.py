@@ -0,0 +1,95 @@
+import collections
+
+# Local deps
+from .containers import Table
+from .pair import freeze
+from .sym import Sym
+
+### Memoization
+# A procedure like
+#
+#   (def fib (\ (n) (if (< n 2) n (+ (fib (- n 1)) (fib (- n 2))))))
+#
+# calls itself with the same arguments over and over: `(fib 30)` makes
+# more than a million calls to work out thirty different values.
+#
+# `(memoize f)` wraps f in a procedure that remembers what f returned
+# for each list of arguments it was called with, and gives that back
+# instead of calling f again. Since `fib` calls itself by name, defining
+# it as `(def fib (memoize (\ (n) ...)))` (or with `def-memo`, see
+# `parseval.py`) memoizes the calls it makes to itself as well.
+#
+# Only the most recently used `size` results are kept (1024 unless
+# `(memoize f size)` says otherwise), so a memoized procedure called
+# with ever different arguments doesn't keep all of them. Arguments are
+# compared by their structure (see `freeze()` in `pair.py`). Calls with
+# arguments that can't be compared that way, like tables, aren't
+# remembered.
+#
+# This only makes sense for procedures that always return the same
+# thing for the same arguments and don't do anything else, like
+# printing or changing variables.
+
+# How many results are kept if memoize isn't told
+SIZE = 1024
+
+# A procedure that remembers its results
+class Memoized(object):
+  __slots__ = ('f', 'size', 'cache', 'hits', 'misses', 'evictions')
+
+  def __init__(self, f, size):
+    if size < 1:
+      raise ValueError('memoize expects a size of at least 1')
+    self.f, self.size, self.cache = f, size, collections.OrderedDict()
+    self.hits, self.misses, self.evictions = 0, 0, 0
+
+  def __call__(self, *args):
+    try:
+      key = tuple(map(freeze, args))
+    except TypeError:
+      self.misses += 1
+      return self.f(*args)
+
+    cache = self.cache
+    if key in cache:
+      self.hits += 1
+      cache.move_to_end(key)
+      return cache[key]
+
+    self.misses += 1
+    value = cache[key] = self.f(*args)
+    if len(cache) > self.size:
+      cache.popitem(last=False)
+      self.evictions += 1
+    return value
+
+  def __str__(self):
+    return '#<memoized>'
+
+  __repr__ = __str__
+
+### Builtins
+
+# Procedure, (Integer) -> Memoized
+def memoize(f, size=SIZE):
+  ''' (memoize f), (memoize f size) '''
+  return Memoized(f, size)
+
+# Memoized -> Table
+def memo_stats(f):
+  ''' (memo-stats f): a table of f's hits, misses, evictions, size and capacity '''
+  return Table([(Sym('hits'), f.hits), (Sym('misses'), f.misses),
+    (Sym('evictions'), f.evictions), (Sym('size'), len(f.cache)), (Sym('capacity'), f.size)])
+
+# Memoized -> None
+def memo_clear(f):
+  ''' (memo-clear! f): forget f's results and statistics '''
+  f.cache.clear()
+  f.hits, f.misses, f.evictions = 0, 0, 0
+
+builtins = {
+  'memoize':     memoize,
+  'memoized?':   lambda x: type(x) is Memoized,
+  'memo-stats':  memo_stats,
+  'memo-clear!': memo_clear,
+}
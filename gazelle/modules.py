@@ -0,0 +1,116 @@
+import os
+
+# Local deps
+from .env import Environment
+from .nodes import Begin, Provide
+from .stdenv import global_env
+from .sym import Symbol
+
+### Modules
+# `(include "file")` pastes a file into the program where it's written:
+# it runs again every time it's evaluated, and whatever it defines ends
+# up in the environment it was included into.
+#
+# `(import name)` loads a *module* instead. A module is a file that runs
+# once, the first time anything imports it, in an environment of its own
+# (inside the global one), and `(provide var...)` in it says which of
+# its variables it shares. Every import after that just binds those
+# variables where the import is, so a module that many files share is
+# only ever read and run once no matter how many times it's imported.
+#
+# Macros aren't part of any environment, so the macros a module defines
+# can be used by any code that comes after the first import of it.
+#
+# Modules are found by name: `(import "lib/util.gel")` looks for that
+# file, and `(import util)` for `util.gel`, in each of the directories
+# of the search path in turn (see `search_path()`).
+
+# The directory of gazelle's own library
+library = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'lib')
+
+# A module that has been run: its environment, and the
+# variables in it that get bound by an import
+class Module(object):
+  def __init__(self, path, env, exports):
+    self.path, self.env, self.exports = path, env, exports
+
+# Every module that has been run, by the absolute path of its file
+registry = {}
+
+# (String) -> [String]
+def search_path(origin=None):
+  ''' The directories modules are looked for in: the directory of the
+  file `origin` that's doing the importing, the current directory, the
+  library directory and then anything in `GAZELLE_PATH`. '''
+
+  dirs = []
+  if origin is not None:
+    dirs.append(os.path.dirname(origin))
+  dirs.extend([os.curdir, library])
+  dirs.extend(d for d in os.environ.get('GAZELLE_PATH', '').split(os.pathsep) if d)
+  return dirs
+
+# String or Symbol, (String) -> String or None
+def find(name, origin=None):
+  ''' Find the file for a module name, or a file path, on the
+  search path. Returns None if there isn't one. '''
+
+  if isinstance(name, Symbol):
+    name = name + '.gel'
+
+  if os.path.isabs(name):
+    return name if os.path.isfile(name) else None
+
+  for directory in search_path(origin):
+    path = os.path.join(directory, name)
+    if os.path.isfile(path):
+      return os.path.abspath(path)
+  return None
+
+# Node -> [Symbol] or None
+def provided(program):
+  ''' The variables a module's program provides, or None if it doesn't
+  say, in which case everything it defines is shared. '''
+
+  if type(program) is Provide:
+    return list(program.names)
+  elif type(program) is not Begin:
+    return None
+
+  found = None
+  for node in program.body:
+    names = provided(node)
+    if names is not None:
+      found = (found or []) + names
+  return found
+
+# Node, Procedure -> Module
+def require(node, evaluate):
+  ''' Run the module an `Import` node refers to with `evaluate`,
+  unless it has been already. '''
+
+  module = registry.get(node.path)
+  if module is not None:
+    return module
+
+  env = Environment(outer=global_env)
+  evaluate(node.program, env)
+
+  if node.exports is None:
+    exports = list(env)
+  else:
+    exports = node.exports
+    for var in exports:
+      if var not in env:
+        raise LookupError(var)
+
+  module = registry[node.path] = Module(node.path, env, exports)
+  return module
+
+# Node, Environment, Procedure -> None
+def link(node, env, evaluate):
+  ''' (import name): bind what the module provides in env. '''
+
+  module = require(node, evaluate)
+  for var in module.exports:
+    env[var] = module.env[var]
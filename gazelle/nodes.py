@@ -0,0 +1,174 @@
+# Local deps
+from .sym import Symbol, Symbols
+
+### Nodes
+# `expand()` used to hand the evaluators the same kind of thing the
+# atomizer reads: nested python lists with a symbol at the front of each
+# one. Every evaluator then had to look at that symbol to find out what
+# kind of expression it was looking at, every time it saw it.
+#
+# Now `expand()` builds a tree of nodes instead, one class for each kind
+# of expression, so an evaluator can tell what it has from its type and
+# reach each piece of it by name. Everything in the tree has been
+# expanded, so nothing ever needs to be expanded again once the program
+# is running.
+#
+# Nodes can't be changed once they're made, and use `__slots__` so that
+# they're smaller than the lists they replace. Each one knows the line
+# of the source it was read from, if there was one.
+class Node(object):
+  __slots__ = ('line',)
+
+  # The names of the pieces of this kind of node, in order
+  fields = ()
+
+  def __init__(self, *values, **kwargs):
+    if len(values) != len(self.fields):
+      raise TypeError('%s expects %d values, not %d'
+        % (type(self).__name__, len(self.fields), len(values)))
+    for name, value in zip(self.fields, values):
+      object.__setattr__(self, name, value)
+    object.__setattr__(self, 'line', kwargs.get('line'))
+
+  def __setattr__(self, name, value):
+    raise AttributeError('%s nodes can\'t be changed' % type(self).__name__)
+
+  def __delattr__(self, name):
+    raise AttributeError('%s nodes can\'t be changed' % type(self).__name__)
+
+  def __eq__(self, other):
+    return type(self) is type(other) and \
+      all(getattr(self, name) == getattr(other, name) for name in self.fields)
+
+  def __ne__(self, other):
+    return not self == other
+
+  def __reduce__(self):
+    return (make, (type(self), self.values(), self.line))
+
+  def __repr__(self):
+    return '%s(%s)' % (type(self).__name__,
+      ', '.join(repr(value) for value in self.values()))
+
+  # None -> (Object)
+  def values(self):
+    ''' The pieces of this node, in the order of `fields`. '''
+
+    return tuple(getattr(self, name) for name in self.fields)
+
+# Class, (Object), Integer -> Node
+def make(cls, values, line):
+  ''' Make a node, for unpickling. '''
+
+  return cls(*values, line=line)
+
+# A value, which is either a literal or something that was quoted
+class Const(Node):
+  __slots__ = fields = ('value',)
+
+# A variable
+class Ref(Node):
+  __slots__ = fields = ('var',)
+
+# (if test conseq alt)
+class If(Node):
+  __slots__ = fields = ('test', 'conseq', 'alt')
+
+# (set! var value)
+class Set(Node):
+  __slots__ = fields = ('var', 'value')
+
+# (def var value)
+class Def(Node):
+  __slots__ = fields = ('var', 'value')
+
+# (lambda params body)
+class Lambda(Node):
+  __slots__ = fields = ('params', 'body')
+
+# (begin body...), where body is a tuple of at least two nodes
+class Begin(Node):
+  __slots__ = fields = ('body',)
+
+# (while test body)
+class While(Node):
+  __slots__ = fields = ('test', 'body')
+
+# A special form like `display` that evaluates all of its arguments and
+# then calls a python procedure with them. `name` is the symbol it was
+# written with.
+class Primitive(Node):
+  __slots__ = fields = ('name', 'proc', 'args')
+
+# (include "path"), where program is what the file expanded to
+class Include(Node):
+  __slots__ = fields = ('path', 'program')
+
+# (stdlib), where program is what the standard library expanded to
+class Stdlib(Node):
+  __slots__ = fields = ('program',)
+
+# (import name), where program is what the module's file expanded to,
+# path is where it was found and exports is what it provides
+class Import(Node):
+  __slots__ = fields = ('name', 'path', 'program', 'exports')
+
+# (provide var...)
+class Provide(Node):
+  __slots__ = fields = ('names',)
+
+# (proc args...)
+class App(Node):
+  __slots__ = fields = ('proc', 'args')
+
+# Node -> [Node]
+def children(node):
+  ''' The nodes directly inside of node. '''
+
+  found = []
+  for value in node.values():
+    if isinstance(value, Node):
+      found.append(value)
+    elif isinstance(value, tuple):
+      found.extend(item for item in value if isinstance(item, Node))
+  return found
+
+# Node -> Gazelle Expression
+def unparse(node):
+  ''' Turn a node back into the lists and atoms it could have been read
+  from, for printing. '''
+
+  t = type(node)
+
+  if t is Const:
+    value = node.value
+    if isinstance(value, (list, Symbol)):
+      return [Symbols['quote'], value]
+    return value
+  elif t is Ref:
+    return node.var
+  elif t is If:
+    return [Symbols['if']] + [unparse(value) for value in node.values()]
+  elif t is Set:
+    return [Symbols['set!'], node.var, unparse(node.value)]
+  elif t is Def:
+    return [Symbols['def'], node.var, unparse(node.value)]
+  elif t is Lambda:
+    return [Symbols['lambda'], node.params, unparse(node.body)]
+  elif t is Begin:
+    return [Symbols['begin']] + [unparse(subnode) for subnode in node.body]
+  elif t is While:
+    return [Symbols['while'], unparse(node.test), unparse(node.body)]
+  elif t is Primitive:
+    return [node.name] + [unparse(arg) for arg in node.args]
+  elif t is Include:
+    return [Symbols['include'], node.path]
+  elif t is Stdlib:
+    return [Symbols['stdlib']]
+  elif t is Import:
+    return [Symbols['import'], node.name]
+  elif t is Provide:
+    return [Symbols['provide']] + list(node.names)
+  elif t is App:
+    return [unparse(node.proc)] + [unparse(arg) for arg in node.args]
+  return node
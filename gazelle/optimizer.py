@@ -0,0 +1,245 @@
+# Local deps
+from . import stdenv
+from .nodes import Const, Ref, If, Set, Def, Lambda, Begin, While, \
+  Primitive, Import, App, children
+from .sym import Symbols
+
+### Optimizer
+# `expand()` only checks syntax and removes sugar, so what it makes is
+# exactly what was written: `(* 60 60 24)` is multiplied out every time
+# it's evaluated, `(if #t a b)` checks whether `#t` is true, and every
+# `begin` a macro expands to is a `begin` of its own. Quasiquote is the
+# worst of these: `(a ,b c) expands to
+#
+#   (cons 'a (cons b (cons 'c '())))
+#
+# which makes a pair for every element of the template.
+#
+# `optimize()` is run over every program once it's been expanded, and
+# rewrites it into a program that does the same thing with less work:
+#
+#  - calls to pure builtins like `+`, `<` and `sqrt` with constant
+#    arguments are made once, and replaced with what they return (as
+#    long as that's a small enough atom, and the call doesn't raise
+#    anything)
+#  - an `if` with a constant test is replaced with the branch it takes
+#  - a `begin` inside a `begin` is spliced into it, and constants that
+#    aren't the last expression of one are dropped
+#  - chains of `cons` and `append` ending in a list, like the ones
+#    quasiquote expands to, are turned into one call to `list`, or a
+#    call to `append` of each piece of the template: the template above
+#    becomes `(list 'a b 'c)`
+#
+# This assumes that the builtins it uses are still what they were when
+# gazelle started. Nothing is folded if a builtin has been redefined,
+# or if its name is defined, set or bound as a parameter anywhere in the
+# program (including the files it includes or imports).
+#
+# Set `enabled` to False (or use `--no-optimize`) to run programs just as
+# they were expanded, to check whether the optimizer is what changed
+# something.
+
+# Turned off by the commandline with `--no-optimize`
+enabled = True
+
+# The builtins that have been folded or lowered on the assumption that
+# they're still what they were when gazelle started. `load()` saves
+# these with each cached program, so the cached program isn't used once
+# one of them has been redefined.
+assumed = set()
+
+# Builtins that always return the same thing for the same arguments
+# and don't do anything else
+PURE = frozenset([
+  '+', '-', '*', '/', '//', '%', '>', '<', '>=', '<=', '=', '>>', '<<',
+  'abs', 'not', 'max', 'min', 'round', 'bool?', 'number?', 'str?',
+  'sqrt', 'exp', 'log', 'log2', 'log10', 'sin', 'cos', 'tan', 'asin',
+  'acos', 'atan', 'floor', 'ceil', 'pow', 'factorial', 'gcd',
+])
+
+# Constants it's safe to fold calls into
+ATOMS = (bool, int, float, complex, str)
+
+# The biggest integers (in bits) and strings that calls are folded with
+# or into. Anything bigger would take a long time to make while the
+# program is parsed, even in a branch that never runs, and then be
+# saved in the cache.
+BITS = 512
+CHARS = 1024
+
+# Node -> Node
+def optimize(program):
+  ''' Optimize an expanded program, unless the optimizer is off. '''
+
+  if not enabled:
+    return program
+  bound = set()
+  bindings(program, bound)
+  return simplify(program, bound)
+
+# Node, {Symbol} -> None
+def bindings(node, bound):
+  ''' Add every variable node defines, sets or binds to bound. '''
+
+  t = type(node)
+  if t is Def or t is Set:
+    bound.add(node.var)
+  elif t is Lambda:
+    bound.update([node.params] if isinstance(node.params, str) else node.params)
+  elif t is Import:
+    bound.update(node.exports or ())
+  for child in children(node):
+    bindings(child, bound)
+
+# Symbol, {Symbol} -> Boolean
+def builtin(node, name, bound):
+  ''' Is node a reference to the builtin `name`? '''
+
+  if type(node) is Ref and node.var == name and name not in bound and \
+      stdenv.global_env.get(name) is stdenv.initial.get(name):
+    assumed.add(name)
+    return True
+  return False
+
+# [Symbol] -> Boolean
+def still_builtins(names):
+  ''' Are all of names still the builtins they were when gazelle started? '''
+
+  return all(stdenv.global_env.get(name) is stdenv.initial.get(name) for name in names)
+
+# Node, {Symbol} -> Node
+def simplify(node, bound):
+  ''' The optimized version of node. '''
+
+  t = type(node)
+
+  if t is If:
+    test = simplify(node.test, bound)
+    if type(test) is Const:
+      return simplify(node.conseq if test.value else node.alt, bound)
+    return If(test, simplify(node.conseq, bound), simplify(node.alt, bound), line=node.line)
+
+  elif t is Set or t is Def:
+    return t(node.var, simplify(node.value, bound), line=node.line)
+
+  elif t is Lambda:
+    return Lambda(node.params, simplify(node.body, bound), line=node.line)
+
+  elif t is Begin:
+    body = []
+    for subnode in node.body:
+      subnode = simplify(subnode, bound)
+      body.extend(subnode.body if type(subnode) is Begin else [subnode])
+    body = [subnode for subnode in body[:-1] if type(subnode) is not Const] + body[-1:]
+    return body[0] if len(body) == 1 else Begin(tuple(body), line=node.line)
+
+  elif t is While:
+    return While(simplify(node.test, bound), simplify(node.body, bound), line=node.line)
+
+  elif t is Primitive:
+    return Primitive(node.name, node.proc,
+      tuple(simplify(arg, bound) for arg in node.args), line=node.line)
+
+  elif t is App:
+    return simplify_app(App(simplify(node.proc, bound),
+      tuple(simplify(arg, bound) for arg in node.args), line=node.line), bound)
+
+  # Included and imported files were optimized when they were loaded
+  return node
+
+# Object -> Boolean
+def small(value):
+  ''' Is value small enough to fold with? '''
+
+  if type(value) is int:
+    return value.bit_length() <= BITS
+  elif type(value) is str:
+    return len(value) <= CHARS
+  return True
+
+# Symbol, [Object] -> Boolean
+def too_big(name, args):
+  ''' Could calling the builtin name with args make something that
+  isn't `small()`, or take too long finding out? '''
+
+  if not all(small(arg) for arg in args):
+    return True
+  ints = [arg for arg in args if type(arg) is int]
+  if name == '<<':
+    return len(ints) == 2 and ints[1] > BITS
+  elif name == '*':
+    # Multiplying strings repeats them
+    return sum(abs(n).bit_length() for n in ints) > BITS or \
+      any(type(arg) is str for arg in args) and any(abs(n) > CHARS for n in ints)
+  elif name == '%':
+    # Formatting a string can pad it to any width, and working out how
+    # wide would mean parsing the format
+    return bool(args) and type(args[0]) is str
+  elif name == 'factorial':
+    return any(n * n.bit_length() > BITS for n in ints)
+  return False
+
+# App, {Symbol} -> Node
+def simplify_app(node, bound):
+  ''' Fold a call to a pure builtin, or lower a chain of `cons`
+  and `append`. '''
+
+  proc, args = node.proc, node.args
+
+  if type(proc) is Ref and proc.var in PURE and all(type(arg) is Const for arg in args) \
+      and not too_big(proc.var, [arg.value for arg in args]) and builtin(proc, proc.var, bound):
+    try:
+      value = stdenv.global_env[proc.var](*[arg.value for arg in args])
+    except Exception:
+      return node
+    return Const(value, line=node.line) if isinstance(value, ATOMS) and small(value) else node
+
+  if len(args) == 2 and (builtin(proc, 'cons', bound) or builtin(proc, 'append', bound)):
+    rest = pieces(args[1], bound)
+    if rest is not None:
+      return join(node, args[0] if proc.var == 'cons' else None,
+        args[0] if proc.var == 'append' else None, rest, bound)
+
+  return node
+
+# Node, {Symbol} -> (Boolean, [Node]) or None
+def pieces(node, bound):
+  ''' If node makes a list out of elements (a call to `list`, or a
+  constant list) then (True, elements); if it's a call to `append`
+  then (False, lists); otherwise None. '''
+
+  if type(node) is Const and type(node.value) is list:
+    return True, [Const(value, line=node.line) for value in node.value]
+  elif type(node) is App and builtin(node.proc, 'list', bound):
+    return True, list(node.args)
+  elif type(node) is App and builtin(node.proc, 'append', bound):
+    return False, list(node.args)
+  return None
+
+# App, Node or None, Node or None, (Boolean, [Node]), {Symbol} -> App
+def join(node, element, splice, rest, bound):
+  ''' `(cons element rest)` or `(append splice rest)` as one call. '''
+
+  def call(name, args):
+    if name == 'append':
+      # Empty lists add nothing, but `append` takes at least two lists
+      args = [arg for arg in args if not (type(arg) is Const and arg.value == [])]
+      args += [Const([], line=node.line)] * (2 - len(args))
+    return App(Ref(Symbols[name], line=node.line), tuple(args), line=node.line)
+
+  elements, items = rest
+
+  if element is not None and elements:
+    return call('list', [element] + items)
+
+  if element is not None:
+    # In front of an append: add it to the first list,
+    # or make a list of its own
+    first = pieces(items[0], bound) if items else None
+    if first is not None and first[0] and type(items[0]) is App:
+      return call('append', [call('list', [element] + first[1])] + items[1:])
+    return call('append', [call('list', [element])] + items)
+
+  if elements:
+    return call('append', [splice] + ([call('list', items)] if items else []))
+  return call('append', [splice] + items)
@@ -0,0 +1,173 @@
+import itertools
+
+# Local deps
+from .containers import Array
+
+### Pairs
+# Lisp lists are built out of pairs: `cons` makes a new pair out of an
+# element and the rest of a list, `car` gets the element back and `cdr`
+# gets the rest. None of these have to copy anything, which is what
+# makes walking down a list one element at a time cheap.
+#
+# Gazelle lists are python lists though, so `cons` used to copy the
+# whole list to put one element in front of it, and `cdr` copied all but
+# the first element. A recursive procedure that walks a list with them
+# copied the list once for every element.
+#
+# Instead, `cons` now makes a `Pair` that points at the list it was
+# given, and `cdr` of a python list makes a `Tail` that points into it,
+# so neither copies anything. Both behave like read-only python lists
+# (they can be iterated over, measured, indexed and compared with
+# lists) so that builtins like `map`, `filter` and `length` can take
+# them without caring how they were built.
+class SharedList(object):
+  __slots__ = ()
+
+  __hash__ = None
+
+  def __eq__(self, other):
+    if not is_list(other):
+      return NotImplemented
+    if len(self) != len(other):
+      return False
+    return all(a == b for a, b in zip(self, other))
+
+  def __ne__(self, other):
+    result = self.__eq__(other)
+    return result if result is NotImplemented else not result
+
+  def __getitem__(self, i):
+    if isinstance(i, slice):
+      return list(self)[i]
+    if i < 0:
+      i += len(self)
+    if not 0 <= i < len(self):
+      raise IndexError('list index out of range')
+    return next(itertools.islice(iter(self), i, None))
+
+  def __add__(self, other):
+    if not is_list(other):
+      return NotImplemented
+    return list(self) + list(other)
+
+  def __radd__(self, other):
+    if not isinstance(other, list):
+      return NotImplemented
+    return other + list(self)
+
+  def __repr__(self):
+    return repr(list(self))
+
+  def __reduce__(self):
+    # Pickled as the python list it's equal to, a pair at a time would
+    # go a level deeper into the pickler for every element
+    return (list, (list(self),))
+
+# A `Pair` is an element (its car) in front of another list (its cdr).
+# It remembers how long it is so that `length` doesn't have to count,
+# unless the list it ends in is an array, which can change length
+# after the pair is made. Then its length is None and it's counted.
+class Pair(SharedList):
+  __slots__ = ('car', 'cdr', 'length')
+
+  def __init__(self, car, cdr):
+    self.car, self.cdr = car, cdr
+    if type(cdr) is Pair:
+      self.length = None if cdr.length is None else cdr.length + 1
+    elif type(cdr) is Array or (type(cdr) is Tail and type(cdr.items) is Array):
+      self.length = None
+    else:
+      self.length = len(cdr) + 1
+
+  def __len__(self):
+    if self.length is not None:
+      return self.length
+    n, pair = 0, self
+    while type(pair) is Pair:
+      n, pair = n + 1, pair.cdr
+    return n + len(pair)
+
+  def __iter__(self):
+    pair = self
+    while type(pair) is Pair:
+      yield pair.car
+      pair = pair.cdr
+    for item in pair:
+      yield item
+
+# A `Tail` is what's left of a python list after dropping the elements
+# before `start`.
+class Tail(SharedList):
+  __slots__ = ('items', 'start')
+
+  def __init__(self, items, start):
+    self.items, self.start = items, start
+
+  def __len__(self):
+    # An array it points into can have shrunk past start
+    return max(0, len(self.items) - self.start)
+
+  def __iter__(self):
+    return itertools.islice(self.items, self.start, None)
+
+  def __getitem__(self, i):
+    if isinstance(i, int) and 0 <= i < len(self):
+      return self.items[self.start + i]
+    return SharedList.__getitem__(self, i)
+
+# Object -> Boolean
+def is_list(x):
+  ''' Is x a python list or one of the lists above? '''
+
+  return isinstance(x, (list, SharedList))
+
+# Gazelle Expression -> Hashable Object
+def freeze(expr):
+  ''' Turn an expression into something hashable that is only equal to
+  the freezing of an expression with the same structure. Atoms are kept
+  with their type, so that `1`, `1.0` and `#t` or the string "x" and the
+  symbol `x` aren't mixed up. Raises TypeError for anything that can't
+  be hashed. '''
+
+  if is_list(expr):
+    return (list,) + tuple(freeze(item) for item in expr)
+  hash(expr)
+  return (type(expr), expr)
+
+### Builtins
+# Object, List -> Pair
+def cons(x, y):
+  ''' Put x in front of the list y. '''
+
+  if not is_list(y):
+    raise TypeError('cons expects a list, not %s' % type(y).__name__)
+  return Pair(x, y)
+
+# List -> Object
+def car(x):
+  ''' The first element of a list or string. '''
+
+  if type(x) is Pair:
+    return x.car
+  return x[0]
+
+# List -> List
+def cdr(x):
+  ''' Everything after the first element of a list or string. '''
+
+  if type(x) is Pair:
+    return x.cdr
+  elif type(x) is Tail:
+    return Tail(x.items, x.start + 1) if len(x) > 1 else []
+  elif isinstance(x, list):
+    return Tail(x, 1) if len(x) > 1 else []
+  return x[1:]
+
+# Object -> Object
+def to_list(x):
+  ''' Copy any lists made out of pairs inside of x into plain python
+  lists, which is what the parser expects code to be made of. '''
+
+  if isinstance(x, SharedList) or isinstance(x, list):
+    return [to_list(item) for item in x]
+  return x
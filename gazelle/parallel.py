@@ -0,0 +1,222 @@
+import concurrent.futures, io, math, os, pickle
+
+# Local deps
+from .env import unbound
+from .sym import eof, Symbol
+
+### Parallel map
+# `map` calls a procedure on each element of a list one after another,
+# so a program that does a lot of work on each element can only ever
+# use one core. `pmap` sends the elements to a pool of worker processes
+# in chunks instead, and puts the results back together in order:
+#
+#   (pmap (\ (n) (count-primes-below n)) '(100000 200000 300000 400000))
+#
+# `pfor-each` does the same for procedures that are only run for what
+# they do, like writing files, and doesn't collect their results.
+#
+# A procedure is sent to a worker along with the environment it was
+# made in, and every environment around that, so it takes the variables
+# it uses along with it. The global environment is special: the worker
+# has its own, and builtins are sent by name. Of what the program has
+# defined or changed in it, only the variables the procedure refers to
+# (or that the ones it refers to refer to, and so on) are sent, once to
+# each worker as it starts rather than with every chunk. The pool is
+# started again when a later `pmap` needs different ones. Workers can't
+# change anything in the program that started them, so `pmap` is only
+# for procedures that don't `set!` variables outside of themselves.
+#
+# `stdenv` makes `pmap` a builtin, so it's only imported here
+# once it's needed.
+#
+# Every evaluator's procedures can be sent this way. The closure
+# compiler's procedures are analyzed again by the worker, since python
+# can't send the functions it compiles them into.
+
+# How many worker processes to use, if not one for each core
+processes = None
+
+# The pool, started the first time something is run in parallel, and
+# the globals its workers were started with
+pool = None
+pool_globals = None
+
+# Set in worker processes, which run `pmap` one element at a time
+# rather than starting pools of their own
+worker = False
+
+# Bytes -> ProcessPoolExecutor
+def executor(globals_data):
+  ''' The pool of worker processes, with globals_data (from
+  `dumps_globals()`) defined in each, starting it if it isn't yet. '''
+
+  global pool, pool_globals
+  if pool is not None and pool_globals != globals_data:
+    pool.shutdown()
+    pool = None
+  if pool is None:
+    pool = concurrent.futures.ProcessPoolExecutor(workers(),
+      initializer=start_worker, initargs=(globals_data,))
+    pool_globals = globals_data
+  return pool
+
+# None -> Integer
+def workers():
+  ''' How many worker processes there are, or would be. '''
+
+  return processes or os.cpu_count() or 1
+
+# Bytes -> None
+def start_worker(globals_data):
+  ''' Run in each worker as it starts: define the globals it's sent. '''
+
+  from . import stdenv
+  global worker
+  worker = True
+  for var, value in loads(globals_data):
+    stdenv.global_env[var] = value
+
+### Sending procedures
+# Objects that are the same in every process are sent as references
+# rather than copied: the builtins, and the uninterned symbols that
+# `is` is used to check for.
+special = {'#<unbound>': unbound, '#<eof>': eof}
+
+# Object -> Boolean
+def defined(var, value):
+  ''' Has var been defined or changed in the global environment since
+  it was made? '''
+
+  from . import stdenv
+  return stdenv.initial.get(var, unbound) is not value
+
+# Pickles with what has been defined in the global environment if
+# with_globals is true, and adds each symbol it pickles to symbols
+# if it's given
+class Pickler(pickle.Pickler):
+
+  def __init__(self, file, with_globals, symbols=None):
+    pickle.Pickler.__init__(self, file, pickle.HIGHEST_PROTOCOL)
+    self.with_globals, self.symbols = with_globals, symbols
+
+  def persistent_id(self, obj):
+    from . import stdenv
+    if obj is unbound or obj is eof:
+      return ('special', str(obj))
+    name = stdenv.builtin_names.get(id(obj))
+    if name is not None and stdenv.initial[name] is obj:
+      return ('builtin', name)
+    return None
+
+  def reducer_override(self, obj):
+    from . import stdenv
+    if self.symbols is not None and type(obj) is Symbol:
+      self.symbols.add(obj)
+    if obj is stdenv.global_env:
+      # Filled in after it's been remembered, so that procedures
+      # defined in it can refer back to it
+      changes = [(var, value) for var, value in obj.items() if defined(var, value)] \
+        if self.with_globals else []
+      return (global_environment, (), None, None, iter(changes))
+    return NotImplemented
+
+class Unpickler(pickle.Unpickler):
+
+  def persistent_load(self, pid):
+    from . import stdenv
+    kind, name = pid
+    if kind == 'special':
+      return special[name]
+    return stdenv.initial[name]
+
+# None -> Environment
+def global_environment():
+  ''' The global environment of this process. '''
+
+  from . import stdenv
+  return stdenv.global_env
+
+# Object, Boolean -> Bytes
+def dumps(obj, with_globals):
+  ''' Pickle obj to send to another process, along with what has been
+  defined in the global environment if with_globals is true. '''
+
+  f = io.BytesIO()
+  Pickler(f, with_globals).dump(obj)
+  return f.getvalue()
+
+# Object -> Bytes
+def dumps_globals(obj):
+  ''' Pickle what has been defined or changed in the global environment
+  that obj refers to, by name, directly or through other globals. '''
+
+  from . import stdenv
+  changed = dict((var, value) for var, value in stdenv.global_env.items() if defined(var, value))
+  needed, seen, pending = [], set(), [obj]
+  while pending:
+    symbols = set()
+    Pickler(io.BytesIO(), False, symbols).dump(pending)
+    pending = []
+    for var in sorted(symbols - seen):
+      seen.add(var)
+      if var in changed:
+        needed.append((var, changed[var]))
+        pending.append(changed[var])
+  return dumps(needed, False)
+
+# Bytes -> Object
+def loads(data):
+  ''' Unpickle something made by `dumps()`. '''
+
+  return Unpickler(io.BytesIO(data)).load()
+
+# Bytes -> Bytes
+def run_chunk(data):
+  ''' Run in a worker: call a procedure on each of a chunk of elements. '''
+
+  f, items, keep = loads(data)
+  results = [f(item) for item in items]
+  return dumps(results if keep else None, False)
+
+# Procedure, List, Integer, Boolean -> List
+def run(f, items, chunksize, keep):
+  ''' Call f on every item in the pool, in chunks of chunksize. '''
+
+  # There's nothing to gain by sending things to a single worker
+  items = list(items)
+  if worker or len(items) < 2 or workers() < 2:
+    results = [f(item) for item in items]
+    return results if keep else None
+
+  if chunksize is None:
+    # A few chunks for each worker, so that one slow chunk
+    # doesn't leave the rest of them waiting
+    chunksize = max(1, math.ceil(len(items) / (workers() * 4)))
+
+  pool = executor(dumps_globals(f))
+  futures = [pool.submit(run_chunk, dumps((f, items[i:i + chunksize], keep), False))
+    for i in range(0, len(items), chunksize)]
+
+  results = []
+  for future in futures:
+    chunk = loads(future.result())
+    if keep:
+      results.extend(chunk)
+  return results if keep else None
+
+### Builtins
+
+# Procedure, List, (Integer) -> List
+def pmap(f, items, chunksize=None):
+  ''' (pmap f list), (pmap f list chunksize) '''
+  return run(f, items, chunksize, True)
+
+# Procedure, List, (Integer) -> None
+def pfor_each(f, items, chunksize=None):
+  ''' (pfor-each f list), (pfor-each f list chunksize) '''
+  run(f, items, chunksize, False)
+
+builtins = {
+  'pmap':      pmap,
+  'pfor-each': pfor_each,
+}
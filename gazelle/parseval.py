@@ -1,10 +1,15 @@
 # Local deps
+from . import cache, modules, optimizer
 from .atomizer import Atomizer
 from .env import Environment
 from .gazellestr import gazellestr
-from .stdenv import global_env
+from .pair import freeze, to_list
+from .optimizer import optimize
+from .nodes import Node, Const, Ref, If, Set, Def, Lambda, Begin, While, \
+  Primitive, Include, Stdlib, Import, Provide, App
+from .stdenv import global_env, check_expect, check_within, member, display
 from .sym import eof, Symbol, Symbols, Quotes
-import collections, io
+import collections.abc, io, os, time
 
 ### Parser
 # Atomizer -> Gazelle Expression
@@ -12,37 +17,55 @@ def parse(atomizer, file=False):
   ''' Parse a program: read and expand/error-check it '''
 
   if file:
-    
-    atomizer = Atomizer(open(atomizer))
+
+    with open(atomizer) as f:
+      return optimize(expand(Atomizer(f).read(), toplevel=True))
 
   else:
     
     # Backwards compatibility: given a str, convert it to an atomizer
     atomizer = Atomizer(io.StringIO(atomizer))
   
-  return expand(atomizer.read(), toplevel=True)
-
-# Atomized Gazelle Expression, (Boolean) -> Gazelle Expression
-def expand(expr, toplevel=False):
-  ''' Expand turns an atomized gazelle expression into an expression
-  that is readily readable by `gazeval()`. You can view this as
-  sort of making an AST, though it's more like something
-  that optimizes and expands syntactic sugar. This also checks
-  syntax for any errors.
+  return optimize(expand(atomizer.read(), toplevel=True))
+
+# Atomized Gazelle Expression, (Boolean, Integer) -> Node
+def expand(expr, toplevel=False, line=None):
+  ''' Expand turns an atomized gazelle expression into a tree of nodes
+  (see `nodes.py`) that is readily readable by `gazeval()`. You can view
+  this as making an AST, which also expands syntactic sugar and macros
+  along the way. This also checks syntax for any errors.
   
   We can't just name this parse and expect it to work with the atomizer
   object. It recursively looks at the expression and changes it,
-  so it would not work at all with the way the `Atomizer` class works. '''
+  so it would not work at all with the way the `Atomizer` class works.
+
+  `line` is where expr came from, if it doesn't know itself. '''
+
+  # Anything that has already been expanded stays as it is
+  if isinstance(expr, Node):
+    return expr
 
   # Our input expression should not be an empty list
   # () => Error
-  if expr == []:
+  elif expr == []:
     raise SyntaxError('Expression is empty')
 
-  # If it isn't a list, we don't need to expand it
-  # constant => unchanged
+  # Symbols are variables
+  # var => Ref
+  elif isinstance(expr, Symbol):
+    return Ref(expr, line=line)
+
+  # If it isn't a list, it's a constant
+  # constant => Const
   elif not isinstance(expr, list):
-    return expr
+    return Const(expr, line=line)
+
+  # Lists read from the input know which line they started on
+  line = getattr(expr, 'line', line)
+
+  # Expand each subexpression of a list, which is in the same place
+  def each(exprs):
+    return tuple(expand(subexpr, line=line) for subexpr in exprs)
 
   # The leftmost term should always be a procedure.
   # We use this to compare it to our symbol table
@@ -57,7 +80,7 @@ def expand(expr, toplevel=False):
       raise SyntaxError(gazellestr(expr) + ': quote has recieved '
         + str(len(expr) - 1) + ' arguments, not 1')
 
-    return expr
+    return Const(to_list(expr[1]), line=line)
 
   # Check our if statement and make the proper optimizations,
   # check it's arguments, and expand them
@@ -75,7 +98,7 @@ def expand(expr, toplevel=False):
       raise SyntaxError(gazellestr(expr) + ': if statement has recieved '
         + str(len(expr) - 1) + ' arguments, not 2 or 3')
 
-    return list(list(map(expand, expr)))
+    return If(*each(expr[1:]), line=line)
 
   # Make sure we are only applying set! to a symbol
   # (set! var expr)
@@ -91,7 +114,7 @@ def expand(expr, toplevel=False):
       raise SyntaxError(gazellestr(expr) + 
         ': set! expects a symbol')
 
-    return [Symbols['set!'], var, expand(expr)]
+    return Set(var, expand(expr, line=line), line=line)
 
   # Validate def and macro
   # (def var expr), (macro var expr)
@@ -124,7 +147,8 @@ def expand(expr, toplevel=False):
       
       # ... => (def name (lambda (args) body))
       name, args = var[0], var[1:]
-      return expand([procedure, name, [Symbols['lambda'], args] + body])
+      return expand([procedure, name, [Symbols['lambda'], args] + body],
+        toplevel, line)
 
     else:
       
@@ -139,7 +163,7 @@ def expand(expr, toplevel=False):
           ': definition expects to bind to a symbol')
 
       # Expand the expression we want to bind to v
-      exp = expand(expr[2])
+      exp = expand(expr[2], line=line)
 
       # Macro expansion
       if procedure is Symbols['macro']:
@@ -147,28 +171,22 @@ def expand(expr, toplevel=False):
           raise SyntaxError(gazellestr(expr) + 
             ': macros can only be defined at the top level') 
 
-        proc = gazeval(exp)
-
-        if not isinstance(proc, collections.Callable):
-          raise SyntaxError(gazellestr(expr) + 
-            ': macro must be a procedure, not an atom or list')   
-        
-        # Add our macro to the macro table
-        # (macro v proc)
-        macro_table[var] = proc
-
         # => None; add v:proc to macro_table
-        return None
+        define_macro(var, exp)
+        return Const(None, line=line)
 
-      return [Symbols['def'], var, exp]
+      return Def(var, exp, line=line)
 
   # Expand the content of begin if it exists
   elif procedure is Symbols['begin']:
     # Prevents infinite loop
-    if len(expr)==1:
-      return None
-    else: 
-      return [expand(xi, toplevel) for xi in expr]
+    if len(expr) == 1:
+      return Const(None, line=line)
+
+    # Subexpressions are expanded in order, so a macro that's defined
+    # or loaded by one of them can be used by the ones after it
+    body = tuple(expand(xi, toplevel, line) for xi in expr[1:])
+    return body[0] if len(body) == 1 else Begin(body, line=line)
 
   # Expand a lambda expression
   # (lambda (expr) e1 e2) 
@@ -188,7 +206,8 @@ def expand(expr, toplevel=False):
 
     exp = body[0] if len(body) == 1 else [Symbols['begin']] + body
 
-    return [Symbols['lambda'], var, expand(exp)]   
+    params = var if isinstance(var, Symbol) else list(var)
+    return Lambda(params, expand(exp, line=line), line=line)
 
   # Expand quasiquote
   # `expr => expand_quasiquote(expr)
@@ -196,17 +215,79 @@ def expand(expr, toplevel=False):
     if len(expr) != 2:
       raise SyntaxError(gazellestr(expr) + 
         ': quasiquote (`) expects at least 2 arguments')
-    return expand_quasiquote(expr[1])
+    return expand(expand_quasiquote(expr[1]), line=line)
+
+  # (return expr) => expr
+  elif procedure is Symbols['return']:
+    if len(expr) != 2:
+      raise SyntaxError(gazellestr(expr) + ': return expects 1 argument')
+    return expand(expr[1], line=line)
+
+  # (while test body)
+  elif procedure is Symbols['while']:
+    if len(expr) != 3:
+      raise SyntaxError(gazellestr(expr) + ': while expects 2 arguments')
+    return While(*each(expr[1:]), line=line)
+
+  # Load the file now, so that the macros it defines can be used
+  # by whatever comes after it
+  # (include "filepath")
+  elif procedure is Symbols['include']:
+    if len(expr) != 2 or not isinstance(expr[1], str) or isinstance(expr[1], Symbol):
+      raise SyntaxError(gazellestr(expr) + ': include expects a file path')
+    path = find(expr[1]) or expr[1]
+    return Include(expr[1], load(path), line=line)
+
+  # (import name), (import "filepath")
+  elif procedure is Symbols['import']:
+    if len(expr) != 2 or not isinstance(expr[1], str):
+      raise SyntaxError(gazellestr(expr) + ': import expects a module name')
+    path = find(expr[1])
+    if path is None:
+      raise ImportError(gazellestr(expr) + ': can\'t find module ' + expr[1])
+    program = load(path)
+    return Import(expr[1], path, program, modules.provided(program), line=line)
+
+  # (provide var...)
+  elif procedure is Symbols['provide']:
+    if not all(isinstance(var, Symbol) for var in expr[1:]):
+      raise SyntaxError(gazellestr(expr) + ': provide expects symbols')
+    return Provide(tuple(expr[1:]), line=line)
+
+  # (stdlib)
+  elif procedure is Symbols['stdlib']:
+    return Stdlib(load(stdlib_path), line=line)
+
+  # (display expr), (check-expect expr expected), ...
+  elif isinstance(procedure, Symbol) and procedure in primitives:
+    proc, arity = primitives[procedure]
+    if len(expr) - 1 != arity:
+      raise SyntaxError(gazellestr(expr) + ': ' + procedure + ' expects '
+        + str(arity) + ' arguments, not ' + str(len(expr) - 1))
+    return Primitive(procedure, proc, each(expr[1:]), line=line)
 
   # Expand macros that already exist
   # (m arg...) 
   elif isinstance(procedure, Symbol) and procedure in macro_table:
-    return expand(macro_table[procedure](*expr[1:]), toplevel)
+    return expand_macro(procedure, expr, toplevel, line)
 
   # Otherwise we need to keep expanding the expression
   else:
     # (f arg...) => expand each
-    return list(list(map(expand, expr)))
+    exprs = each(expr)
+    return App(exprs[0], exprs[1:], line=line)
+
+# Special forms that evaluate all of their arguments and call a python
+# procedure with them, and how many arguments they take
+primitives = {
+  Symbols['check-expect']: (check_expect, 2),
+  Symbols['check-within']: (check_within, 3),
+  Symbols['member?']:      (member, 2),
+  Symbols['display']:      (display, 1),
+}
+
+# Where `(stdlib)` loads the standard library from
+stdlib_path = os.path.join(modules.library, 'stdlib.gel')
 
 # Gazelle Expression -> Gazelle Expression
 def expand_quasiquote(expr):
@@ -257,7 +338,253 @@ def let(*args):
 
   return [[Symbols['lambda'], list(var)]+list(map(expand, args[1:]))] + list(map(expand, vals))
 
-macro_table = {Symbols['let']:let} ## More macros can go here
+# Arguments -> Gazelle Expression
+def delay(*args):
+  ''' Delay macro: (delay expr) => (make-promise (lambda () expr)) '''
+
+  if len(args) != 1:
+    raise SyntaxError(gazellestr([Symbols['delay']] + list(args)) + ': delay expects 1 argument')
+
+  return [Symbols['make-promise'], [Symbols['lambda'], [], args[0]]]
+
+# Arguments -> Gazelle Expression
+def def_memo(*args):
+  ''' Def-memo macro: (def-memo var exp) => (def var (memoize exp)),
+  (def-memo var size exp) => (def var (memoize exp size)),
+  (def-memo (var args) body) => (def var (memoize (lambda (args) body))) '''
+
+  # Like `def`, but (def-memo (f) body) is a procedure too
+  if len(args) >= 2 and isinstance(args[0], list) and args[0] and \
+      all(isinstance(v, Symbol) for v in args[0]):
+    return [Symbols['def'], args[0][0],
+      [Symbols['memoize'], [Symbols['lambda'], list(args[0][1:])] + list(args[1:])]]
+
+  if len(args) not in (2, 3) or not isinstance(args[0], Symbol):
+    raise SyntaxError(gazellestr([Symbols['def-memo']] + list(args)) +
+      ': def-memo expects a variable, an optional size and an expression')
+
+  return [Symbols['def'], args[0], [Symbols['memoize'], args[-1]] + list(args[1:-1])]
+
+macro_table = {Symbols['let']:let, Symbols['delay']:delay, Symbols['def-memo']:def_memo} ## More macros can go here
+
+# The expanded procedure of every macro defined by a program, by name
+macro_sources = {}
+
+# Symbol, Node -> None
+def define_macro(var, exp):
+  ''' Evaluate the expression for a macro's procedure and add it to the
+  macro table under var. '''
+
+  proc = gazeval(exp)
+
+  if not isinstance(proc, collections.abc.Callable):
+    raise SyntaxError(gazellestr([Symbols['macro'], var, exp]) +
+      ': macro must be a procedure, not an atom or list')
+
+  # Add our macro to the macro table
+  # (macro v proc)
+  macro_table[var] = proc
+  macro_sources[var] = exp
+  for frame in loading:
+    frame.macros.append((var, exp))
+  forget_expansions()
+
+### Macro expansion cache
+# Calling a macro written in gazelle means running its procedure in the
+# tree walker, and a recursive macro like `and` expands into a call to
+# itself, so it runs again for every argument it was given. Code that
+# uses macros a lot (or generates code that does) can spend most of its
+# time being expanded before it ever runs.
+#
+# Since nodes can't be changed, the node a macro call expanded to can be
+# handed out again the next time the same macro is called with the same
+# arguments, and none of that work has to be done twice. Arguments are
+# compared by their structure (see `freeze()` in `pair.py`), so the same
+# form written in two places only gets expanded once. This assumes that
+# macros only look at their arguments, which is what macros are for.
+#
+# Expanding can also change what later expansions do: defining a macro
+# or loading a file. Whenever that happens the cache is thrown away, and
+# nothing that did it while it was being expanded is kept.
+
+# Expansions by (macro procedure, frozen arguments, toplevel)
+expansions = {}
+
+# How many expansions to keep before starting over
+MAX_EXPANSIONS = 10000
+
+# Bumped whenever something happens that can change what expand does
+generation = 0
+
+# How often a macro has been called, how many of those were already in
+# the cache, and how many seconds the rest took to expand (along with
+# everything they expanded to)
+class MacroStats(object):
+  def __init__(self):
+    self.count, self.hits, self.time = 0, 0, 0.0
+
+  def __repr__(self):
+    return 'MacroStats(count=%d, hits=%d, time=%f)' % (self.count, self.hits, self.time)
+
+# Stats for each macro, by name
+macro_stats = collections.defaultdict(MacroStats)
+
+# None -> None
+def forget_expansions():
+  ''' Throw away every cached expansion. '''
+
+  global generation
+  generation += 1
+  expansions.clear()
+
+# Symbol, Gazelle Expression, Boolean, Integer -> Node
+def expand_macro(name, expr, toplevel, line):
+  ''' Expand a call to the macro `name`, using the cached expansion of
+  it if there is one. '''
+
+  proc, stats = macro_table[name], macro_stats[name]
+  stats.count += 1
+
+  try:
+    key = (proc, freeze(expr[1:]), toplevel)
+  except TypeError:
+    key = None
+
+  if key is not None and key in expansions:
+    stats.hits += 1
+    return expansions[key]
+
+  before, start = generation, time.perf_counter()
+  try:
+    # Macros written in gazelle may build their expansion out of pairs
+    node = expand(to_list(proc(*expr[1:])), toplevel, line)
+  finally:
+    stats.time += time.perf_counter() - start
+
+  # Keep it, unless expanding it defined or loaded something
+  if key is not None and generation == before:
+    if len(expansions) >= MAX_EXPANSIONS:
+      expansions.clear()
+    expansions[key] = node
+  return node
+
+# None -> [(Symbol, MacroStats)]
+def expansion_stats():
+  ''' Every macro that has been expanded, and how often,
+  from the one that took the longest. '''
+
+  return sorted(macro_stats.items(), key=lambda item: -item[1].time)
+
+### Loading files
+# `(stdlib)`, `(include ...)` and running a file from the commandline all
+# go through `load()`, which keeps expanded programs in the cache (see
+# `cache.py`) so that a file only goes through the front end once.
+#
+# Since `include` and `stdlib` load their file while they're being
+# expanded, the program a file expands to contains the programs of the
+# files it loads, so its entry in the cache depends on those too.
+#
+# `expand()` rewrites calls to macros, so what a file expands to also
+# depends on the macros that were already defined when it was loaded.
+# Those are saved along with the program, and the cached program is only
+# used if they are still the same. Macros the file defines itself are
+# left out, so that loading a file again doesn't miss just because the
+# first load defined them. Whether the program was optimized (see
+# `optimizer.py`) is saved as well, along with the builtins the optimizer
+# assumed hadn't been redefined, since a file that's loaded after
+# another one redefines `+` can't have its calls to `+` folded.
+#
+# Which file an include or import finds can depend on the current
+# directory, so where each one was found is saved too, and the cached
+# program is only used if they'd all still be found in the same place.
+
+# A file that's being expanded, the macros that have been defined while
+# expanding it, the files it has loaded (with their cache stamps) and
+# where the files it includes and imports were found
+class Loading(object):
+  def __init__(self, path):
+    self.path, self.macros, self.files, self.found = path, [], [], []
+
+# Every file being expanded, from the outermost in
+loading = []
+
+# None -> String or None
+def origin():
+  ''' The file being expanded, if any. '''
+
+  return loading[-1].path if loading else None
+
+# String or Symbol -> String or None
+def find(name):
+  ''' Find a file that's being included or imported on the search path
+  (see `modules.py`), remembering where it was found. '''
+
+  where = origin()
+  path = modules.find(name, where)
+  if loading:
+    loading[-1].found.append((name, where, path))
+  return path
+
+# [Symbol], (Dict) -> [(Symbol, Node)]
+def macro_context(own, sources=None):
+  ''' The macros defined so far, or in sources, except for
+  the ones named in own. '''
+
+  if sources is None:
+    sources = macro_sources
+  return sorted((var, exp) for var, exp in sources.items() if var not in own)
+
+# String -> Node
+def load(path):
+  ''' Parse a file like `parse(path, file=True)` does, but use the cached
+  expansion of it if there is one, defining the macros it defines. '''
+
+  if any(frame.path == os.path.abspath(path) for frame in loading):
+    raise SyntaxError(path + ': file includes itself')
+
+  # Expansions made before the file was loaded might not be
+  # what the same code expands to after it
+  forget_expansions()
+
+  caching = cache.directory() is not None
+
+  if caching:
+    cached = cache.fetch(path)
+    if cached is not None:
+      stamp, (program, macros, context, files, optimized, assumed, found) = cached
+      if macro_context([var for var, _ in macros]) == context and \
+          optimized == optimizer.enabled and optimizer.still_builtins(assumed) and \
+          all(cache.unchanged(*file) for file in files) and \
+          all(modules.find(name, where) == path for name, where, path in found):
+        for var, exp in macros:
+          define_macro(var, exp)
+        for frame in loading:
+          frame.files += [(path, stamp)] + files
+          frame.found += found
+        optimizer.assumed.update(assumed)
+        return program
+
+  stamp = cache.stamp(path) if caching else None
+  frame, before = Loading(os.path.abspath(path)), macro_sources.copy()
+  loading.append(frame)
+  # Collect what the optimizer assumes about this file (and the ones it
+  # loads) on its own, then add it to what the file loading it assumes
+  outside, optimizer.assumed = optimizer.assumed, set()
+  try:
+    program = parse(path, file=True)
+  finally:
+    loading.pop()
+    assumed, optimizer.assumed = optimizer.assumed, outside | optimizer.assumed
+
+  for outer in loading:
+    outer.files += [(path, stamp)] + frame.files
+    outer.found += frame.found
+
+  if caching:
+    context = macro_context([var for var, _ in frame.macros], before)
+    cache.store(path, stamp, (program, frame.macros, context, frame.files, optimizer.enabled,
+      sorted(assumed), frame.found))
+  return program
 
 ### Procedures
 # A procedure as implemented in gazelle is a lambda expression as
@@ -298,9 +625,13 @@ macro_table = {Symbols['let']:let} ## More macros can go here
 #  `(def func (lamb (args) (func)))`
 # as the environment `func` is defined in will be passed to the `Procedure`
 # object, allowing it to access itself
+#
+# A procedure also remembers the name it was first bound to with `def`,
+# if it has been, for the profiler.
 class Procedure(object):
   def __init__(self, params, body, env):
     self.params, self.body, self.env = params, body, env
+    self.name = None
 
   def __call__(self, *args): 
     ''' A `Procedure` is a function, therefore we should be able to
@@ -308,111 +639,116 @@ class Procedure(object):
     Note that the environment is created each time the procedure is
     called. '''
 
+    # Apply it the way `gazeval()` does, so the profiler sees the call
+    if profile is not None:
+      return gazeval(App(Const(self), tuple(Const(arg) for arg in args)))
+
     return gazeval(self.body, Environment(self.params, args, self.env))
 
+# The `Profiler` (see `profiler.py`) that `gazeval()` reports to, if any
+profile = None
+
 ### gazeval
-# Gazelle expression -> Evaluated Gazelle expression
+# Node -> Evaluated Gazelle expression
 def gazeval(expr, env=global_env):
   ''' Evaluate an expression in an environment. '''
   # TODO: Missing unquote
 
-  while True:
-    # variable reference
-    if isinstance(expr, Symbol):
-      return env.find(expr)[expr]
-
-    # constant literal
-    elif not isinstance(expr, list):
-      return expr
-
-    # procedure = (func arg1 arg2 arg3 ...)
-    procedure = expr[0]
-
-    # (quote subexpr)
-    if procedure is Symbols['quote']:     
-      # (_, subexpr) = expr
-      return expr[1]
-
-    # (if test conseq else)
-    elif procedure is Symbols['if']:        
-      # (_, test, conseq, alt) = expr
-      expr = (expr[2] if gazeval(expr[1], env) else expr[3])
-
-    # (set! var expr)
-    elif procedure is Symbols['set!']:      
-      # (_, var, subexpr) = expr
-      env.find(expr[1])[expr[1]] = gazeval(expr[2], env)
-      return None
-
-    # (def var expr)
-    elif procedure is Symbols['def']:
-      # (_, var, subexpr) = expr
-      env[expr[1]] = gazeval(expr[2], env)
-
-      return None
-    # (lambda (var*) expr)
-    elif procedure is Symbols['lambda']:
-      # (_, vars, subexpr) = expr
-      return Procedure(expr[1], expr[2], env)
-
-    # (begin expr+)
-    elif procedure is Symbols['begin']:
-      for subexpr in expr[1:-1]:
-        gazeval(expand(subexpr), env)
-      expr = expr[-1]
-
-    # test exact
-    elif procedure == Symbols['check-expect']:
-      # (_, var, subexpr) = expr
-      return (gazeval(expr[1], env) == gazeval(expr[2], env))
-
-    # test range
-    elif procedure == Symbols['check-within']: 
-      # (_, var, lower_bound, upper_bound) = expr
-      return ((gazeval(expr[1], env) <= gazeval(expr[3], env) and
-          (gazeval(expr[1], env) >= gazeval(expr[2], env))))
-    
-    # (member? var list)
-    elif procedure == Symbols['member?']: 
-      # (_, var, lst) = expr
-      return (gazeval(expr[1], env) in gazeval(expr[2], env))
-    
-    # (display symbol/var)
-    elif procedure == Symbols['display']:
-      # (_, body) = expr
-      print(gazellestr(gazeval(expr[1], env)))
-      return None
-
-    # (return exp)
-    elif procedure == Symbols['return']:
-      # (_, body) = expr
-      return gazeval(expr[1], env)
-
-    # (include "filepath")
-    elif procedure == Symbols['include']:
-      # (_, file) = expr
-      return gazeval(parse(expr[1], file=True), env)
-
-    # (stdlib)
-    elif procedure == Symbols['stdlib']:
-      gazeval(parse('./lib/stdlib.gel', file=True), env)
-      return None
-
-    # (while cond body)
-    elif procedure == Symbols['while']:
-
-      # (_, cond, body) = expr
-      while gazeval(expr[1], env):
-        gazeval(expr[2], env)
-
-      return None
-    
-    # (proc expr*)
-    else:                    
-      subexprs = [gazeval(subexpr, env) for subexpr in expr]
-      proc = subexprs.pop(0)
-      if isinstance(proc, Procedure):
-        expr = proc.body
-        env = Environment(proc.params, subexprs, proc.env)
+  # Whether this call is running a procedure the profiler knows about
+  profiled = False
+
+  try:
+    while True:
+      kind = type(expr)
+
+      # variable reference
+      if kind is Ref:
+        return env.find(expr.var)[expr.var]
+
+      # constant literal
+      elif kind is Const:
+        return expr.value
+
+      # (proc expr*)
+      elif kind is App:
+        proc = gazeval(expr.proc, env)
+        args = [gazeval(arg, env) for arg in expr.args]
+        if isinstance(proc, Procedure):
+          if profile is not None:
+            if profiled:
+              profile.tail(profile.name(proc))
+            else:
+              profile.enter(profile.name(proc))
+              profiled = True
+          expr = proc.body
+          env = Environment(proc.params, args, proc.env)
+        elif profile is not None:
+          return profile.call(proc, args)
+        else:
+          return proc(*args)
+
+      # (if test conseq else)
+      elif kind is If:
+        expr = (expr.conseq if gazeval(expr.test, env) else expr.alt)
+
+      # (begin expr+)
+      elif kind is Begin:
+        for subexpr in expr.body[:-1]:
+          gazeval(subexpr, env)
+        expr = expr.body[-1]
+
+      # (set! var expr)
+      elif kind is Set:
+        env.find(expr.var)[expr.var] = gazeval(expr.value, env)
+        return None
+
+      # (def var expr)
+      elif kind is Def:
+        value = env[expr.var] = gazeval(expr.value, env)
+        # Procedures are named after what they're first defined as
+        if type(value) is Procedure and value.name is None:
+          value.name = expr.var
+        return None
+
+      # (lambda (var*) expr)
+      elif kind is Lambda:
+        return Procedure(expr.params, expr.body, env)
+
+      # (while cond body)
+      elif kind is While:
+        while gazeval(expr.test, env):
+          gazeval(expr.body, env)
+        return None
+
+      # (display symbol/var), (check-expect ...), ...
+      elif kind is Primitive:
+        args = [gazeval(arg, env) for arg in expr.args]
+        if profile is not None:
+          return profile.call(expr.proc, args)
+        return expr.proc(*args)
+
+      # (include "filepath")
+      elif kind is Include:
+        expr = expr.program
+
+      # (stdlib)
+      elif kind is Stdlib:
+        gazeval(expr.program, env)
+        return None
+
+      # (import name)
+      elif kind is Import:
+        modules.link(expr, env, gazeval)
+        return None
+
+      # (provide var...)
+      elif kind is Provide:
+        return None
+
+      # anything else is a value already
       else:
-        return proc(*subexprs)
\ No newline at end of file
+        return expr
+
+  finally:
+    if profiled:
+      profile.exit()
@@ -0,0 +1,128 @@
+import time
+
+### Profiler
+# Python's own profilers can only see the evaluator: every gazelle
+# procedure looks like another call to `gazeval()` or a lambda.
+#
+# A `Profiler` keeps its own stack of the gazelle procedures and builtins
+# that are running instead, which `gazeval()` pushes onto and pops off of
+# while `parseval.profile` is set to one. For each procedure (named by
+# the `def` it was bound with, or where its lambda was written) and
+# builtin it counts how many times it was called, how many of those were
+# tail calls, the time spent inside it including what it called
+# (inclusive) and the time spent in it alone (self).
+#
+# A tail call replaces the procedure on top of the stack rather than
+# going on top of it, just like it replaces the procedure that made it
+# in `gazeval()`. Time spent in a procedure that calls itself is only
+# counted once towards its inclusive time.
+#
+# Self time is also kept for each whole stack, which `collapsed()`
+# writes out in the format flame graph tools read: the names on the
+# stack from the outside in, separated by `;`, and the number of
+# microseconds spent there.
+
+# What's known about one procedure or builtin
+class Stats(object):
+  __slots__ = ('calls', 'tail_calls', 'inclusive', 'own')
+
+  def __init__(self):
+    self.calls, self.tail_calls, self.inclusive, self.own = 0, 0, 0.0, 0.0
+
+# A procedure or builtin that's running: its name, when it started and
+# how long the things it called have taken so far
+class Frame(object):
+  __slots__ = ('name', 'start', 'children')
+
+  def __init__(self, name, start):
+    self.name, self.start, self.children = name, start, 0.0
+
+class Profiler(object):
+
+  def __init__(self, env):
+    self.stats, self.stacks, self.frames, self.active = {}, {}, [], {}
+
+    # Builtins are named by what they're bound to
+    self.names = {}
+    for name, value in env.items():
+      if callable(value):
+        self.names.setdefault(id(value), name)
+
+  # Procedure -> String
+  def name(self, proc):
+    ''' The name proc is reported under. '''
+
+    name = getattr(proc, 'name', None)
+    if name is not None:
+      return name
+    if hasattr(proc, 'body'):
+      line = getattr(proc.body, 'line', None)
+      return '<lambda>' if line is None else '<lambda:%d>' % line
+    return self.names.get(id(proc)) or getattr(proc, '__name__', repr(proc))
+
+  # String -> None
+  def enter(self, name):
+    ''' Start running name on top of whatever is running now. '''
+
+    self.frames.append(Frame(name, time.perf_counter()))
+    self.active[name] = self.active.get(name, 0) + 1
+    stats = self.stats.get(name)
+    if stats is None:
+      stats = self.stats[name] = Stats()
+    stats.calls += 1
+
+  # None -> None
+  def exit(self):
+    ''' Stop running whatever is on top. '''
+
+    frame = self.frames.pop()
+    elapsed = time.perf_counter() - frame.start
+    own = elapsed - frame.children
+
+    stats = self.stats[frame.name]
+    stats.own += own
+    self.active[frame.name] -= 1
+    if not self.active[frame.name]:
+      stats.inclusive += elapsed
+
+    stack = tuple(f.name for f in self.frames) + (frame.name,)
+    self.stacks[stack] = self.stacks.get(stack, 0.0) + own
+
+    if self.frames:
+      self.frames[-1].children += elapsed
+
+  # String -> None
+  def tail(self, name):
+    ''' Replace whatever is on top with name. '''
+
+    self.exit()
+    self.enter(name)
+    self.stats[name].tail_calls += 1
+
+  # Procedure, [Object] -> Object
+  def call(self, proc, args):
+    ''' Call a builtin, timing it. '''
+
+    self.enter(self.name(proc))
+    try:
+      return proc(*args)
+    finally:
+      self.exit()
+
+  # (Integer) -> String
+  def report(self, limit=None):
+    ''' A table of what was called, from the most inclusive time. '''
+
+    rows = sorted(self.stats.items(), key=lambda item: -item[1].inclusive)
+    lines = ['%-30s %10s %10s %12s %12s' % ('name', 'calls', 'tail', 'inclusive', 'self')]
+    for name, stats in rows[:limit]:
+      lines.append('%-30s %10d %10d %11.6fs %11.6fs' % (name, stats.calls,
+        stats.tail_calls, stats.inclusive, stats.own))
+    return '\n'.join(lines)
+
+  # None -> String
+  def collapsed(self):
+    ''' The self time of every stack, for flame graphs. '''
+
+    return ''.join('%s %d\n' % (';'.join(stack), round(own * 1e6))
+      for stack, own in sorted(self.stacks.items()))
@@ -1,84 +1,163 @@
 # Local deps
 from . import colors
-from .atomizer import Atomizer
+from .atomizer import Atomizer, CHUNK_SIZE
 from .gazellestr import gazellestr
-from .parseval import gazeval, parse, gazellestr, global_env
+from .analyze import aeval
+from .cek import cekeval
+from .optimizer import optimize
+from .parseval import gazeval, expand, load, global_env
+from .sym import eof, Symbols
+from .vm import execute
+
+# Evaluators that can run a parsed program, by the name
+# they are selected with from the commandline
+engines = {
+  'tree':    gazeval,
+  'closure': aeval,
+  'vm':      execute,
+  'cek':     cekeval,
+}
+
+# Exception -> Boolean
+def explain(e):
+  ''' Print what went wrong, with a hint about why if it's the kind of
+  error gazelle programs usually run into. Returns whether it was. '''
+
+  colors.printf('[!] %s: %s' % (type(e).__name__, e), colors.FAIL)
+
+  # TypeErrors arise if a non-callable object is called 
+  # or non-iterable object is iterated over
+  if type(e) == TypeError:
+    if 'object is not callable' in str(e):
+      colors.printf('[#] This could be a problem because the lefthand term of an expression isn\'t a procedure\n[:] Make sure to use `quote` (\') on lists of atoms.', colors.FAIL)
+    if 'object is not iterable' in str(e):
+      colors.printf('[#] You cannot iterate over an atom or procedure.\n[:] In addition, some procedures only take lists as inputs.', colors.FAIL)
+      
+  # LookupErrors arise if a symbol can't be found in an Environment
+  elif type(e) == LookupError:
+    colors.printf('[#] ' + str(e) + ' cannot be found in the current scope.\n[:] This might be a typo, or this symbol is not defined', colors.FAIL)
+
+  # ValueErrors occur if the user tries to give a procedure more arguments than it needs
+  elif type(e) == ValueError:
+    colors.printf('[#] You are trying to give a procedure more arguments than it can handle.', colors.FAIL)
+  else:
+    return False
+
+  return True
+
+# String, (Procedure) -> Boolean
+def run_file(path, evaluate=gazeval):
+  ''' Evaluate a file, printing what went wrong if anything did.
+  Returns whether it ran without an error. '''
 
-def run_file(path):
   try:
-    gazeval(parse(path, file=True), global_env)
+    evaluate(load(path), global_env)
+    return True
   except Exception as e:
-    colors.printf('[!] %s: %s' % (type(e).__name__, e), colors.FAIL)
-
-    # TypeErrors arise if a non-callable object is called 
-    # or non-iterable object is iterated over
-    if type(e) == TypeError:
-      if 'object is not callable' in str(e):
-        colors.printf('[#] This could be a problem because the lefthand term of an expression isn\'t a procedure\n[:] Make sure to use `quote` (\') on lists of atoms.', colors.FAIL)
-      if 'object is not iterable' in str(e):
-        colors.printf('[#] You cannot iterate over an atom or procedure.\n[:] In addition, some procedures only take lists as inputs.', colors.FAIL)
-          
-    # LookupErrors arise if a symbol can't be found in an Environment
-    elif type(e) == LookupError:
-      colors.printf('[#] ' + str(e) + ' cannot be found in the current scope.\n[:] This might be a typo, or this symbol is not defined', colors.FAIL)
-
-    # ValueErrors occur if the user tries to give a procedure more arguments than it needs
-    elif type(e) == ValueError:
-      colors.printf('[#] You are trying to give a procedure more arguments than it can handle.', colors.FAIL)
-    else:
+    if not explain(e):
       raise e
+    return False
 
-# (String) -> None
-def run(prompt='gel> ', subprompt='> '):
+### Reading input
+# The REPL used to read a line, and if it started a list that wasn't
+# finished yet, read more lines until there were as many `)` as `(`,
+# counting them all again after every line. Parens in strings were
+# counted too, and the first error ended the session.
+#
+# Now what's typed is read by an `Atomizer`, which picks up where it
+# left off with each line, and every expression is evaluated as soon
+# as it's been read, even if there's more on the same line. An error
+# is printed and the REPL carries on with the next expression.
+#
+# `run_batch()` does the same with input that isn't typed, like a
+# program piped into `gazelle.py --batch`, reading it in chunks as
+# big as the ones files are read in.
+
+# Input for an `Atomizer` that's typed at a prompt: `prompt` is shown
+# before the first line of an expression, and `subprompt` before
+# the lines that continue it
+class Prompter(object):
+  def __init__(self, prompt, subprompt):
+    self.prompt, self.subprompt, self.first = prompt, subprompt, True
+
+  # self -> String
+  def readline(self):
+    ''' Read a line the way files do, with an empty one at the end. '''
+
+    try:
+      line = input(self.prompt if self.first else self.subprompt)
+    except EOFError:
+      return ''
+    self.first = False
+    return line + '\n'
+
+# Gazelle Expression -> Node
+def compile_form(expr):
+  ''' Expand and optimize an expression that's been read. '''
+
+  return optimize(expand(expr, toplevel=True))
+
+# (String, String, Procedure) -> None
+def run(prompt='gel> ', subprompt='> ', evaluate=gazeval):
   ''' A prompt-read-gazeval-print loop.
   The repl
-   1. Reads from stdin through `raw_input`
-   2. Parses the input into an expanded gazelle expression
+   1. Reads an expression from stdin through `input`, a line at a time
+   2. Parses the expression into an expanded gazelle expression
       (barring no syntax errors)
    3. Evaluates the gazelle expression
    4. Returns the output to stdout through `print`
-   5. Goes back to step 1 '''
-  
-  try:
-    
-    while True:
-      
-      inpt = input(prompt)
+   5. Goes back to step 1, until it reads `quit` or the input ends '''
+
+  prompter = Prompter(prompt, (len(prompt) - len(subprompt)) * ' ' + subprompt)
+  reader = Atomizer(prompter, chunk_size=0)
+
+  while True:
+    # Only prompt for a new expression if the last line is used up
+    if not reader.pending():
+      prompter.first = True
 
-      if inpt == "quit": break
+    try:
+      try:
+        expr = reader.read()
+      except Exception:
+        # Whatever's left of the line can't be read either
+        reader.discard()
+        raise
 
-      # If the user has started a list, and
-      # the list is incomplete, allow the user to complete
-      # it on the next line
-      while list(inpt)[0] == '(' and inpt.count('(') != inpt.count(')'):
-        inpt += ' ' # Lack of an extra space may cause some programs to fail
-        inpt += input((len(prompt)-len(subprompt)) * ' ' + subprompt)
+      if expr is eof or expr is Symbols['quit']:
+        break
 
-      val = gazeval(parse(inpt), global_env)
+      val = evaluate(compile_form(expr), global_env)
 
       if val is not None:
         print(gazellestr(val))
 
+    except KeyboardInterrupt:
+      print()
+      reader.discard()
+    except Exception as e:
+      explain(e)
+
+# File, (Procedure) -> Boolean
+def run_batch(file, evaluate=gazeval):
+  ''' Evaluate each expression read from file as soon as it's been
+  read, printing the value of each one like the REPL does but without
+  prompting. Stops at the first error, and returns whether everything
+  ran without one. '''
+
+  reader = Atomizer(file, chunk_size=CHUNK_SIZE)
+
+  try:
+    while True:
+      expr = reader.read()
+      if expr is eof:
+        return True
+
+      val = evaluate(compile_form(expr), global_env)
+
+      if val is not None:
+        print(gazellestr(val))
   except Exception as e:
-    if isinstance(e, KeyboardInterrupt) or isinstance(e, EOFError):
-      pass
-    else:
-      colors.printf('[!] %s: %s' % (type(e).__name__, e), colors.FAIL)
-
-      # TypeErrors arise if a non-callable object is called 
-      # or non-iterable object is iterated over
-      if type(e) == TypeError:
-        if 'object is not callable' in str(e):
-          colors.printf('[#] This could be a problem because the lefthand term of an expression isn\'t a procedure\n[:] Make sure to use `quote` (\') on lists of atoms.', colors.FAIL)
-        if 'object is not iterable' in str(e):
-          colors.printf('[#] You cannot iterate over an atom or procedure.\n[:] In addition, some procedures only take lists as inputs.', colors.FAIL)
-          
-      # LookupErrors arise if a symbol can't be found in an Environment
-      elif type(e) == LookupError:
-        colors.printf('[#] ' + str(e) + ' cannot be found in the current scope.\n[:] This might be a typo, or this symbol is not defined', colors.FAIL)
-
-      # ValueErrors occur if the user tries to give a procedure more arguments than it needs
-      elif type(e) == ValueError:
-        colors.printf('[#] You are trying to give a procedure more arguments than it can handle.', colors.FAIL)
-      else:
-        raise e
+    if not explain(e):
+      raise e
+    return False
@@ -0,0 +1,129 @@
+# Local deps
+from .env import Environment, Frame, unbound
+from .gazellestr import gazellestr
+from .nodes import Node, Const, Ref, Def, Lambda, Include, Stdlib, Import, \
+  Provide, children
+from .sym import Symbol
+
+### Lexical addressing
+# Gazelle is lexically scoped: which variable a symbol refers to depends
+# only on where the symbol is written, not on how the program got there.
+# So instead of searching for a variable by name every time it's used,
+# we can work out once where it will be. A variable's *address* is
+# how many frames out from the current one it lives (its depth), and
+# its position in that frame (its index).
+#
+# A `Scope` describes the variables of one procedure while it's being
+# analyzed: its parameters, followed by everything its body `def`s.
+# Scopes are chained through `outer` just like the frames they describe
+# will be at runtime, with `None` standing in for the environment that
+# the whole program is evaluated in.
+#
+# Some procedures can't be described ahead of time: `(include ...)`,
+# `(stdlib)` and `(import ...)` define whatever is in the file they load. Those are
+# marked `dynamic`, get an `Environment` when called instead of a
+# `Frame`, and anything that can't be resolved before reaching them
+# is looked up by name.
+class Scope(object):
+
+  def __init__(self, params, body, outer=None):
+    self.params, self.outer = params, outer
+
+    names = [params] if isinstance(params, Symbol) else list(params)
+    defines, self.dynamic = survey(body)
+    for var in defines:
+      if var not in names:
+        names.append(var)
+
+    self.names = tuple(names)
+
+  # Symbol -> (Integer, Integer)
+  def resolve(self, var):
+    ''' Find the address of var as (depth, index). If var has to be
+    looked up by name, index is None and depth is the frame to start
+    looking from. '''
+
+    depth, scope = 0, self
+    while scope is not None:
+      if scope.dynamic:
+        return depth, None
+      elif var in scope.names:
+        return depth, scope.names.index(var)
+      depth, scope = depth + 1, scope.outer
+    return depth, None
+
+  # Integer -> Boolean
+  def is_param(self, index):
+    ''' Parameters are bound as soon as a frame is made, whereas
+    variables from `def` might not have been defined yet. '''
+
+    return index < (1 if isinstance(self.params, Symbol) else len(self.params))
+
+  # None -> Procedure
+  def binder(self):
+    ''' Make the procedure that creates a frame for this scope. '''
+
+    return binder(self.params, self.names, self.dynamic)
+
+# Symbol or [Symbol], (Symbol), Boolean -> Procedure
+def binder(params, names, dynamic):
+  ''' Make the procedure that creates a frame for a procedure from a
+  list of arguments and the frame the procedure was created in. '''
+
+  if dynamic:
+    return lambda args, outer: Environment(params, args, outer)
+
+  if isinstance(params, Symbol):
+    padding = [unbound] * (len(names) - 1)
+    return lambda args, outer: Frame(names, [list(args)] + padding, outer)
+
+  arity, padding = len(params), [unbound] * (len(names) - len(params))
+
+  def bind(args, outer):
+    if len(args) != arity:
+      raise SyntaxError('expected %s, given %s, '
+        % (gazellestr(params), gazellestr(args)))
+    return Frame(names, list(args) + padding if padding else list(args), outer)
+  return bind
+
+# Symbol, Scope -> (Integer, Integer)
+def resolve(var, scope):
+  ''' Resolve var in scope, where the scope might be the top level. '''
+
+  if scope is None:
+    return 0, None
+  return scope.resolve(var)
+
+# Scope, Integer -> Scope
+def scope_at(scope, depth):
+  ''' The scope depth steps out from scope. '''
+
+  for _ in range(depth):
+    scope = scope.outer
+  return scope
+
+# Node -> ([Symbol], Boolean)
+def survey(node, defines=None):
+  ''' Collect the variables that a procedure body defines and whether
+  it loads code that could define more at runtime. Nested lambdas have
+  scopes of their own, so we don't look inside them. '''
+
+  if defines is None:
+    defines = []
+
+  kind = type(node)
+
+  if kind is Lambda or kind is Const or kind is Ref or kind is Provide:
+    return defines, False
+
+  elif kind is Include or kind is Stdlib or kind is Import:
+    return defines, True
+
+  elif kind is Def:
+    defines.append(node.var)
+    return survey(node.value, defines)
+
+  dynamic = False
+  for child in children(node) if isinstance(node, Node) else ():
+    dynamic = survey(child, defines)[1] or dynamic
+  return defines, dynamic
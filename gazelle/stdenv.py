@@ -1,5 +1,9 @@
 from .env import Environment
+from .gazellestr import gazellestr
+from .pair import car, cdr, cons, is_list
+from . import containers, memo, parallel, stream, tasks, vector
 from functools import reduce
+import operator as op
 
 def callcc(proc):
   ''' Call proc with current continuation; escape only '''
@@ -11,6 +15,117 @@ def callcc(proc):
     if w is ball: return ball.retval
   else: raise w
 
+# Builtins that call procedures they are given. These are defined
+# out here so that evaluators that want to run those procedures
+# themselves (see `cek.py`) can recognize them.
+
+def apply(proc, l):
+  ''' Call proc with the elements of l as its arguments '''
+  return proc(*l)
+
+def map_list(f, l):
+  ''' Call f on each element of l, collecting the results in a list '''
+  return list(map(f, l))
+
+def filter_list(f, l):
+  ''' The elements of l that f returns true for '''
+  return list(filter(f, l))
+
+def append(a, b, *rest):
+  ''' Join two or more lists (or strings) together '''
+  x = (a, b) + rest
+  if all(map(is_list, x)):
+    joined = []
+    for l in x:
+      joined.extend(l)
+    return joined
+  return reduce(op.add, x)
+
+# Special forms that `expand()` turns into calls to python procedures
+# once it has checked them (see `primitives` in `parseval.py`)
+
+def check_expect(value, expected):
+  ''' (check-expect value expected) '''
+  return value == expected
+
+def check_within(x, lower, upper):
+  ''' (check-within x lower upper) '''
+  return x <= upper and x >= lower
+
+def member(item, lst):
+  ''' (member? item lst) '''
+  return item in lst
+
+def display(value):
+  ''' (display value) '''
+  print(gazellestr(value))
+
+# Arithmetic takes any number of arguments
+
+def add(*x):
+  ''' (+ x...) '''
+  return reduce(op.add, x, 0)
+
+def sub(*x):
+  ''' (- x y...) '''
+  return x[0] - sum(x[1:])
+
+def mul(*x):
+  ''' (* x...) '''
+  return reduce(op.mul, x, 1)
+
+def div(*x):
+  ''' (/ x y...) '''
+  return reduce(op.truediv, (x[1:]), x[0])
+
+def floordiv(*x):
+  ''' (// x y...) '''
+  return reduce(op.floordiv, (x[1:]), x[0])
+
+### Fast paths
+# Almost every call to arithmetic has exactly two arguments, but the
+# builtins above have to pack them into a tuple and loop over it anyway.
+# These are versions of builtins that only take two arguments and give
+# exactly the same answers (`+` still starts from 0, so it won't add up
+# strings), for evaluators that can tell how many arguments a call has
+# before it's made. They only use them once they've checked that the
+# procedure being called is still the builtin. Comparisons already take
+# two arguments, but are here so that those evaluators can call them
+# without going through their general way of calling procedures.
+
+def add2(a, b):
+  ''' (+ a b) '''
+  return 0 + a + b
+
+def sub2(a, b):
+  ''' (- a b) '''
+  return a - (0 + b)
+
+binary = {
+  add:      add2,
+  sub:      sub2,
+  mul:      op.mul,
+  div:      op.truediv,
+  floordiv: op.floordiv,
+  op.mod:   op.mod,
+  op.gt:    op.gt,
+  op.lt:    op.lt,
+  op.ge:    op.ge,
+  op.le:    op.le,
+  op.eq:    op.eq,
+}
+
+# Symbol -> (Procedure, Procedure) or None
+def fast_path(var):
+  ''' If var is bound to a builtin with a two-argument version, the
+  builtin and that version. '''
+
+  proc = global_env.get(var)
+  try:
+    return (proc, binary[proc]) if proc in binary else None
+  except TypeError:
+    return None
+
 ### StdEnv
 # None -> Environment
 def make_env():
@@ -19,7 +134,6 @@ def make_env():
   import math
   import cmath
   import itertools
-  import operator as op
 
   env = Environment()
   
@@ -32,27 +146,27 @@ def make_env():
     '>=':         op.ge,     '<=':      op.le,
     '=':          op.eq,
     '>>':         op.rshift, '<<':      op.lshift,
-    '+':          lambda *x: reduce(op.add, x, 0),
-    '-':          lambda *x: x[0] - sum(x[1:]),
-    '*':          lambda *x: reduce(op.mul, x, 1),
-    '/':          lambda *x: reduce(op.truediv, (x[1:]), x[0]),
-    '//':         lambda *x: reduce(op.floordiv, (x[1:]), x[0]),
+    '+':          add,
+    '-':          sub,
+    '*':          mul,
+    '/':          div,
+    '//':         floordiv,
     '%':          op.mod,
     'abs':        abs,
-    'append':     op.add,
-    'apply':      lambda proc,l: proc(*l),
+    'append':     append,
+    'apply':      apply,
     'begin':      lambda *x: x[-1],
     'bool?':      lambda x: isinstance(x, bool),
     'call/cc':    callcc,
-    'car':        lambda x: x[0],
-    'cdr':        lambda x: x[1:],
-    'cons':       lambda x,y: [x] + y,
-    'filter':     lambda f,l: list(filter(f, l)),
+    'car':        car,
+    'cdr':        cdr,
+    'cons':       cons,
+    'filter':     filter_list,
     'length':     len, 
     'list':       lambda *x: list(x),
-    'list?':      lambda x: isinstance(x,list), 
+    'list?':      is_list,
     # Map can be defined in the stdlib, though it will max out python's recursion depth
-    'map':        lambda f,l: list(map(f, l)),
+    'map':        map_list,
     'max':        max,
     'min':        min,
     'not':        op.not_,
@@ -64,7 +178,21 @@ def make_env():
     'str?':       lambda x: isinstance(x, str),
     'sum':        lambda x: sum(x),
     })
+
+  env.update(containers.builtins)
+  env.update(memo.builtins)
+  env.update(parallel.builtins)
+  env.update(stream.builtins)
+  env.update(tasks.builtins)
+
+  # Only there if NumPy is
+  env.update(vector.builtins)
   return env
 
 # Create a global env for `gazeval()` to access
-global_env = make_env()
\ No newline at end of file
+global_env = make_env()
+
+# The global environment as it was made, so that what programs define in
+# it can be told apart from the builtins (see `parallel.py`)
+initial = dict(global_env)
+builtin_names = dict((id(value), name) for name, value in initial.items() if callable(value))
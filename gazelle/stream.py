@@ -0,0 +1,120 @@
+import functools, itertools
+
+### Streams
+# `range`, `map` and `filter` all make whole lists, so
+#   `(sum (filter even? (map square (range 1000000))))`
+# builds three lists of up to a million elements just to add up the
+# last one.
+#
+# A `Stream` is a sequence that doesn't exist until something walks
+# through it. The `stream-` builtins below make new streams out of
+# old ones without walking through anything, so a pipeline of them is
+# only run when something like `sum`, `stream-fold` or `stream->list`
+# finally asks for its elements. Then every element goes through the
+# whole pipeline before the next one is made, in a single pass that
+# never holds more than one element at a time.
+#
+# A stream remembers how to make its elements rather than the elements
+# themselves, so walking through it again runs the pipeline again
+# from the start.
+class Stream(object):
+  __slots__ = ('make',)
+
+  def __init__(self, make):
+    self.make = make
+
+  def __iter__(self):
+    return iter(self.make())
+
+  def __str__(self):
+    return '#<stream>'
+
+  __repr__ = __str__
+
+# A `Promise` is an expression that is evaluated the first time it's
+# forced, and remembers its value after that. `(delay expr)` makes one
+# (see `delay` in `parseval.py`).
+class Promise(object):
+  __slots__ = ('thunk', 'value', 'forced')
+
+  def __init__(self, thunk):
+    self.thunk, self.value, self.forced = thunk, None, False
+
+  def __str__(self):
+    return '#<promise>'
+
+  __repr__ = __str__
+
+### Builtins
+
+# Object -> Object
+def force(x):
+  ''' (force promise): the value of a promise, or x if it isn't one '''
+  if type(x) is not Promise:
+    return x
+  if not x.forced:
+    value = x.thunk()
+    # Forcing the thunk might have forced x already
+    if not x.forced:
+      x.value, x.forced, x.thunk = value, True, None
+  return x.value
+
+# List -> Stream
+def stream(items):
+  ''' (stream list): a stream of the elements of a list '''
+  return Stream(lambda: items)
+
+# Number, (Number, Number) -> Stream
+def stream_range(*x):
+  ''' (stream-range end), (stream-range start end), (stream-range start end step) '''
+  return Stream(lambda: range(*x))
+
+# Procedure, Object -> Stream
+def stream_iterate(f, x):
+  ''' (stream-iterate f x): the endless stream x, (f x), (f (f x))... '''
+  def make():
+    value = x
+    while True:
+      yield value
+      value = f(value)
+  return Stream(make)
+
+# Procedure, Stream -> Stream
+def stream_map(f, s):
+  ''' (stream-map f stream) '''
+  return Stream(lambda: map(f, s))
+
+# Procedure, Stream -> Stream
+def stream_filter(f, s):
+  ''' (stream-filter f stream) '''
+  return Stream(lambda: filter(f, s))
+
+# Integer, Stream -> Stream
+def stream_take(n, s):
+  ''' (stream-take n stream): the first n elements of stream '''
+  return Stream(lambda: itertools.islice(s, n))
+
+# Procedure, Object, Stream -> Object
+def stream_fold(f, init, s):
+  ''' (stream-fold f init stream): (f (f init x0) x1)... '''
+  return functools.reduce(f, s, init)
+
+# Stream -> List
+def stream_to_list(s):
+  ''' (stream->list stream) '''
+  return list(s)
+
+builtins = {
+  'force':          force,
+  'make-promise':   Promise,
+  'promise?':       lambda x: type(x) is Promise,
+  'stream':         stream,
+  'stream?':        lambda x: type(x) is Stream,
+  'stream-range':   stream_range,
+  'stream-iterate': stream_iterate,
+  'stream-map':     stream_map,
+  'stream-filter':  stream_filter,
+  'stream-take':    stream_take,
+  'stream-fold':    stream_fold,
+  'stream->list':   stream_to_list,
+}
@@ -5,7 +5,13 @@
 #
 # In gazelle, a symbol is an atom that isn't a bool,
 # integer, float, or complex number, therefore it must be a string
-class Symbol(str): pass
+class Symbol(str):
+
+  def __reduce__(self):
+    ''' Symbols are unique, so when one is unpickled make sure we
+    get the entry from the symbol table instead of a copy. '''
+
+    return (Sym, (str(self),))
 
 # String, (Dict) -> Atom
 def Sym(s, symbol_table={}):
@@ -23,15 +29,23 @@ Symbols = {
   'check-within':    Sym('check-within'),
   'cons':            Sym('cons'),
   'def':             Sym('def'),
+  'def-memo':        Sym('def-memo'),
+  'delay':           Sym('delay'),
   'display':         Sym('display'),
   'if':              Sym('if'),
+  'import':          Sym('import'),
   'include':         Sym('include'),
   'lambda':          Sym('lambda'),
   '\\':              Sym('\\'),
   'let':             Sym('let'),
+  'list':            Sym('list'),
   'macro':           Sym('macro'),
+  'make-promise':    Sym('make-promise'),
+  'memoize':         Sym('memoize'),
   'member?':         Sym('member?'),
+  'provide':         Sym('provide'),
   'quasiquote':      Sym('quasiquote'),
+  'quit':            Sym('quit'),
   'quote':           Sym('quote'),
   'return':          Sym('return'),
   'set!':            Sym('set!'),
@@ -0,0 +1,201 @@
+import threading
+
+# Local deps
+from .sym import eof
+
+### Tasks
+# A program that waits on something slow, like a command or a sleep,
+# waits with the whole interpreter: nothing else runs until it's done,
+# so ten commands that take a second each take ten seconds.
+#
+# `spawn` starts a procedure running as a task alongside the rest of the
+# program, and returns straight away. `await` waits for a task to finish
+# and gives back what it returned (or raises what it raised):
+#
+#   (def slow (\ (n) (begin (sleep 1) (* n n))))
+#   (map await (map (\ (n) (spawn slow n)) (range 10)))
+#
+# takes one second rather than ten. While a task waits (in `sleep`,
+# `run-command`, `receive` or `await`) the others carry on.
+#
+# Waiting is done by an asyncio event loop, which runs in a thread of its
+# own from the first time it's needed. Each task runs in a thread of its
+# own too, since gazelle procedures are ordinary python functions that
+# can't give the loop control back part way through. A task that's
+# waiting keeps its thread, so there's no pool of them to run out of:
+# however many tasks are waiting on each other, the one they're waiting
+# for still gets to run. The program itself is just another task as far
+# as the builtins below go, so it can `sleep` or `receive` too.
+#
+# Tasks share the global environment, and all run python code under the
+# same lock, so they only help with waiting, not with computing.
+# For that there's `pmap` (see `parallel.py`).
+#
+# asyncio takes a while to import, so it's only imported by the
+# builtins here, for programs that use them.
+#
+# Channels pass values between tasks: `(send! ch x)` puts x in the
+# channel and `(receive ch)` takes the oldest value out, waiting for one
+# if there isn't any yet. A channel made with `(channel n)` only holds n
+# values, and `send!` waits for room; `(channel)` holds `channel_size`.
+# Once a channel is `close!`d, `receive` gives back `eof` when it's
+# empty, which `eof?` checks for.
+
+# How many values `(channel)` holds before `send!` waits
+channel_size = 64
+
+# The event loop, started the first time it's needed
+loop = None
+lock = threading.Lock()
+
+# None -> EventLoop
+def event_loop():
+  ''' The event loop, starting it if it isn't yet. '''
+
+  import asyncio
+
+  global loop
+  with lock:
+    if loop is None:
+      new = asyncio.new_event_loop()
+      threading.Thread(target=new.run_forever, name='gazelle-loop', daemon=True).start()
+      loop = new
+  return loop
+
+# Coroutine -> Future
+def submit(coroutine):
+  ''' Run coroutine on the event loop. '''
+
+  import asyncio
+  return asyncio.run_coroutine_threadsafe(coroutine, event_loop())
+
+# Coroutine -> Object
+def wait(coroutine):
+  ''' Run coroutine on the event loop and wait for what it returns. '''
+
+  return submit(coroutine).result()
+
+# A procedure running alongside the program
+class Task(object):
+  __slots__ = ('future',)
+
+  def __init__(self, future):
+    self.future = future
+
+  def __str__(self):
+    return '#<task>'
+
+  __repr__ = __str__
+
+class Channel(object):
+  __slots__ = ('queue', 'closed')
+
+  def __init__(self, size):
+    # Only ever used from the event loop's thread
+    import asyncio
+    self.queue, self.closed = asyncio.Queue(size), False
+
+  def __str__(self):
+    return '#<channel>'
+
+  __repr__ = __str__
+
+### Builtins
+
+# Procedure, Object... -> Task
+def spawn(f, *args):
+  ''' (spawn f arg...): call f with args as a task '''
+  import concurrent.futures
+  future = concurrent.futures.Future()
+  def run():
+    future.set_running_or_notify_cancel()
+    try:
+      future.set_result(f(*args))
+    except BaseException as e:
+      future.set_exception(e)
+  threading.Thread(target=run, name='gazelle-task', daemon=True).start()
+  return Task(future)
+
+# Object -> Object
+def await_task(x):
+  ''' (await task): wait for a task and return its value, or x if it isn't one '''
+  if type(x) is not Task:
+    return x
+  return x.future.result()
+
+# Number -> None
+def sleep(seconds):
+  ''' (sleep seconds) '''
+  import asyncio
+  wait(asyncio.sleep(seconds))
+
+# String -> String
+def run_command(command):
+  ''' (run-command string): run a shell command, returning what it printed '''
+  import asyncio
+  async def run():
+    process = await asyncio.create_subprocess_shell(command,
+      stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+    output, _ = await process.communicate()
+    if process.returncode:
+      raise RuntimeError('%r exited with status %d' % (command, process.returncode))
+    return output.decode()
+  return wait(run())
+
+# (Integer) -> Channel
+def channel(size=None):
+  ''' (channel), (channel size) '''
+  if size is None:
+    size = channel_size
+  # asyncio would take 0 or less to mean no limit at all
+  if size < 1:
+    raise ValueError('a channel has to hold at least one value')
+  async def make():
+    return Channel(size)
+  return wait(make())
+
+# Channel, Object -> None
+def send(ch, x):
+  ''' (send! channel value) '''
+  if ch.closed:
+    raise ValueError('send! to a closed channel')
+  wait(ch.queue.put(x))
+
+# Channel -> Object
+def receive(ch):
+  ''' (receive channel): the oldest value sent, or eof once it's closed and empty '''
+  async def get():
+    if ch.closed and ch.queue.empty():
+      return eof
+    x = await ch.queue.get()
+    if x is eof:
+      # Leave it there for anything else waiting to receive
+      ch.queue.put_nowait(eof)
+    return x
+  return wait(get())
+
+# Channel -> None
+def close(ch):
+  ''' (close! channel) '''
+  async def put_eof():
+    # Wakes up anything waiting on an empty channel. A full one has
+    # nothing waiting to receive, and gives eof once it's emptied.
+    if not ch.closed:
+      ch.closed = True
+      if not ch.queue.full():
+        ch.queue.put_nowait(eof)
+  wait(put_eof())
+
+builtins = {
+  'spawn':       spawn,
+  'await':       await_task,
+  'task?':       lambda x: type(x) is Task,
+  'sleep':       sleep,
+  'run-command': run_command,
+  'channel':     channel,
+  'channel?':    lambda x: type(x) is Channel,
+  'send!':       send,
+  'receive':     receive,
+  'close!':      close,
+  'eof?':        lambda x: x is eof,
+}
@@ -0,0 +1,532 @@
+import ast, collections, math, os, pickle, re
+
+# Local deps
+from . import stdenv
+from .nodes import Const, Ref, If, Set, Def, Lambda, Begin, While, \
+  Primitive, Include, Stdlib, Import, Provide, App, children
+from .parseval import load
+from .sym import Symbol
+
+### Transpiler
+# Every engine gazelle has interprets the program in some way while it
+# runs: it walks the tree, calls the closures the analyzer made or runs
+# the VM's bytecode, and every variable is looked up in an environment.
+#
+# `transpile()` turns an expanded program into the source of a python
+# module instead, which CPython can byte-compile and run like any other:
+#
+#   python gazelle.py --emit-py fib.gel   # writes fib.py
+#   python fib.py
+#
+# Running the module (or calling its `main()`) does what running the
+# program does, and `main()` returns what the program evaluates to.
+#
+#  - procedures are python functions, and variables are python
+#    variables: top-level definitions are globals of the module, and
+#    parameters and definitions inside a procedure are its locals
+#  - builtins are bound once when the module is imported, straight from
+#    `stdenv.global_env`, so the module needs gazelle to run
+#  - a procedure defined with `def` that calls itself in tail position
+#    runs as a loop, so it doesn't use up the python stack. (Unless it
+#    makes procedures of its own, since they could see its parameters
+#    change, or its name is defined more than once or `set!` anywhere in
+#    the program, since then the name might not be it by the time it's
+#    called.) Other calls, including other tail calls, are python calls
+#  - `(include ...)` and `(stdlib)` are compiled into the module
+#
+# Names that aren't defined anywhere are looked up in the global
+# environment when they're used, raising a LookupError the same way the
+# engines do. `(import ...)` can't be transpiled, and procedures show
+# up as python functions when they're printed.
+
+# A python block: lines of code with how far each one is indented
+class Block(list):
+
+  # String, (Integer) -> None
+  def emit(self, line, depth=0):
+    self.append((depth, line))
+
+  # Block, (Integer) -> None
+  def nest(self, block, depth=1):
+    self.extend((d + depth, line) for d, line in block)
+
+  # (Integer) -> String
+  def source(self, depth=0):
+    return ''.join('  ' * (d + depth) + line + '\n' for d, line in self)
+
+# The variables a procedure (or the top level of the program, if outer
+# is None) binds, and the ones it assigns that python has to be told
+# are someone else's
+class Scope(object):
+  def __init__(self, names, outer=None):
+    self.names, self.outer, self.declared = names, outer, []
+    # Python names for the variables that aren't called what
+    # `Transpiler.name()` calls them
+    self.renamed = {}
+
+  # Symbol -> Scope or None
+  def find(self, var):
+    ''' The scope var is bound in, if it's bound anywhere. '''
+
+    scope = self
+    while scope is not None and var not in scope.names:
+      scope = scope.outer
+    return scope
+
+# A procedure whose tail calls to itself are a loop
+class Loop(object):
+  def __init__(self, var, params, scope):
+    self.var, self.params, self.scope = var, params, scope
+
+# Node -> [Node]
+def descendants(node):
+  ''' Every node inside of node, including the files it includes. '''
+
+  found = []
+  for child in children(node):
+    found.append(child)
+    found.extend(descendants(child))
+  return found
+
+# Node -> {Symbol}
+def defined(node):
+  ''' The variables node defines, not counting the procedures in it. '''
+
+  names = set()
+  if type(node) is Def:
+    names.add(node.var)
+  if type(node) is not Lambda:
+    for child in children(node):
+      names |= defined(child)
+  return names
+
+# Node -> {Symbol}
+def read_early(node, seen=None):
+  ''' The variables node defines that it could use before they're
+  defined, not counting the procedures in it. '''
+
+  if seen is None:
+    seen = set()
+  early = set()
+  t = type(node)
+  if t is Ref:
+    seen.add(node.var)
+  elif t is Def:
+    early |= read_early(node.value, seen)
+    if node.var in seen:
+      early.add(node.var)
+  elif t is not Lambda:
+    for child in children(node):
+      early |= read_early(child, seen)
+  return early
+
+# Symbol or [Symbol] -> [Symbol]
+def parameters(params):
+  ''' The names of a procedure's parameters. '''
+
+  return [params] if isinstance(params, Symbol) else list(params)
+
+# The pieces of a python module a program turns into
+class Transpiler(object):
+  def __init__(self, program):
+    # How many times each variable is defined or set in the program
+    self.assigned = collections.Counter(node.var for node in [program] + descendants(program)
+      if type(node) is Def or type(node) is Set)
+    self.names, self.used = {}, set()
+    self.constants, self.symbols = Block(), {}
+    self.builtins, self.primitives = set(), {}
+    self.fresh_names = set()
+
+  # String -> String
+  def fresh(self, prefix):
+    ''' A new name for a temporary, procedure or constant. '''
+
+    name = '%s%d' % (prefix, len(self.fresh_names) + 1)
+    self.fresh_names.add(name)
+    return name
+
+  # String -> Boolean
+  def simple(self, value):
+    ''' Does the python expression value always evaluate to the same
+    thing, without doing anything else? '''
+
+    try:
+      ast.literal_eval(value)
+      return True
+    except (ValueError, SyntaxError):
+      return value in self.fresh_names
+
+  # Symbol -> String
+  def name(self, var):
+    ''' The python name of a gazelle variable. '''
+
+    if var not in self.names:
+      readable = re.sub('[^A-Za-z0-9_]', lambda m: {'-': '_', '?': '_p', '!': '_x'}.get(
+        m.group(), '_%x' % ord(m.group())), var)
+      self.names[var] = self.unused('g_' + readable)
+    return self.names[var]
+
+  # String -> String
+  def unused(self, name):
+    ''' name, or name with a number after it if it's been used. '''
+
+    candidate, n = name, 1
+    while candidate in self.used:
+      n += 1
+      candidate = '%s_%d' % (name, n)
+    self.used.add(candidate)
+    return candidate
+
+  # Symbol, Scope -> String
+  def variable(self, var, scope):
+    ''' The python name of var, where scope can see it. '''
+
+    found = scope.find(var)
+    if found is not None and var in found.renamed:
+      return found.renamed[var]
+    return self.name(var)
+
+  # Object -> String
+  def literal(self, value):
+    ''' A python expression for a constant. '''
+
+    t = type(value)
+    if value is None or t is bool or t is int or t is str:
+      return repr(value)
+    elif t is float:
+      return repr(value) if math.isfinite(value) else 'float(%r)' % repr(value)
+    elif t is complex:
+      return 'complex(%s, %s)' % (self.literal(value.real), self.literal(value.imag))
+    elif t is Symbol:
+      if value not in self.symbols:
+        self.symbols[value] = self.constant('_sym(%r)' % str(value))
+      return self.symbols[value]
+    elif t is list:
+      # Quoted lists are the same list every time they're evaluated
+      return self.constant('[%s]' % ', '.join(self.literal(item) for item in value))
+    return self.constant('_pickle.loads(%r)' % pickle.dumps(value))
+
+  # String -> String
+  def constant(self, code):
+    ''' Name code at the top of the module. '''
+
+    name = self.fresh('_k')
+    self.constants.emit('%s = %s' % (name, code))
+    return name
+
+  # Symbol, Scope -> String
+  def ref(self, var, scope):
+    ''' A python expression for the value of a variable. '''
+
+    found = scope.find(var)
+    if found is None and var not in stdenv.global_env:
+      return '_env.find(%s)[%s]' % ((self.literal(Symbol(var)),) * 2)
+    if found is None or (found.outer is None and var in stdenv.global_env):
+      self.builtins.add(var)
+    return self.variable(var, scope)
+
+  # Symbol, Scope -> None
+  def declare(self, var, scope):
+    ''' Let python know that an assignment to var in scope is to
+    a variable of another one. '''
+
+    found = scope.find(var)
+    if found is scope:
+      return
+    if found is None or found.outer is None:
+      statement = 'global ' + self.name(var)
+      if found is None and var in stdenv.global_env:
+        self.builtins.add(var)
+    else:
+      statement = 'nonlocal ' + self.variable(var, scope)
+    if statement not in scope.declared:
+      scope.declared.append(statement)
+
+  # [Node], Scope, Block -> [String]
+  def sequence(self, nodes, scope, block):
+    ''' Python expressions for the values of nodes, keeping the order
+    they're evaluated in. '''
+
+    values = []
+    for node in nodes:
+      inner = Block()
+      value = self.expr(node, scope, inner)
+      if inner:
+        # Statements that have to run first: work out everything
+        # before it beforehand, in case they change it
+        for i, before in enumerate(values):
+          if not self.simple(before):
+            values[i] = self.fresh('_t')
+            block.emit('%s = %s' % (values[i], before))
+        block.extend(inner)
+      values.append(value)
+    return values
+
+  # Node, Scope, Block -> String
+  def expr(self, node, scope, block):
+    ''' Compile node into block, returning a python expression
+    for its value. '''
+
+    t = type(node)
+
+    if t is Const:
+      return self.literal(node.value)
+
+    elif t is Ref:
+      return self.ref(node.var, scope)
+
+    elif t is If:
+      test = self.expr(node.test, scope, block)
+      conseq, alt = Block(), Block()
+      conseq_value = self.expr(node.conseq, scope, conseq)
+      alt_value = self.expr(node.alt, scope, alt)
+      if not conseq and not alt:
+        return '(%s if %s else %s)' % (conseq_value, test, alt_value)
+      temp = self.fresh('_t')
+      conseq.emit('%s = %s' % (temp, conseq_value))
+      alt.emit('%s = %s' % (temp, alt_value))
+      block.emit('if %s:' % test)
+      block.nest(conseq)
+      block.emit('else:')
+      block.nest(alt)
+      return temp
+
+    elif t is Begin:
+      for subnode in node.body[:-1]:
+        self.stmt(subnode, scope, block)
+      return self.expr(node.body[-1], scope, block)
+
+    elif t is Include:
+      return self.expr(node.program, scope, block)
+
+    elif t is Lambda:
+      name = self.fresh('_lambda')
+      self.function(name, node, scope, block)
+      return name
+
+    elif t is Primitive:
+      proc = node.proc
+      if proc not in self.primitives:
+        self.primitives[proc] = '_' + proc.__name__
+      return '%s(%s)' % (self.primitives[proc], ', '.join(self.sequence(node.args, scope, block)))
+
+    elif t is App:
+      values = self.sequence((node.proc,) + node.args, scope, block)
+      return '%s(%s)' % (values[0], ', '.join(values[1:]))
+
+    # Everything else is a statement that evaluates to None
+    self.stmt(node, scope, block)
+    return 'None'
+
+  # Node, Scope, Block -> None
+  def stmt(self, node, scope, block):
+    ''' Compile node into block for what it does, ignoring its value. '''
+
+    t = type(node)
+
+    if t is Def or t is Set:
+      if t is Set:
+        self.declare(node.var, scope)
+      name = self.variable(node.var, scope)
+      if type(node.value) is Lambda:
+        self.function(name, node.value, scope, block, node.var if t is Def else None)
+      else:
+        block.emit('%s = %s' % (name, self.expr(node.value, scope, block)))
+
+    elif t is If:
+      test = self.expr(node.test, scope, block)
+      conseq, alt = Block(), Block()
+      self.stmt(node.conseq, scope, conseq)
+      self.stmt(node.alt, scope, alt)
+      block.emit('if %s:' % test)
+      block.nest(conseq or [(0, 'pass')])
+      if alt:
+        block.emit('else:')
+        block.nest(alt)
+
+    elif t is Begin:
+      for subnode in node.body:
+        self.stmt(subnode, scope, block)
+
+    elif t is While:
+      test, body = Block(), Block()
+      value = self.expr(node.test, scope, test)
+      self.stmt(node.body, scope, body)
+      if test:
+        block.emit('while True:')
+        block.nest(test)
+        block.emit('if not %s:' % value, 1)
+        block.emit('break', 2)
+      else:
+        block.emit('while %s:' % value)
+      block.nest(body or [(0, 'pass')])
+
+    elif t is Include or t is Stdlib:
+      self.stmt(node.program, scope, block)
+
+    elif t is Import:
+      raise SyntaxError('(import %s): imports can\'t be transpiled' % node.name)
+
+    elif t is Const or t is Provide:
+      pass
+
+    else:
+      value = self.expr(node, scope, block)
+      if not self.simple(value):
+        block.emit(value)
+
+  # Node, Scope, Block, Loop or None -> None
+  def tail(self, node, scope, block, loop=None):
+    ''' Compile node into block so that it returns its value (or
+    starts loop again, for a tail call to it). '''
+
+    t = type(node)
+
+    if t is If:
+      test = self.expr(node.test, scope, block)
+      conseq, alt = Block(), Block()
+      self.tail(node.conseq, scope, conseq, loop)
+      self.tail(node.alt, scope, alt, loop)
+      block.emit('if %s:' % test)
+      block.nest(conseq)
+      block.extend(alt)
+
+    elif t is Begin:
+      for subnode in node.body[:-1]:
+        self.stmt(subnode, scope, block)
+      self.tail(node.body[-1], scope, block, loop)
+
+    elif t is Include:
+      self.tail(node.program, scope, block, loop)
+
+    elif self.is_loop_call(node, scope, loop):
+      values = self.sequence(node.args, scope, block)
+      if values:
+        block.emit('%s = %s' % (', '.join(map(self.name, loop.params)), ', '.join(values)))
+      block.emit('continue')
+
+    else:
+      block.emit('return ' + self.expr(node, scope, block))
+
+  # Node, Scope, Loop or None -> Boolean
+  def is_loop_call(self, node, scope, loop):
+    ''' Is node a tail call of the procedure loop is running? '''
+
+    return loop is not None and type(node) is App and type(node.proc) is Ref and \
+      node.proc.var == loop.var and scope.find(loop.var) is loop.scope and \
+      len(node.args) == len(loop.params)
+
+  # String, Lambda, Scope, Block, (Symbol) -> None
+  def function(self, name, node, scope, block, var=None):
+    ''' Compile a procedure into a python function called name. If it's
+    being defined as var, its tail calls to itself are a loop. '''
+
+    params = parameters(node.params)
+    inner = Scope(set(params) | defined(node.body), scope)
+
+    # A variable that's used before the procedure defines it is
+    # whatever it was outside until then
+    shadowing = Block()
+    for early in sorted(read_early(node.body) - set(params)):
+      if scope.find(early) is not None or early in stdenv.global_env:
+        outer = self.ref(early, scope)
+        inner.renamed[early] = self.unused(self.name(early))
+        shadowing.emit('%s = %s' % (inner.renamed[early], outer))
+
+    loop = None
+    # A loop's iterations would share the locals the body defines,
+    # where every call gets its own
+    if var is not None and self.assigned[var] == 1 and not isinstance(node.params, Symbol) and \
+        not defined(node.body) and not any(type(subnode) is Lambda for subnode in descendants(node.body)):
+      loop = Loop(var, params, scope.find(var) or scope)
+      if not any(self.is_loop_call(subnode, inner, loop) for subnode in tails(node.body)):
+        loop = None
+
+    body = Block()
+    self.tail(node.body, inner, body, loop)
+
+    if isinstance(node.params, Symbol):
+      block.emit('def %s(*%s):' % (name, self.name(node.params)))
+      block.emit('%s = list(%s)' % ((self.name(node.params),) * 2), 1)
+    else:
+      block.emit('def %s(%s):' % (name, ', '.join(map(self.name, params))))
+    for statement in inner.declared:
+      block.emit(statement, 1)
+    block.nest(shadowing)
+    if loop is not None:
+      block.emit('while True:', 1)
+      block.nest(body, 2)
+    else:
+      block.nest(body)
+
+# Node -> [Node]
+def tails(node):
+  ''' The nodes in tail position in node. '''
+
+  t = type(node)
+  if t is If:
+    return tails(node.conseq) + tails(node.alt)
+  elif t is Begin:
+    return tails(node.body[-1])
+  elif t is Include:
+    return tails(node.program)
+  return [node]
+
+# Node, (String) -> String
+def transpile(program, source=None):
+  ''' The source of a python module that runs program. '''
+
+  transpiler = Transpiler(program)
+  scope = Scope(defined(program))
+
+  body = Block()
+  transpiler.tail(program, scope, body)
+  names = sorted(set(transpiler.name(var) for var in scope.names) |
+    set(statement.split()[1] for statement in scope.declared))
+
+  module = Block()
+  if source is not None:
+    module.emit('# Transpiled from %s by `gazelle.py --emit-py`' % source)
+  module.emit('import pickle as _pickle')
+  module.emit('import re as _re')
+  module.emit('from gazelle import stdenv as _stdenv')
+  module.emit('from gazelle.sym import Sym as _sym')
+  module.emit('')
+  module.emit('_env = _stdenv.global_env')
+  for proc, alias in sorted(transpiler.primitives.items(), key=lambda item: item[1]):
+    module.emit('from %s import %s as %s' % (proc.__module__, proc.__name__, alias))
+  for var in sorted(transpiler.builtins):
+    module.emit('%s = _env[%r]' % (transpiler.name(var), str(var)))
+  module.extend(transpiler.constants)
+  module.emit('')
+  module.emit('_names = %r' % {name: str(var) for var, name in sorted(transpiler.names.items())})
+  module.emit('')
+  module.emit('def _main():')
+  if names:
+    module.emit('global ' + ', '.join(names), 1)
+  module.nest(body)
+  module.emit('')
+  # Python's error for a variable that's used before it's defined
+  # should be the one gazelle's environments raise
+  module.emit('def main():')
+  module.emit('try:', 1)
+  module.emit('return _main()', 2)
+  module.emit('except NameError as e:', 1)
+  module.emit('name = _re.search(r"\'(\\w+)\'", str(e)).group(1)', 2)
+  module.emit('raise LookupError(_names.get(name, name)) from None', 2)
+  module.emit('')
+  module.emit('if __name__ == \'__main__\':')
+  module.emit('main()', 1)
+  return module.source()
+
+# String -> String
+def emit(path):
+  ''' Transpile the file at path into a python module next to it,
+  returning the module's path. '''
+
+  target = os.path.splitext(path)[0] + '.py'
+  source = transpile(load(path), path)
+  compile(source, target, 'exec')
+  with open(target, 'w') as f:
+    f.write(source)
+  return target
@@ -0,0 +1,123 @@
+import importlib.util, sys
+
+# Local deps
+from .pair import is_list
+
+### Vectors
+# Numeric work in gazelle goes through lists one element at a time:
+# summing the multiples of 3 or 5 below 1000 calls an interpreted
+# procedure for every number with `filter`, and `sum` adds them up in a
+# python loop.
+#
+# A vector is a NumPy array of numbers instead. The arithmetic builtins
+# already work on them an element at a time (`(* 3 v)`, `(+ v w)`,
+# `(% v 5)`), comparisons make masks of booleans (`(= (% v 3) 0)`) that
+# `or` combines, and the builtins below make vectors, pick out elements
+# with masks and add them up, all at array speed:
+#
+#   (def v (vector-range 1000))
+#   (vector-sum (vector-select (or (= (% v 3) 0) (= (% v 5) 0)) v))
+#
+# Vectors hold machine numbers, not python ones, so they can overflow.
+# Anything that comes out of a vector on its own (from `vector-ref` or a
+# reduction) is turned back into a python number.
+#
+# NumPy isn't needed for anything else, so if it isn't installed there
+# just aren't any vector builtins. It also takes longer to import than
+# all of gazelle, so it isn't imported until a vector builtin is used.
+
+# Is NumPy installed?
+available = importlib.util.find_spec('numpy') is not None
+
+# None -> Module
+def np():
+  ''' NumPy, importing it if nothing has yet. '''
+
+  import numpy
+  return numpy
+
+# Object -> Boolean
+def is_vector(x):
+  ''' Is x a vector? '''
+
+  # Nothing can have made one if NumPy hasn't been imported
+  numpy = sys.modules.get('numpy')
+  return numpy is not None and isinstance(x, numpy.ndarray)
+
+# Object -> Object
+def scalar(x):
+  ''' Turn a NumPy number into a python one. '''
+
+  return x.item() if isinstance(x, np().generic) else x
+
+# Object -> Vector
+def to_vector(x):
+  ''' Make a vector out of a list or vector, or a scalar. '''
+
+  return np().asarray(list(x) if is_list(x) else x)
+
+### Builtins
+
+# Number... -> Vector
+def vector(*x):
+  ''' (vector x...) '''
+  return np().array(x)
+
+# Vector -> List
+def vector_to_list(v):
+  ''' (vector->list v) '''
+  return to_vector(v).tolist()
+
+# Number, (Number, Number) -> Vector
+def vector_range(*x):
+  ''' (vector-range end), (vector-range start end), (vector-range start end step) '''
+  return np().arange(*x)
+
+# Vector, Integer -> Number
+def vector_ref(v, i):
+  ''' (vector-ref v i) '''
+  return scalar(v[i])
+
+# Vector, Vector -> Vector
+def vector_select(mask, v):
+  ''' (vector-select mask v): the elements of v where mask is true '''
+  return to_vector(v)[to_vector(mask).astype(bool)]
+
+# Vector, Vector -> Number
+def dot(v, w):
+  ''' (dot v w) '''
+  return scalar(np().dot(to_vector(v), to_vector(w)))
+
+# String -> Procedure
+def reduction(name):
+  ''' A builtin that reduces a vector (or list) to a python number
+  with the NumPy function name. '''
+  return lambda v: scalar(getattr(np(), name)(to_vector(v)))
+
+# String -> Procedure
+def elementwise(name):
+  ''' A builtin that applies the NumPy function name to each element. '''
+  return lambda *x: getattr(np(), name)(*map(to_vector, x))
+
+builtins = {} if not available else {
+  'vector':         vector,
+  'vector?':        is_vector,
+  'list->vector':   to_vector,
+  'vector->list':   vector_to_list,
+  'vector-range':   vector_range,
+  'vector-length':  len,
+  'vector-ref':     vector_ref,
+  'vector-select':  vector_select,
+  'vector-and':     elementwise('logical_and'),
+  'vector-or':      elementwise('logical_or'),
+  'vector-not':     elementwise('logical_not'),
+  'vector-sqrt':    elementwise('sqrt'),
+  'vector-exp':     elementwise('exp'),
+  'vector-log':     elementwise('log'),
+  'vector-sum':     reduction('sum'),
+  'vector-product': reduction('prod'),
+  'vector-min':     reduction('min'),
+  'vector-max':     reduction('max'),
+  'vector-mean':    reduction('mean'),
+  'dot':            dot,
+}
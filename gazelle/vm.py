@@ -0,0 +1,438 @@
+# Local deps
+from .env import Environment, InlineCache, unbound
+from .gazellestr import gazellestr
+from . import modules
+from .nodes import Const, Ref, If, Set, Def, Lambda, Begin, While, \
+  Primitive, Include, Stdlib, Import, Provide, App
+from .scope import Scope, binder, resolve, scope_at
+from .stdenv import global_env, fast_path
+import pickle
+
+### Virtual machine
+# The tree-walking evaluators run a program by following its structure,
+# which makes how much work a single step does depend on what that step
+# happens to be. The virtual machine instead compiles an expanded program
+# into a flat list of simple instructions for a stack machine and runs
+# them one after another in a single loop.
+#
+# Every instruction is an opcode followed by a single integer argument.
+# Anything that doesn't fit in an integer, like a constant, a variable's
+# name or a nested procedure, lives in the code object's constant pool
+# and the argument is its position there.
+#
+# Calling a compiled procedure doesn't recurse in python either: the
+# machine saves where it was on its own list of frames and jumps into
+# the procedure's code, so only builtins that call back into gazelle
+# (like `map`) start a new loop.
+
+### Opcodes
+CONST         = 0   # push consts[arg]
+LOCAL0        = 1   # push parameter arg of the current frame
+LOCAL1        = 2   # push parameter arg of the enclosing frame
+LOCAL         = 3   # push the local at consts[arg] = (depth, index)
+LOCAL_CHECKED = 4   # push the local at consts[arg] = (depth, index, name)
+NAME          = 5   # push the variable at consts[arg] = (depth, InlineCache)
+SET_LOCAL     = 6   # pop into the local at consts[arg] = (depth, index, name)
+SET_NAME      = 7   # pop into the variable at consts[arg] = (depth, name)
+DEF_LOCAL     = 8   # pop into slot arg of the current frame
+DEF_NAME      = 9   # pop into consts[arg] of the current environment
+POP           = 10  # discard the top of the stack
+JUMP          = 11  # continue at arg
+JUMP_IF_FALSE = 12  # pop, and continue at arg if it was false
+CLOSURE       = 13  # push a procedure for the code at consts[arg]
+CALL          = 14  # call the procedure below arg arguments
+TAIL_CALL     = 15  # call the procedure below arg arguments, then return
+RETURN        = 16  # return the top of the stack to the caller
+PRIMITIVE     = 17  # call consts[arg] = (proc, count) on the top count values
+INCLUDE       = 18  # run the code of an included file at consts[arg]
+STDLIB        = 19  # run the code of the standard library at consts[arg]
+IMPORT        = 20  # import the module of the node at consts[arg]
+BINARY        = 21  # if the procedure below 2 arguments is consts[arg][0], call
+                    # consts[arg][1] on them and skip the call that follows
+
+opnames = [
+  'CONST', 'LOCAL0', 'LOCAL1', 'LOCAL', 'LOCAL_CHECKED', 'NAME',
+  'SET_LOCAL', 'SET_NAME', 'DEF_LOCAL', 'DEF_NAME', 'POP', 'JUMP',
+  'JUMP_IF_FALSE', 'CLOSURE', 'CALL', 'TAIL_CALL', 'RETURN', 'PRIMITIVE',
+  'INCLUDE', 'STDLIB', 'IMPORT', 'BINARY',
+]
+
+# A `Code` object is the compiled form of a procedure body, or of a
+# whole program (which is just a procedure that takes no arguments).
+# Besides the instructions and constants it knows the variables it
+# needs a frame for, which is all the machine needs to call it.
+class Code(object):
+
+  def __init__(self, params, body, names, dynamic):
+    self.params, self.body, self.names, self.dynamic = params, body, names, dynamic
+    self.instrs, self.consts = [], []
+    self.bind = binder(params, names, dynamic)
+
+  def __getstate__(self):
+    state = dict(self.__dict__)
+    del state['bind']
+    return state
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    self.bind = binder(self.params, self.names, self.dynamic)
+
+  # Integer, (Integer) -> Integer
+  def emit(self, op, arg=0):
+    ''' Add an instruction and return where it is. '''
+
+    self.instrs += [op, arg]
+    return len(self.instrs) - 2
+
+  # Object -> Integer
+  def constant(self, value):
+    ''' Add a value to the constant pool and return its position. '''
+
+    self.consts.append(value)
+    return len(self.consts) - 1
+
+  # Integer -> None
+  def patch(self, at):
+    ''' Point the jump at `at` to the next instruction. '''
+
+    self.instrs[at + 1] = len(self.instrs)
+
+# A `VMClosure` is a compiled procedure paired with the frame it was
+# created in. Calling it from python runs it on a new machine.
+class VMClosure(object):
+  def __init__(self, code, env):
+    self.code, self.env = code, env
+    self.params, self.body = code.params, code.body
+
+  def __call__(self, *args):
+    return run(self.code, self.code.bind(args, self.env))
+
+### Compiler
+# Node -> Code
+def compile_program(expr):
+  ''' Compile an expanded top-level expression. '''
+
+  code = Code([], expr, (), True)
+  compile_expr(expr, code, None, True)
+  code.emit(RETURN)
+  return code
+
+# Node, Code, Scope, Boolean -> None
+def compile_expr(expr, code, scope, tail=False):
+  ''' Emit the instructions that leave the value of expr on the stack.
+  When `tail` is true, calls are emitted as tail calls. '''
+
+  kind = type(expr)
+
+  # variable reference
+  if kind is Ref:
+    depth, index = resolve(expr.var, scope)
+    if index is None:
+      code.emit(NAME, code.constant((depth, InlineCache(expr.var))))
+    elif not scope_at(scope, depth).is_param(index):
+      code.emit(LOCAL_CHECKED, code.constant((depth, index, expr.var)))
+    elif depth == 0:
+      code.emit(LOCAL0, index)
+    elif depth == 1:
+      code.emit(LOCAL1, index)
+    else:
+      code.emit(LOCAL, code.constant((depth, index)))
+
+  # constant literal, (quote subexpr)
+  elif kind is Const:
+    code.emit(CONST, code.constant(expr.value))
+
+  # (if test conseq alt)
+  elif kind is If:
+    compile_expr(expr.test, code, scope)
+    to_alt = code.emit(JUMP_IF_FALSE)
+    compile_expr(expr.conseq, code, scope, tail)
+    to_end = code.emit(JUMP)
+    code.patch(to_alt)
+    compile_expr(expr.alt, code, scope, tail)
+    code.patch(to_end)
+
+  # (set! var expr)
+  elif kind is Set:
+    compile_expr(expr.value, code, scope)
+    depth, index = resolve(expr.var, scope)
+    if index is None:
+      code.emit(SET_NAME, code.constant((depth, expr.var)))
+    else:
+      code.emit(SET_LOCAL, code.constant((depth, index, expr.var)))
+    code.emit(CONST, code.constant(None))
+
+  # (def var expr)
+  elif kind is Def:
+    compile_expr(expr.value, code, scope)
+    if scope is None or scope.dynamic:
+      code.emit(DEF_NAME, code.constant(expr.var))
+    elif expr.var in scope.names:
+      code.emit(DEF_LOCAL, scope.names.index(expr.var))
+    else:
+      raise SyntaxError(gazellestr(expr) +
+        ': definition was not visible when its procedure was compiled')
+    code.emit(CONST, code.constant(None))
+
+  # (lambda (var*) expr)
+  elif kind is Lambda:
+    params, body = expr.params, expr.body
+    inner = Scope(params, body, scope)
+    proc = Code(params, body, inner.names, inner.dynamic)
+    compile_expr(body, proc, inner, True)
+    proc.emit(RETURN)
+    code.emit(CLOSURE, code.constant(proc))
+
+  # (begin expr+)
+  elif kind is Begin:
+    for subexpr in expr.body[:-1]:
+      compile_expr(subexpr, code, scope)
+      code.emit(POP)
+    compile_expr(expr.body[-1], code, scope, tail)
+
+  # (display expr), (check-expect expr expected), ...
+  elif kind is Primitive:
+    compile_args(expr.args, code, scope)
+    code.emit(PRIMITIVE, code.constant((expr.proc, len(expr.args))))
+
+  # (include "filepath")
+  elif kind is Include:
+    code.emit(INCLUDE, code.constant(compile_program(expr.program)))
+
+  # (stdlib)
+  elif kind is Stdlib:
+    code.emit(STDLIB, code.constant(compile_program(expr.program)))
+
+  # (import name)
+  elif kind is Import:
+    code.emit(IMPORT, code.constant(expr))
+
+  # (provide var...)
+  elif kind is Provide:
+    code.emit(CONST, code.constant(None))
+
+  # (while cond body)
+  elif kind is While:
+    start = len(code.instrs)
+    compile_expr(expr.test, code, scope)
+    to_end = code.emit(JUMP_IF_FALSE)
+    compile_expr(expr.body, code, scope)
+    code.emit(POP)
+    code.emit(JUMP, start)
+    code.patch(to_end)
+    code.emit(CONST, code.constant(None))
+
+  # (proc expr*)
+  elif kind is App:
+    compile_expr(expr.proc, code, scope)
+    compile_args(expr.args, code, scope)
+
+    # (+ a b), (< a b), ...: see `binary` in `stdenv.py`
+    if type(expr.proc) is Ref and len(expr.args) == 2 and \
+        resolve(expr.proc.var, scope)[1] is None:
+      fast = fast_path(expr.proc.var)
+      if fast is not None:
+        code.emit(BINARY, code.constant(fast))
+
+    code.emit(TAIL_CALL if tail else CALL, len(expr.args))
+
+  # anything else is a value already
+  else:
+    code.emit(CONST, code.constant(expr))
+
+# [Node], Code, Scope -> None
+def compile_args(exprs, code, scope):
+  ''' Emit each expression in order, leaving all of their values. '''
+
+  for subexpr in exprs:
+    compile_expr(subexpr, code, scope)
+
+### Interpreter
+# Environment or Frame, Integer -> Environment or Frame
+def outwards(env, depth):
+  ''' Follow `outer` depth times. '''
+
+  for _ in range(depth):
+    env = env.outer
+  return env
+
+# Code, Environment or Frame -> Evaluated Gazelle expression
+def run(code, env):
+  ''' Run compiled code in a frame until it returns. '''
+
+  stack, frames = [], []
+  push, pop = stack.append, stack.pop
+  instrs, consts, pc = code.instrs, code.consts, 0
+
+  while True:
+    op, arg = instrs[pc], instrs[pc + 1]
+    pc += 2
+
+    if op == LOCAL0:
+      push(env.values[arg])
+
+    elif op == CONST:
+      push(consts[arg])
+
+    elif op == NAME:
+      depth, cache = consts[arg]
+      scope = env
+      while depth:
+        scope, depth = scope.outer, depth - 1
+      if scope is cache.env and cache.version == Environment.version:
+        push(cache.cell.value)
+      else:
+        push(cache.lookup(scope))
+
+    elif op == CALL or op == TAIL_CALL:
+      if arg:
+        args = stack[-arg:]
+        del stack[-arg:]
+      else:
+        args = ()
+      proc = pop()
+
+      if type(proc) is VMClosure:
+        if op == CALL:
+          frames.append((code, pc, env))
+        code = proc.code
+        env = code.bind(args, proc.env)
+        instrs, consts, pc = code.instrs, code.consts, 0
+        continue
+
+      push(proc(*args))
+
+      # A tail call to a builtin returns its result right away
+      if op == TAIL_CALL:
+        if not frames:
+          return pop()
+        code, pc, env = frames.pop()
+        instrs, consts = code.instrs, code.consts
+
+    elif op == BINARY:
+      builtin, binary = consts[arg]
+      if stack[-3] is builtin:
+        b, a = pop(), pop()
+        stack[-1] = binary(a, b)
+        pc += 2
+
+    elif op == JUMP_IF_FALSE:
+      if not pop():
+        pc = arg
+
+    elif op == RETURN:
+      if not frames:
+        return pop()
+      code, pc, env = frames.pop()
+      instrs, consts = code.instrs, code.consts
+
+    elif op == LOCAL1:
+      push(env.outer.values[arg])
+
+    elif op == JUMP:
+      pc = arg
+
+    elif op == POP:
+      pop()
+
+    elif op == LOCAL:
+      depth, index = consts[arg]
+      push(outwards(env, depth).values[index])
+
+    elif op == LOCAL_CHECKED:
+      depth, index, var = consts[arg]
+      frame = outwards(env, depth)
+      value = frame.values[index]
+      push(frame.outer.find(var)[var] if value is unbound else value)
+
+    elif op == SET_LOCAL:
+      depth, index, var = consts[arg]
+      frame = outwards(env, depth)
+      if frame.values[index] is unbound:
+        frame.outer.find(var)[var] = pop()
+      else:
+        frame.values[index] = pop()
+
+    elif op == SET_NAME:
+      depth, var = consts[arg]
+      outwards(env, depth).find(var)[var] = pop()
+
+    elif op == DEF_LOCAL:
+      env.values[arg] = pop()
+
+    elif op == DEF_NAME:
+      env[consts[arg]] = pop()
+
+    elif op == CLOSURE:
+      push(VMClosure(consts[arg], env))
+
+    elif op == PRIMITIVE:
+      proc, count = consts[arg]
+      args = stack[-count:]
+      del stack[-count:]
+      push(proc(*args))
+
+    elif op == INCLUDE:
+      push(run(consts[arg], env))
+
+    elif op == STDLIB:
+      run(consts[arg], env)
+      push(None)
+
+    elif op == IMPORT:
+      modules.link(consts[arg], env, execute)
+      push(None)
+
+    else:
+      raise RuntimeError('unknown opcode %s' % op)
+
+### Serialization
+# Compiled programs can be saved and loaded again later without going
+# through the atomizer, expander or compiler.
+
+MAGIC = b'GZLVM4\n'
+
+# Code, File -> None
+def dump(code, file):
+  ''' Write compiled code to a binary file. '''
+
+  file.write(MAGIC)
+  pickle.dump(code, file, pickle.HIGHEST_PROTOCOL)
+
+# File -> Code
+def load(file):
+  ''' Read compiled code written by `dump()`. '''
+
+  if file.read(len(MAGIC)) != MAGIC:
+    raise ValueError('not a compiled gazelle program')
+  return pickle.load(file)
+
+# Code -> String
+def disassemble(code):
+  ''' A readable listing of compiled code, including nested procedures. '''
+
+  lines, nested = [], []
+  for pc in range(0, len(code.instrs), 2):
+    op, arg = code.instrs[pc], code.instrs[pc + 1]
+    line = '%4d %-14s %d' % (pc, opnames[op], arg)
+    if op in (CONST, LOCAL, LOCAL_CHECKED, NAME, SET_LOCAL, SET_NAME, DEF_NAME):
+      line += ' (' + gazellestr(code.consts[arg]) + ')'
+    elif op == PRIMITIVE:
+      line += ' (' + code.consts[arg][0].__name__ + ')'
+    elif op == CLOSURE:
+      nested.append(code.consts[arg])
+    lines.append(line)
+
+  for proc in nested:
+    lines.append('')
+    lines.append('lambda ' + gazellestr(proc.params) + ':')
+    lines.append(disassemble(proc))
+
+  return '\n'.join(lines)
+
+### execute
+# Node -> Evaluated Gazelle expression
+def execute(expr, env=global_env):
+  ''' Compile an expression, then run it in an environment. '''
+
+  return run(compile_program(expr), env)
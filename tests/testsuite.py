@@ -1,11 +1,39 @@
 import sys
 sys.dont_write_bytecode = True
 
+from gazelle.analyze import aeval
+from gazelle.cek import cekeval
 from gazelle.parseval import gazeval, parse
+import gazelle.parseval as parseval
+import gazelle.modules as modules
+import gazelle.batch as batch
+import gazelle.image as image
+import gazelle.parallel as parallel
+from gazelle.profiler import Profiler
+import gazelle.optimizer as optimizer
+import gazelle.transpile as transpile
+import gazelle.tasks as tasks
+from gazelle.nodes import Const, Ref, Begin, App, Primitive, Import
+from gazelle.env import Environment
+from gazelle.stdenv import global_env, display
+from gazelle.vm import execute
+import gazelle.vm as vm
 from gazelle.atomizer import Atomizer
+from gazelle.sym import eof, Sym
 import gazelle.repl as repl
 
+import glob
+import io
+import os
 import pytest
+import subprocess
+import time
+
+# Programs loaded by the tests are cached somewhere that goes away
+# afterwards, rather than in the user's cache
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+  monkeypatch.setenv('GAZELLE_CACHE_DIR', str(tmp_path / 'gazelle-cache'))
 
 # Test builtin procedures
 builtins_test = [
@@ -232,6 +260,12 @@ stdenv_tests = [
   # cons
   ('(cons \'(1) \'(2))', [[1], 2]),
   ('(cons \'(1) 2)', TypeError),
+  ('(cons 1 (cdr \'(1 2 3)))', [1, 2, 3]),
+  ('(cdr (cons 1 (cdr \'(1 2 3))))', [2, 3]),
+  ('(length (cons 1 (cdr \'(1 2 3))))', 3),
+  ('(list? (cons 1 \'()))', True),
+  ('(list? (cdr \'(1 2 3)))', True),
+  ('(append (cdr \'(1 2)) (cons 3 \'()))', [2, 3]),
   # filter
   ('''(begin
     (def fib \'(0 1 1 2 3 5 8 13 21 34 55 89 144 233 377 610 987 1597 2584 4181 6765 10946 17711 28657 46368 75025 121393 196418 317811 514229 832040 1346269 2178309 3524578))
@@ -331,6 +365,20 @@ stdlib_tests = [
   ('(nil? \'())', True),
   ('(= nil \'())', True),
   ('(reverse \'(1 2 3))', [3, 2, 1]),
+  ('(foldr cons \'() (cons 1 (cdr \'(1 2 3))))', [1, 2, 3]),
+]
+
+# Test variable scoping, shadowing and closures
+scope_tests = [
+  ('(def (counter n) (\\ () (set! n (+ n 1)) n))', None),
+  ('(def tick (counter 0))', None),
+  ('(tick)', 1), ('(tick)', 2),
+  ('(def shadowed 5)', None),
+  ('((\\ () (def before shadowed) (def shadowed 7) (+ before shadowed)))', 12),
+  ('shadowed', 5),
+  ('((\\ (x) ((\\ (y) ((\\ (z) (+ x y z)) 3)) 2)) 1)', 6),
+  ('((\\ args args) 1 2 3)', [1, 2, 3]),
+  ('((\\ () (include "./example/euler/one.gel") ans))', 233168),
 ]
 
 # Test syntax by throwing errors
@@ -364,6 +412,7 @@ suites = [
   (macro_tests, 'Macro'),
   (operator_tests, 'Operator'),
   (proc_tests, 'Procedure'),
+  (scope_tests, 'Scope'),
   (stdenv_tests, 'Standard Environment'),
   (stdlib_tests, 'Standard Library'),
   (syntax_tests, 'Syntax'),
@@ -372,9 +421,10 @@ suites = [
 
 ### Tests
 
-def test_integration():
+def integrate(evaluate):
   ''' Test each test case in all suites to 
-  see if Gazelle code is being properly interpreted. '''
+  see if Gazelle code is being properly interpreted
+  by the evaluator `evaluate`. '''
 
   # Iterate over each test in all suites
   for suite in suites:
@@ -392,7 +442,7 @@ def test_integration():
         # strings.
 
         print('> ' + expr + ' == ' + str(expected))
-        result = gazeval(parse(expr))
+        result = evaluate(parse(expr))
         print('>> got ' + str(result))
 
         assert result == expected
@@ -409,8 +459,667 @@ def test_integration():
           # This will be called when you know you really messed up
           raise e
 
+def test_integration():
+  integrate(gazeval)
+
+def test_integration_closure():
+  integrate(aeval)
+
+def test_integration_vm():
+  integrate(execute)
+
+def test_integration_cek():
+  integrate(cekeval)
+
+def test_cek_recursion():
+  ''' The CEK machine should handle recursion well past python's
+  recursion limit, including through `map` and `call/cc`. '''
+
+  depth = sys.getrecursionlimit() * 5
+  cekeval(parse('(stdlib)'))
+  cekeval(parse('(def (depth n) (if (= n 0) 0 (+ 1 (depth (- n 1)))))'))
+  assert cekeval(parse('(depth %d)' % depth)) == depth
+  assert cekeval(parse('(car (map depth (list %d)))' % depth)) == depth
+  assert cekeval(parse('(foldr + 0 (range %d))' % depth)) == sum(range(depth))
+  assert cekeval(parse('(+ 1 (call/cc (\\ (k) (+ 10 (k (depth %d))))))' % depth)) == depth + 1
+
+def test_cek_collecting():
+  ''' The CEK machine should collect the values of a map, filter or
+  call in time proportional to how many there are, and a continuation
+  resumed more than once should start from what had been collected
+  when it was captured each time. '''
+
+  def seconds(n):
+    program = parse('(length (filter (\\ (x) #t) (map (\\ (x) x) (range %d))))' % n)
+    start = time.perf_counter()
+    assert cekeval(program, Environment(outer=global_env)) == n
+    return time.perf_counter() - start
+
+  # Sixteen times as many values would take 256 times as long if
+  # collecting them was quadratic
+  assert seconds(80000) < min(seconds(5000) for _ in range(3)) * 64
+
+  assert cekeval(parse('''(begin
+    (def k #f)
+    (def n 0)
+    (def xs (map (\\ (x) (if (= x 2) (call/cc (\\ (c) (set! k c) x)) x)) (list 1 2 3)))
+    (set! n (+ n 1))
+    (if (< n 3) (k (* n 10)) xs))'''), Environment(outer=global_env)) == [1, 20, 3]
+
+def test_builtin_arity():
+  ''' Builtins that the CEK machine runs itself should raise the same
+  errors as everywhere else when they're given the wrong number
+  of arguments. '''
+
+  for expr in ("(map + '(1 2) '(3 4))", "(filter +)", "(apply + '(1) '(2))",
+      "(call/cc (\\ (k) (k)))", "(call/cc (\\ (k) (k 1 2)))"):
+    for evaluate in (gazeval, aeval, execute, cekeval):
+      with pytest.raises(TypeError):
+        evaluate(parse(expr), Environment(outer=global_env))
+
+def test_long_lists():
+  ''' cons, car and cdr shouldn't copy, so walking a long list
+  with them should take linear time. '''
+
+  aeval(parse('(stdlib)'))
+  assert aeval(parse('(length (reverse (range 100000)))')) == 100000
+  assert aeval(parse('(foldl + 0 (range 100000))')) == sum(range(100000))
+
+def test_vm_serialize():
+  ''' Compiled programs should run the same after a round trip through
+  `dump()` and `load()`, and non-tail recursion shouldn't need the
+  python stack. '''
+
+  code = vm.compile_program(parse('''(begin
+    (def (depth n) (if (= n 0) 0 (+ 1 (depth (- n 1)))))
+    (depth 20000))'''))
+  saved = io.BytesIO()
+  vm.dump(code, saved)
+  saved.seek(0)
+  assert vm.run(vm.load(saved), vm.global_env) == 20000
+
+def test_atomizer_chunks():
+  ''' Tokens and strings that are split across the chunks the
+  atomizer reads should come out the same as when they aren't. '''
+
+  source = '(list 12 -3.5 .5 1e3 2j foo "a (b)\n c" ; comment\n \'(x))'
+  expected = Atomizer(io.StringIO(source)).read()
+  assert expected == [Sym('list'), 12, -3.5, 0.5, 1000.0, 2j, Sym('foo'),
+    'a (b)\n c', [Sym('quote'), [Sym('x')]]]
+  for size in range(1, 8):
+    assert Atomizer(io.StringIO(source), chunk_size=size).read() == expected
+
+  with pytest.raises(SyntaxError):
+    Atomizer(io.StringIO('(display "oops)'), chunk_size=4).read()
+
+def test_expand_once(monkeypatch):
+  ''' Macros are expanded once before a program runs, however many
+  times the code they were used in is evaluated. '''
+
+  calls = []
+  def double(x):
+    calls.append(x)
+    return [Sym('*'), 2, x]
+  monkeypatch.setitem(parseval.macro_table, Sym('double'), double)
+
+  program = parse('''(begin (def i 0) (def total 0)
+    (while (< i 10)
+      (begin (set! i (+ i 1)) (set! total (+ total (double i)))))
+    total)''')
+  for evaluate in (gazeval, aeval, execute, cekeval):
+    assert evaluate(program) == 110
+  assert len(calls) == 1
+
+def test_nodes():
+  ''' Expanded expressions know which line they came from, and can't
+  be changed. '''
+
+  program = parse('(begin\n  (display "a")\n  (if #t\n    2))')
+  assert [node.line for node in program.body] == [2, 3]
+  with pytest.raises(AttributeError):
+    program.body = ()
+
+def test_modules(tmp_path, monkeypatch, capsys):
+  ''' A module should be run once no matter how many times or by which
+  evaluator it's imported, and only bind what it provides. '''
+
+  monkeypatch.setenv('GAZELLE_PATH', str(tmp_path))
+  monkeypatch.setattr(modules, 'registry', {})
+  (tmp_path / 'shapes.gel').write_text('''(begin
+    (provide square area)
+    (display "loading shapes")
+    (def (square x) (* x x))
+    (def (area r) (* 3 (square r)))
+    (def shapes-secret 42))''')
+
+  program = parse('(begin (import shapes) (import "shapes.gel") (area (square 2)))')
+  for evaluate in (gazeval, aeval, execute, cekeval):
+    env = Environment(outer=global_env)
+    assert evaluate(program, env) == 48
+    assert 'shapes-secret' not in env
+  assert capsys.readouterr().out.count('loading shapes') == 1
+
+  with pytest.raises(ImportError):
+    parse('(import no-such-module)')
+
+def test_macro_cache(monkeypatch):
+  ''' The same macro call should only be expanded once, until a new
+  macro is defined. '''
+
+  monkeypatch.setattr(parseval, 'macro_table', dict(parseval.macro_table))
+  monkeypatch.setattr(parseval, 'macro_stats', parseval.collections.defaultdict(parseval.MacroStats))
+  parseval.forget_expansions()
+
+  calls = []
+  def swap(a, b):
+    calls.append((a, b))
+    return [Sym('list'), b, a]
+  parseval.macro_table[Sym('swap')] = swap
+
+  program = parse('(list (swap 1 2) (swap 1 2) (swap 1.0 2) (swap "x" x))')
+  assert len(calls) == 3
+  assert gazeval(program, Environment([Sym('x')], [5], global_env)) == [[2, 1], [2, 1], [2, 1.0], [5, 'x']]
+  assert parseval.macro_stats[Sym('swap')].count == 4
+  assert parseval.macro_stats[Sym('swap')].hits == 1
+
+  parse('(begin (macro noop (\\ () 0)) (swap 1 2))')
+  assert len(calls) == 4
+
+def test_binary_fast_paths():
+  ''' Two-argument arithmetic should give the same answers as the
+  builtins, and stop being used once they are rebound. '''
+
+  for evaluate in (aeval, execute):
+    assert evaluate(parse('(list (+ 1 2) (- 1 2.5) (* 2 3) (/ 1 2) (// 7 2) (% 7 2) (< 1 2))')) \
+      == [3, -1.5, 6, 0.5, 3, 1, True]
+    with pytest.raises(TypeError):
+      evaluate(parse('(+ "string" "string")'))
+
+    env = Environment(outer=global_env)
+    assert evaluate(parse('(begin (def (f x) (+ x 1)) (def + -) (f 1))'), env) == 0
+
+def test_inline_caches():
+  ''' Variables read through a cell should see every `def` and `set!`
+  made after they were first read, including ones that hide them. '''
+
+  program = parse('''(begin
+    (def n 1)
+    (def f (\\ () (list n (abs -1))))
+    (def before (f))
+    (set! n 2)
+    (def after-set (f))
+    (def abs (\\ (x) 'mine))
+    (list before after-set (f)))''')
+  for evaluate in (aeval, execute):
+    env = Environment(outer=global_env)
+    assert evaluate(program, env) == [[1, 1], [2, 1], [2, 'mine']]
+
+    del env['abs']
+    env['n'] = 3
+    assert evaluate(parse('(f)'), env) == [3, 1]
+
+def test_optimizer(monkeypatch):
+  ''' Programs should be simplified without changing what they do, and
+  left alone where a builtin they'd use has been rebound. '''
+
+  assert parse('(* 60 60 24)') == Const(86400)
+  assert parse('(if (> 1 2) (display 1) (begin (begin 1 (display 2)) 3))') == \
+    Begin((Primitive(Sym('display'), display, (Const(2),)), Const(3)))
+  assert parse('`(a ,b (c ,@d) e)') == App(Ref('list'), (Const('a'), Ref('b'),
+    App(Ref('append'), (App(Ref('list'), (Const('c'),)), Ref('d'))), Const('e')))
+  assert parse('(/ 1 0)') == App(Ref('/'), (Const(1), Const(0)))
+  assert type(parse('(begin (def (f +) (+ 1 2)) (f -))').body[0].value.body) is App
+
+  # Nothing too big is made while parsing
+  assert parse('(<< 1 4000000000)') == App(Ref('<<'), (Const(1), Const(4000000000)))
+  assert type(parse('(* "ab" 100000)')) is App and type(parse('(factorial 1000)')) is App
+  assert type(parse('(* (<< 1 300) (<< 1 300))')) is App and parse('(<< 1 64)') == Const(1 << 64)
+  assert type(parse('(% "%0100000000d" 1)')) is App and parse('(% 7 4)') == Const(3)
+
+  program = '''(begin
+    (def b '(1 2))
+    (list `(a ,@b) `(,@b ,@b c) `(x (y ,(+ 1 2))) (if (= 1 1) 'yes 'no)))'''
+  expected = [['a', 1, 2], [1, 2, 1, 2, 'c'], ['x', ['y', 3]], 'yes']
+  for enabled in (True, False):
+    monkeypatch.setattr(optimizer, 'enabled', enabled)
+    for evaluate in (gazeval, aeval, execute, cekeval):
+      assert evaluate(parse(program), Environment(outer=global_env)) == expected
+
+  monkeypatch.setattr(optimizer, 'enabled', False)
+  assert parse('(* 60 60 24)') == App(Ref('*'), (Const(60), Const(60), Const(24)))
+
+def test_optimizer_cache(tmp_path):
+  ''' A cached program whose calls to a builtin were folded shouldn't be
+  used once a file run before it has redefined that builtin. '''
+
+  (tmp_path / 'a.gel').write_text('(def + -)')
+  (tmp_path / 'b.gel').write_text('(display (+ 5 2))')
+  env = dict(os.environ, GAZELLE_CACHE_DIR=str(tmp_path / 'cache'))
+  def run(*names):
+    return subprocess.check_output([sys.executable, 'gazelle.py'] +
+      [str(tmp_path / name) for name in names], env=env, universal_newlines=True).split()
+
+  assert run('b.gel') == ['7']
+  assert run('a.gel', 'b.gel') == ['3']
+  assert run('b.gel') == ['7']
+
+def test_vectors():
+  ''' Vectors should do arithmetic, masks and reductions on every
+  evaluator, and print as `#v(...)`. '''
+
+  pytest.importorskip('numpy')
+  program = parse('''(begin
+    (def v (vector-range 1000))
+    (list
+      (vector-sum (vector-select (or (= (% v 3) 0) (= (% v 5) 0)) v))
+      (dot (vector 1 2 3) '(4 5 6))
+      (vector->list (* 2 (list->vector '(1 2 3))))
+      (vector-ref (vector-sqrt (vector 4 9)) 1)))''')
+  for evaluate in (gazeval, aeval, execute, cekeval):
+    assert evaluate(program, Environment(outer=global_env)) == [233168, 32, [2, 4, 6], 3.0]
+  assert repl.gazellestr(gazeval(parse('(< (vector 1 2 3) 2)'))) == '#v(#t #f #f)'
+
+def test_memoize():
+  ''' A memoized procedure should only be called once for each argument
+  it's remembering, and forget the least recently used ones first. '''
+
+  program = parse('''(begin
+    (def calls 0)
+    (def-memo fib (\\ (n) (begin (set! calls (+ calls 1))
+      (if (< n 2) n (+ (fib (- n 1)) (fib (- n 2)))))))
+    (def sq (memoize (\\ (x) (* x x)) 2))
+    (def len (memoize length))
+    (list (fib 60) calls
+      (map sq '(1 2 1 3 2 1))
+      (ref (memo-stats sq) 'hits) (ref (memo-stats sq) 'evictions) (ref (memo-stats sq) 'size)
+      (len '(1 2)) (len (list 1 2)) (len (table 1 2))
+      (ref (memo-stats len) 'hits) (ref (memo-stats len) 'size) (memoized? fib)))''')
+  for evaluate in (gazeval, aeval, execute, cekeval):
+    result = evaluate(program, Environment(outer=global_env))
+    assert result[:2] == [1548008755920, 61]
+    assert result[2:6] == [[1, 4, 1, 9, 4, 1], 1, 3, 2]
+    assert result[6:] == [2, 2, 1, 1, 1, True]
+
+  # The same procedure definition as `def`
+  program = parse('''(begin
+    (def-memo (fib n) (if (< n 2) n (+ (fib (- n 1)) (fib (- n 2)))))
+    (def-memo (two) 2)
+    (list (fib 80) (two) (memoized? fib)))''')
+  for evaluate in (gazeval, aeval, execute, cekeval):
+    assert evaluate(program, Environment(outer=global_env)) == [23416728348467685, 2, True]
+
+  with pytest.raises(SyntaxError):
+    parse('(def-memo fib)')
+
+def test_streams():
+  ''' Stream pipelines should only make the elements that are asked
+  for, and promises should only be evaluated once. '''
+
+  program = parse('''(begin
+    (def evens (stream-filter (\\ (n) (= (% n 2) 0)) (stream-range 1000000000000)))
+    (def forced 0)
+    (def p (delay (begin (set! forced (+ forced 1)) 'done)))
+    (list
+      (stream->list (stream-take 3 (stream-map (\\ (n) (* n n)) evens)))
+      (stream-fold + 0 (stream-take 4 (stream-iterate (\\ (x) (* 2 x)) 1)))
+      (sum (stream '(1 2 3)))
+      (force p) (force p) forced))''')
+  for evaluate in (gazeval, aeval, execute, cekeval):
+    assert evaluate(program, Environment(outer=global_env)) == [[0, 4, 16], 15, 6, 'done', 'done', 1]
+
+def test_tasks():
+  ''' Tasks should wait alongside each other, hand values over through
+  channels and raise what they raised when awaited. '''
+
+  # Every task has to have started before any of them can finish,
+  # so this only ever finishes if they run alongside each other, however
+  # many of them there are
+  n = 100
+  program = parse('''(begin
+    (def started (channel))
+    (def gate (channel))
+    (def worker (\\ (n) (begin (sleep 0.01) (send! started n) (receive gate) (* n n))))
+    (def tasks (map (\\ (n) (spawn worker n)) (range %d)))
+    (def arrived (map (\\ (i) (receive started)) (range %d)))
+    (map (\\ (i) (send! gate #t)) (range %d))
+    (def ch (channel 1))
+    (def produce (\\ (i) (if (< i 3) (begin (send! ch i) (produce (+ i 1))) (close! ch))))
+    (def producer (spawn produce 0))
+    (def drain (\\ (acc) (begin (def x (receive ch)) (if (eof? x) acc (drain (cons x acc))))))
+    (list (map await tasks) (length arrived)
+      (drain '()) (eof? (receive ch)) (task? producer) (await 'x)))''' % (n, n, n))
+  for evaluate in (gazeval, aeval, execute, cekeval):
+    assert evaluate(program, Environment(outer=global_env)) == \
+      [[i * i for i in range(n)], n, [2, 1, 0], True, True, 'x']
+
+  # A channel holds `channel_size` values unless it's told otherwise,
+  # and always holds at least one
+  assert gazeval(parse('''(begin
+    (def ch (channel))
+    (map (\\ (i) (send! ch i)) (range %d))
+    (receive ch))''' % tasks.channel_size), Environment(outer=global_env)) == 0
+  with pytest.raises(ValueError):
+    gazeval(parse('(channel 0)'), Environment(outer=global_env))
+
+  with pytest.raises(ValueError):
+    gazeval(parse('(begin (def ch (channel)) (close! ch) (await (spawn send! ch 1)))'),
+      Environment(outer=global_env))
+
+def test_containers():
+  ''' Tables, sets and arrays should be changed in place by `put!` and
+  `delete!`, and print in a way that shows what they are. '''
+
+  program = parse('''(begin
+    (def t (table 'a 1 "b" 2))
+    (def s (set 1 2 2))
+    (def a (make-array 3 0))
+    (put! t 'c 3) (delete! t "b")
+    (put! s 3) (delete! s 1)
+    (put! a 1 'x)
+    (list (ref t 'c) (ref t 'z #f) (has? t "b") (has? s 3) (has? s 1)
+      (ref a 1) (has? a 3) (length a) (car a) t s a))''')
+  for evaluate in (gazeval, aeval, execute, cekeval):
+    result = evaluate(program, Environment(outer=global_env))
+    assert result[:9] == [3, False, False, True, False, 'x', False, 3, 0]
+    assert [repl.gazellestr(x) for x in result[9:]] == ['#table((a 1) (c 3))', '#set(2 3)', '#(0 x 0)']
+
+  # Lists made from an array by cons and cdr see it change length
+  program = parse('''(begin
+    (def a (array 1 2 3 4))
+    (def p (cons 0 a))
+    (def q (cons -1 (cdr (cdr (cdr a)))))
+    (delete! a 0) (delete! a 0)
+    (list (length p) p (length (cdr p)) (length q) q))''')
+  for evaluate in (gazeval, aeval, execute, cekeval):
+    result = evaluate(program, Environment(outer=global_env))
+    assert result == [3, [0, 3, 4], 2, 1, [-1]]
+
+def test_profiler(monkeypatch):
+  ''' The profiler should count calls to procedures by name, tail calls
+  and builtins, and keep the stacks they were called from. '''
+
+  profile = Profiler(global_env)
+  monkeypatch.setattr(parseval, 'profile', profile)
+  program = parse('''(begin
+    (def (fib n) (if (< n 2) n (+ (fib (- n 1)) (fib (- n 2)))))
+    (def (count-down i) (if (= i 0) 'done (count-down (- i 1))))
+    (list (fib 10) (count-down 100) (map (\\ (x) (fib x)) '(1 2))))''')
+  assert gazeval(program, Environment(outer=global_env)) == [55, 'done', [1, 1]]
+
+  fib, count_down = profile.stats['fib'], profile.stats['count-down']
+  assert (fib.calls, fib.tail_calls) == (181, 2)
+  assert (count_down.calls, count_down.tail_calls) == (101, 100)
+  assert profile.stats['<'].calls == 181
+  assert 0 <= fib.own <= fib.inclusive
+  assert not profile.frames
+
+  stacks = profile.collapsed().splitlines()
+  assert any(line.startswith('fib;fib;+ ') for line in stacks)
+  # The lambda's tail call to fib takes its place
+  assert any(line.startswith('map;fib ') for line in stacks)
+  assert 'count-down' in profile.report()
+
+@pytest.mark.parametrize('name, answer', [
+  ('fib', 2584), ('tak', 3), ('nqueens', 4), ('collatz', 59431), ('folds', 13334000)])
+def test_benchmark_programs(name, answer):
+  ''' The programs in `benchmarks/` should give the same answer on every
+  evaluator, so that they're measuring the same thing. '''
+
+  program = parseval.load('./benchmarks/%s.gel' % name)
+  for evaluate in (gazeval, aeval, execute, cekeval):
+    assert evaluate(program, Environment(outer=global_env)) == answer
+
+def test_pmap(monkeypatch):
+  ''' Procedures from every evaluator should be sent to worker processes
+  with what they refer to, and their results come back in order. '''
+
+  monkeypatch.setattr(parallel, 'processes', 2)
+  program = parse('''(begin
+    (def offset 100)
+    (def (f n)
+      (begin
+        (def (count k) (if (= k 0) 0 (+ 1 (count (- k 1)))))
+        (+ offset (count n))))
+    (list (pmap f (range 10) 3) (pmap car '((1 2) (3 4))) (pfor-each f '(1 2))))''')
+  for evaluate in (gazeval, aeval, execute, cekeval):
+    env = Environment(outer=global_env)
+    assert evaluate(program, env) == [list(range(100, 110)), [1, 3], None]
+
+    # A procedure that refers to itself survives the trip
+    f = parallel.loads(parallel.dumps(env[Sym('f')], True))
+    assert f(5) == 105
+
+  # Only the globals a procedure refers to are sent, and long lists
+  # built with cons don't need a deep stack to send
+  gazeval(parse('(stdlib)'))
+  monkeypatch.setitem(global_env, Sym('big'), gazeval(parse('(reverse (range 100000))')))
+  monkeypatch.setitem(global_env, Sym('step'), 3)
+  monkeypatch.setitem(global_env, Sym('g'), gazeval(parse('(\\ (n) (* n step))')))
+  sent = dict(parallel.loads(parallel.dumps_globals(global_env[Sym('g')])))
+  assert sorted(sent) == ['step']
+  assert gazeval(parse('(pmap g (range 4))')) == [0, 3, 6, 9]
+  assert gazeval(parse('(pmap (\\ (x) (length big)) (range 2))')) == [100000, 100000]
+
+  # parallel can be imported before anything else
+  subprocess.check_call([sys.executable, '-c', 'import gazelle.parallel'])
+
+def test_batch(tmp_path):
+  ''' Files run with `--jobs` shouldn't see each other's definitions, and
+  each one's output and status should be collected. '''
+
+  (tmp_path / 'define.gel').write_text('(begin (def shared 1) (display "defined"))')
+  (tmp_path / 'use.gel').write_text('(display shared)')
+  paths = [str(tmp_path / 'define.gel'), str(tmp_path / 'use.gel')]
+
+  results = batch.run_files(paths, 2, ['--no-cache'], os.path.abspath('gazelle.py'))
+  assert [result.path for result in results] == paths
+  assert results[0].status == 0 and results[0].output.strip() == 'defined'
+  assert results[1].status != 0 and 'LookupError' in results[1].output
+
+  assert not repl.run_file(paths[1])
+
+def test_repl(monkeypatch, capsys):
+  ''' The REPL should evaluate each expression as soon as it's read,
+  even if it spans lines or shares one, and carry on after errors. '''
+
+  lines = iter(['(def repl-x', '  "a ) b")', '(display repl-x) (+ 1', '2)',
+    '(car 5)', ')', '(display 9)', 'quit', '(display "after quit")'])
+  prompts = []
+  def fake_input(prompt):
+    prompts.append(prompt)
+    return next(lines)
+  monkeypatch.setattr('builtins.input', fake_input)
+
+  repl.run(prompt='gel> ', subprompt='> ')
+  out = capsys.readouterr().out
+  assert prompts == ['gel> ', '   > ', 'gel> ', '   > ', 'gel> ', 'gel> ', 'gel> ', 'gel> ']
+  assert out.count('a ) b') == 1 and '3\n' in out and '9\n' in out
+  assert 'TypeError' in out and 'unexpected )' in out and 'after quit' not in out
+
+def test_repl_batch():
+  ''' `--batch` should evaluate what's piped into it without prompting,
+  and stop with an error status at the first error. '''
+
+  program = ''.join('(def n%d %d)\n' % (i, i) for i in range(2000)) + '(+ n1 n1999)\n'
+  process = subprocess.run([sys.executable, 'gazelle.py', '--batch'], input=program,
+    stdout=subprocess.PIPE, universal_newlines=True)
+  assert process.returncode == 0 and process.stdout == '2000\n'
+
+  process = subprocess.run([sys.executable, 'gazelle.py', '--batch'],
+    input='(display 1)\n(car 5)\n(display 2)\n', stdout=subprocess.PIPE, universal_newlines=True)
+  assert process.returncode == 1
+  assert '1\n' in process.stdout and 'TypeError' in process.stdout and '2\n' not in process.stdout
+
+def test_image(tmp_path):
+  ''' An image should bring back the standard library, and the
+  definitions and macros of the files it was made from. '''
+
+  (tmp_path / 'prelude.gel').write_text('''(begin
+    (def twice (\\ (x) (* 2 x)))
+    (macro unless (\\ (c body) `(if ,c #f ,body))))''')
+  (tmp_path / 'main.gel').write_text('(display (list (twice 4) (unless #f 3) (foldl + 0 (list 1 2 3))))')
+  saved = str(tmp_path / 'prelude.img')
+
+  for engine in ('tree', 'closure'):
+    subprocess.check_call([sys.executable, 'gazelle.py', '-e', engine,
+      '--make-image', saved, str(tmp_path / 'prelude.gel')])
+    output = subprocess.check_output([sys.executable, 'gazelle.py', '-e', 'vm',
+      '--image', saved, str(tmp_path / 'main.gel')], universal_newlines=True)
+    assert output.strip() == '(8 3 6)'
+
+  (tmp_path / 'bad.img').write_bytes(b'not an image')
+  with pytest.raises(ValueError):
+    image.restore(str(tmp_path / 'bad.img'))
+
+def transpiled(program, path='<transpiled>'):
+  ''' Run program as the python module it transpiles to. '''
+
+  module = {'__name__': 'transpiled'}
+  exec(compile(transpile.transpile(program), path, 'exec'), module)
+  return module['main']()
+
+def test_transpile(capsys):
+  ''' The python modules programs transpile to should print and return
+  the same things as the programs do, or raise the same errors. '''
+
+  def outcome(run):
+    try:
+      value = run()
+    except Exception as e:
+      value = type(e)
+    return value, capsys.readouterr().out
+
+  paths = sorted(glob.glob('example/*.gel') + glob.glob('example/euler/*.gel') +
+    glob.glob('benchmarks/*.gel'))
+  assert paths
+  for path in paths:
+    program = parseval.load(path)
+    expected = outcome(lambda: gazeval(program, Environment(outer=global_env)))
+    assert outcome(lambda: transpiled(program, path)) == expected, path
+
+  # Every test case of the suites that doesn't raise, as one program
+  cases = [(expr, expected) for suite, _ in suites for expr, expected in suite
+    if not (isinstance(expected, type) and issubclass(expected, Exception))]
+  program = App(Ref(Sym('list')), tuple(parse(expr) for expr, _ in cases))
+  for (expr, expected), value in zip(cases, transpiled(program)):
+    assert value == expected, expr
+
+  # Tail calls to itself are a loop, and variables used before a
+  # procedure defines them are the ones outside it
+  assert transpiled(parse('''(begin
+    (def (count n acc) (if (= n 0) acc (count (- n 1) (+ acc 1))))
+    (def x 1)
+    (def f (\\ () (def y x) (def x 2) (+ x y)))
+    (list (count 100000 0) (f) x))''')) == [100000, 3, 1]
+
+  # Unless the name might not be the procedure by the time it's called
+  program = parse('''(begin
+    (def (f n) (if (= n 0) 'done (f (- n 1))))
+    (def g f)
+    (def (f n) 'other)
+    (g 3))''')
+  assert transpiled(program) == gazeval(program, Environment(outer=global_env)) == 'other'
+
+  # Or if every call needs its own copies of the body's locals
+  program = parse('''(begin
+    (def x 1)
+    (def (f n acc) (begin
+      (def y x) (def x (+ n 100))
+      (if (= n 0) (+ acc y) (f (- n 1) (+ acc y)))))
+    (f 3 0))''')
+  assert transpiled(program) == gazeval(program, Environment(outer=global_env)) == 4
+
+  # A variable used before it's defined is a LookupError, like it is
+  # for the interpreters
+  for program in ('(begin (def (f n) (begin (def k (if (= n 3) 7 k)) (if (= n 0) k (f (- n 1))))) (f 3))',
+      '(begin (display x) (def x 1))'):
+    program = parse(program)
+    with pytest.raises(LookupError):
+      gazeval(program, Environment(outer=global_env))
+    with pytest.raises(LookupError):
+      transpiled(program)
+
+  with pytest.raises(SyntaxError):
+    transpile.transpile(Import(Sym('shapes'), 'shapes.gel', Const(None), ()))
+
+def test_emit_py(tmp_path):
+  ''' `--emit-py` should write a module that can be run on its own. '''
+
+  path = tmp_path / 'fizz.gel'
+  path.write_text('(begin (stdlib) (display (map (\\ (n) (if (even? n) \'even n)) (range 4))))')
+  subprocess.check_call([sys.executable, 'gazelle.py', '--emit-py', str(path)])
+  output = subprocess.check_output([sys.executable, str(tmp_path / 'fizz.py')],
+    env=dict(os.environ, PYTHONPATH=os.getcwd()), universal_newlines=True)
+  assert output.strip() == '(even 1 even 3)'
+
+def test_include_search(tmp_path, monkeypatch, capsys):
+  ''' An include should look next to the file doing it before the
+  current directory, and a cached program shouldn't be used if one of
+  its includes would now be found somewhere else. '''
+
+  monkeypatch.setenv('GAZELLE_CACHE_DIR', str(tmp_path / 'cache'))
+  for name in ('prog', 'one', 'two'):
+    (tmp_path / name).mkdir()
+  (tmp_path / 'prog' / 'main.gel').write_text('(include "x.gel")')
+  (tmp_path / 'one' / 'x.gel').write_text('(display "one")')
+  (tmp_path / 'two' / 'x.gel').write_text('(display "two")')
+  main = str(tmp_path / 'prog' / 'main.gel')
+
+  for name in ('one', 'two', 'one'):
+    monkeypatch.chdir(tmp_path / name)
+    gazeval(parseval.load(main))
+    assert capsys.readouterr().out == name + '\n'
+
+  (tmp_path / 'prog' / 'x.gel').write_text('(display "prog")')
+  gazeval(parseval.load(main))
+  assert capsys.readouterr().out == 'prog\n'
+
+  # The standard library is found wherever gazelle is run from
+  assert gazeval(parse('(begin (stdlib) (cadr (list 1 2)))'), Environment(outer=global_env)) == 2
+
+def test_load_cache(tmp_path, monkeypatch):
+  ''' A file should only be expanded the first time it's loaded, unless
+  it changes, and loading it from the cache should still define the
+  macros in it. '''
+
+  monkeypatch.setenv('GAZELLE_CACHE_DIR', str(tmp_path / 'cache'))
+  monkeypatch.setattr(parseval, 'macro_table', dict(parseval.macro_table))
+  monkeypatch.setattr(parseval, 'macro_sources', dict(parseval.macro_sources))
+  path = tmp_path / 'lib.gel'
+  path.write_text('(begin (macro twice (\\ (x) `(begin ,x ,x))) (def n 1))')
+
+  expansions = []
+  def counting_parse(path, file=False):
+    expansions.append(path)
+    return parse(path, file)
+  monkeypatch.setattr(parseval, 'parse', counting_parse)
+
+  for _ in range(3):
+    gazeval(parseval.load(str(path)))
+  assert len(expansions) == 1
+  assert parseval.macro_table[Sym('twice')] is not None
+  assert gazeval(parse('(begin (twice (set! n (+ n 1))) n)')) == 3
+
+  path.write_text('(def n 10)')
+  gazeval(parseval.load(str(path)))
+  assert len(expansions) == 2
+  assert gazeval(parse('n')) == 10
+
 ### Benchmarks
 
+def test_bench_tokenizer(benchmark):
+  # A few megabytes of data on long lines, which the
+  # atomizer used to slow down on quadratically
+  line = ' '.join('(%d %d.5 "s%d" sym-%d)' % (i, i, i, i) for i in range(2000))
+  source = '(list ' + '\n'.join([line] * 64) + ')'
+
+  def tokenize():
+    atomizer = Atomizer(io.StringIO(source))
+    while atomizer.next_token() is not eof:
+      pass
+  benchmark.pedantic(tokenize, rounds=3)
+
+
 def test_bench_fizzbuzz(benchmark):
   def fizzbuzz():
     gazeval(Atomizer(open('./example/fizzbuzz.gel')))
@@ -431,5 +1140,25 @@ def test_bench_euler_three(benchmark):
     gazeval(Atomizer(open('./example/euler/three.gel')))
   benchmark.pedantic(euler_three, iterations=10, rounds=2000)
   
+# Collatz sequences, which are almost all two-argument arithmetic
+collatz = parse('''(begin
+  (def (steps n count)
+    (if (> n 1)
+      (if (= (% n 2) 0)
+        (steps (// n 2) (+ count 1))
+        (steps (+ 1 (* 3 n)) (+ count 1)))
+      count))
+  (def total 0)
+  (def i 1)
+  (while (< i 500)
+    (begin (set! total (+ total (steps i 0))) (set! i (+ i 1))))
+  total)''')
+
+def test_bench_arithmetic_closure(benchmark):
+  assert benchmark(aeval, collatz, Environment(outer=global_env)) == 26033
+
+def test_bench_arithmetic_vm(benchmark):
+  assert benchmark(execute, collatz, Environment(outer=global_env)) == 26033
+
 def test_bench_integration(benchmark):
   benchmark(test_integration)
\ No newline at end of file